@@ -0,0 +1,88 @@
+"""
+Measures what the verified-JWT cache saves per request of GET /api/contacts.
+
+    python -m benchmarks.bench_token_cache [requests]
+
+The app runs in process against a temporary sqlite database; the same access token is sent
+with the token cache disabled and enabled, and the mean time of a request and of the
+get_token_claims dependency alone are printed for both.
+"""
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.database.db import get_read_db
+from src.database.models import Base, Contact, Role
+from src.routes import contacts
+from src.services import user_cache
+from src.services.auth import auth_service
+from src.services.rate_limit import Quota
+from src.services.token_cache import access_tokens
+
+
+async def measure(http: httpx.AsyncClient, token: str, requests: int) -> tuple[float, float]:
+    headers = {"Authorization": f"Bearer {token}"}
+    await http.get("/api/contacts/", params={"limit": 10}, headers=headers)
+    start = perf_counter()
+    for _ in range(requests):
+        response = await http.get("/api/contacts/", params={"limit": 10}, headers=headers)
+        assert response.status_code == 200, response.text
+    per_request = (perf_counter() - start) / requests
+    start = perf_counter()
+    for _ in range(requests):
+        await auth_service.get_token_claims(token)
+    per_claims = (perf_counter() - start) / requests
+    return per_request, per_claims
+
+
+async def main(requests: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(Contact.__table__.insert(), [{"first_name": f"Name{number}", "email": f"{number}@example.com"}
+                                                      for number in range(100)])
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+        sessions = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        async def override_get_read_db():
+            async with sessions() as db:
+                yield db
+
+        app.dependency_overrides[get_read_db] = override_get_read_db
+        contacts.rate_limit_get.quotas = {role: Quota(10 ** 9, 1) for role in Role}
+        # keep the user version in the local cache, no Redis is needed
+        user_cache.local_versions.ttl = 3600
+        user_cache.local_versions.set(user_cache.version_key(1), b"0")
+        token = await auth_service.create_access_token(
+            data={"sub": "admin@example.com", "uid": 1, "role": Role.admin.value, "confirmed": True, "ver": 0},
+            expires_delta=3600)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            maxsize, access_tokens.maxsize = access_tokens.maxsize, 0
+            uncached = await measure(http, token, requests)
+            access_tokens.maxsize = maxsize
+            cached = await measure(http, token, requests)
+        await async_engine.dispose()
+
+    print(f"{requests} x GET /api/contacts/?limit=10 with the same access token")
+    print(f"{'':18}{'request, us':>14}{'get_token_claims, us':>24}")
+    for name, (per_request, per_claims) in (("no token cache", uncached), ("token cache", cached)):
+        print(f"{name:18}{per_request * 1e6:>14.1f}{per_claims * 1e6:>24.1f}")
+    print(f"saving per request: {(uncached[0] - cached[0]) * 1e6:.1f} us, "
+          f"get_token_claims {(uncached[1] - cached[1]) * 1e6:.1f} us")
+    print(f"token cache: {access_tokens.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
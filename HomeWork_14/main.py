@@ -1,16 +1,32 @@
+import asyncio
+import os
 import pathlib
 
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi_limiter import FastAPILimiter
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from starlette.middleware.cors import CORSMiddleware
 
-from src.database.db import get_db, redis_db
+from src.conf.config import settings
+from src.database.db import get_db, engine, replica_engine
+from src.database.models import Role
+from src.database.pool import pool_status
+from src.database.query_budget import QueryBudgetMiddleware
+from src.database.routing import ReadYourWritesMiddleware
+from src.repository.outbox import outbox_status
 from src.routes import contacts, front, auth, users
+from src.services import user_cache
+from src.services.avatar_storage import avatar_storage, LocalStorage
+from src.services.cloud_image import CloudImage
+from src.services.mail_coalesce import mail_coalescer
+from src.services.passwords import password_hasher
+from src.services.rate_limit import rate_limiter
+from src.services.roles import RoleAccess
+from src.services.static_assets import static_assets
+from src.services.token_cache import access_tokens
 
 BASE_DIR = pathlib.Path(__file__).parent
 
@@ -19,7 +35,17 @@ app = FastAPI()
 
 @app.on_event("startup")
 async def startup():
-    await FastAPILimiter.init(redis_db)
+    app.state.user_cache_listener = asyncio.create_task(user_cache.listen_invalidations())
+    app.state.rate_limit_sync = asyncio.create_task(rate_limiter.run())
+    await asyncio.to_thread(static_assets.build)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.user_cache_listener.cancel()
+    app.state.rate_limit_sync.cancel()
+    password_hasher.shutdown()
+    await CloudImage.aclose()
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,7 +55,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(QueryBudgetMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
+app.mount(static_assets.url_prefix, static_assets.files(), name="assets")
+if isinstance(avatar_storage, LocalStorage):
+    app.mount(settings.avatar_local_url, avatar_storage.files(), name="avatars")
 
 
 @app.exception_handler(ValueError)
@@ -66,21 +98,25 @@ async def validation_error_exception_handler(request: Request, exc_: ValidationE
     )
 
 
+# the metrics of the worker internals are for the admin only
+allowed_operation_metrics = RoleAccess([Role.admin])
+
+
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     """
     The healthchecker function is a simple function that checks if the database is configured correctly.
     It does this by executing a SQL query and checking if it returns any results. If it doesn't, then the
     database isn't configured correctly.
 
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with a message
     :doc-author: Trelent
     """
     try:
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await db.execute(text("SELECT 1"))).fetchone()
         if db.in_transaction():
-            db.commit()
+            await db.commit()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to FastAPI!"}
@@ -90,6 +126,58 @@ def healthchecker(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/api/healthchecker/pool", dependencies=[Depends(allowed_operation_metrics)], description='Only admin')
+async def pool_healthchecker():
+    """
+    The pool_healthchecker function reports the connection pools of this worker process,
+    so the pool sizes can be checked against the load of all uvicorn workers.
+
+    :return: A dictionary with the status of the primary and the replica pool
+    :doc-author: Trelent
+    """
+    return {"primary": pool_status(engine),
+            "replica": pool_status(replica_engine) if replica_engine is not None else None}
+
+
+@app.get("/api/healthchecker/cache", dependencies=[Depends(allowed_operation_metrics)], description='Only admin')
+async def cache_healthchecker():
+    """
+    The cache_healthchecker function reports the counters of the in-process user and token caches of this worker.
+
+    :return: A dictionary with the size, hits, misses, evictions and invalidations of each cache
+    :doc-author: Trelent
+    """
+    return {"pid": os.getpid(), "users": user_cache.local_users.stats(),
+            "versions": user_cache.local_versions.stats(), "tokens": access_tokens.stats()}
+
+
+@app.get("/api/healthchecker/passwords", dependencies=[Depends(allowed_operation_metrics)],
+         description='Only admin')
+async def passwords_healthchecker():
+    """
+    The passwords_healthchecker function reports the bcrypt thread pool of this worker,
+    the queue depth shows how many password checks wait for a free thread.
+
+    :return: A dictionary with the workers, the cost and the counters of the pool
+    :doc-author: Trelent
+    """
+    return {"pid": os.getpid(), "passwords": password_hasher.stats()}
+
+
+@app.get("/api/healthchecker/mail", dependencies=[Depends(allowed_operation_metrics)], description='Only admin')
+async def mail_healthchecker(db: AsyncSession = Depends(get_db)):
+    """
+    The mail_healthchecker function reports the email outbox, a growing number of pending emails
+    or an old oldest one means the outbox workers do not keep up or cannot reach the SMTP server.
+    The suppressed counts are the repeated requests that reused an email of the coalescing window.
+
+    :param db: AsyncSession: Get the database session
+    :return: A dictionary with the pending and failed emails of the outbox and the suppressed emails
+    :doc-author: Trelent
+    """
+    return {**await outbox_status(settings.outbox_max_attempts, db), "suppressed": await mail_coalescer.stats()}
+
+
 app.include_router(contacts.router, prefix='/api')
 app.include_router(front.router)
 app.include_router(auth.router, prefix='/api')
@@ -0,0 +1,40 @@
+"""email outbox
+
+Revision ID: 4a9d2c7e81b6
+Revises: e6a18f3b72d5
+Create Date: 2026-10-17 18:05:12.413920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9d2c7e81b6'
+down_revision = 'e6a18f3b72d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('email_outbox',
+                    sa.Column('kind', sa.Enum('confirm_email', 'reset_password', name='mailkind'), nullable=False),
+                    sa.Column('recipient', sa.String(length=150), nullable=False),
+                    sa.Column('payload', sa.JSON(), nullable=False),
+                    sa.Column('attempts', sa.Integer(), nullable=False),
+                    sa.Column('available_at', sa.DateTime(), nullable=False),
+                    sa.Column('sent_at', sa.DateTime(), nullable=True),
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('created_on', sa.DateTime(), nullable=False),
+                    sa.Column('updated_on', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    # only the unsent emails are claimed, the sent ones stay out of the index
+    op.create_index('ix_email_outbox_pending', 'email_outbox', ['available_at'], unique=False,
+                    postgresql_where=sa.text('sent_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_outbox_pending', table_name='email_outbox', postgresql_where=sa.text('sent_at IS NULL'))
+    op.drop_table('email_outbox')
+    sa.Enum(name='mailkind').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,28 @@
+"""contacts keyset indexes
+
+Revision ID: 5f0e2b7a9c31
+Revises: b372102ee4a6
+Create Date: 2026-10-17 10:12:40.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0e2b7a9c31'
+down_revision = 'b372102ee4a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_contacts_name_keyset', 'contacts',
+                    ['first_name', sa.text("coalesce(last_name, '')"), 'id'], unique=False)
+    # leading prefix of ix_contacts_name_keyset
+    op.drop_index('ix_contacts_first_name', table_name='contacts')
+
+
+def downgrade() -> None:
+    op.create_index('ix_contacts_first_name', 'contacts', ['first_name'], unique=False)
+    op.drop_index('ix_contacts_name_keyset', table_name='contacts')
@@ -0,0 +1,30 @@
+"""contacts birthday key
+
+Revision ID: 8d41c6e0f2ab
+Revises: 5f0e2b7a9c31
+Create Date: 2026-10-17 11:02:18.547331
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41c6e0f2ab'
+down_revision = '5f0e2b7a9c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # a stored generated column, postgres fills it for the existing rows while adding it
+    op.add_column('contacts', sa.Column('birthday_key', sa.Integer(),
+                                        sa.Computed("CAST(EXTRACT(month FROM birthday) * 100 "
+                                                    "+ EXTRACT(day FROM birthday) AS INTEGER)", persisted=True),
+                                        nullable=True))
+    op.create_index(op.f('ix_contacts_birthday_key'), 'contacts', ['birthday_key'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_contacts_birthday_key'), table_name='contacts')
+    op.drop_column('contacts', 'birthday_key')
@@ -0,0 +1,34 @@
+"""contacts trigram search
+
+Revision ID: c93a57d1e4f0
+Revises: 8d41c6e0f2ab
+Create Date: 2026-10-17 12:20:05.961874
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c93a57d1e4f0'
+down_revision = '8d41c6e0f2ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('contacts', sa.Column('search_text', sa.Text(),
+                                        sa.Computed("lower(first_name || ' ' || coalesce(last_name, '') || ' ' "
+                                                    "|| email || ' ' || coalesce(address, ''))", persisted=True),
+                                        nullable=True))
+    op.create_index('ix_contacts_search_text_trgm', 'contacts', ['search_text'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'})
+    op.create_index('ix_phones_phone_num_trgm', 'phones', ['phone_num'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'phone_num': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_phones_phone_num_trgm', table_name='phones')
+    op.drop_index('ix_contacts_search_text_trgm', table_name='contacts')
+    op.drop_column('contacts', 'search_text')
@@ -0,0 +1,25 @@
+"""users drop refresh_token
+
+Revision ID: e6a18f3b72d5
+Revises: c93a57d1e4f0
+Create Date: 2026-10-17 15:42:37.208114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a18f3b72d5'
+down_revision = 'c93a57d1e4f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the refresh sessions live in Redis now
+    op.drop_column('users', 'refresh_token')
+
+
+def downgrade() -> None:
+    op.add_column('users', sa.Column('refresh_token', sa.String(length=255), nullable=True))
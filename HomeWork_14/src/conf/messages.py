@@ -6,8 +6,17 @@ USER_SUCCESSFULLY_CREATED = "User has ben created.\nCheck your email for confirm
 ACCOUNT_ALREADY_EXISTS = "Account already exists"
 INVALID_EMAIL = "Invalid email"
 INVALID_PASSWORD = "Invalid password"
+TOO_MANY_LOGIN_ATTEMPTS = "Too many failed login attempts, try again later"
 INVALID_USER = "Invalid user"
 INVALID_REFRESH_TOKEN = "Invalid refresh token"
+SESSION_STORE_UNAVAILABLE = "Sessions are not available, try again later"
+USER_VERSION_UNAVAILABLE = "Access tokens cannot be checked, try again later"
+LOGGED_OUT = "Logged out"
 PASSWORD_RESET_SEND = "Password reset request send.\nWe've emailed you with instructions to reset your password."
 VERIFICATION_ERROR = "Verification error"
 PASSWORD_CHANGED = "Password has been changed successfully."
+TOO_MANY_REQUESTS = "Too many requests"
+RATE_LIMIT_UNAVAILABLE = "Rate limiter is not available, try again later"
+INVALID_IMAGE = "The file is not a valid image"
+IMAGE_TOO_LARGE = "The image is too large"
+IMAGE_UPLOAD_FAILED = "The image could not be uploaded, try again later"
@@ -1,22 +1,56 @@
-from fastapi import HTTPException, status
+from fastapi import HTTPException, Request, status
 import redis.asyncio as redis
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy import exc
 
 from src.conf.config import settings
+from src.database.pool import engine_options
+from src.database.query_budget import record_queries
+from src.database.routing import RoutingSession, PRIMARY_COOKIE
 
 URI = settings.uri
+ASYNC_URI = settings.async_uri
 
-engine = create_engine(URI, echo=True)
-session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+engine = create_async_engine(ASYNC_URI, **engine_options(ASYNC_URI, is_async=True))
+replica_engine = create_async_engine(settings.replica_uri, **engine_options(settings.replica_uri, is_async=True)) \
+    if settings.replica_uri else None
+session = async_sessionmaker(bind=engine, replica_bind=replica_engine, sync_session_class=RoutingSession,
+                             autoflush=False, expire_on_commit=False)
+record_queries(engine)
+if replica_engine is not None:
+    record_queries(replica_engine)
+
+# Sync path: alembic, scripts and the sqlite test fixtures
+sync_engine = create_engine(URI, **engine_options(URI))
+sync_session = sessionmaker(bind=sync_engine, autoflush=False, autocommit=False)
 
 redis_db = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
 
 
-# Dependency
-def get_db() -> Session:
-    with session() as db:
+async def get_db() -> AsyncSession:
+    async with session() as db:
+        try:
+            yield db
+        except exc.SQLAlchemyError as err:
+            if db.in_transaction():
+                await db.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+
+
+async def get_read_db(request: Request) -> AsyncSession:
+    async with session(info={"read_only": PRIMARY_COOKIE not in request.cookies}) as db:
+        try:
+            yield db
+        except exc.SQLAlchemyError as err:
+            if db.in_transaction():
+                await db.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+
+
+def get_sync_db() -> Session:
+    with sync_session() as db:
         try:
             yield db
         except exc.SQLAlchemyError as err:
@@ -1,6 +1,8 @@
 import enum
+from datetime import datetime
 
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Date, func, Enum, Boolean
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Date, func, Enum, Boolean, Index, Computed, \
+    Text, cast, extract, JSON
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -18,7 +20,7 @@ class MyBaseModel(Base):
 
 class Contact(MyBaseModel):
     __tablename__ = "contacts"
-    first_name = Column(String(64), index=True, nullable=False)
+    first_name = Column(String(64), nullable=False)
     last_name = Column(String(64))
 
     @hybrid_property
@@ -31,16 +33,35 @@ class Contact(MyBaseModel):
 
     email = Column(String(64), unique=True, nullable=False)
     birthday = Column(Date)
+    # month * 100 + day (1201 for December 1), see src.functions.birthday_key
+    birthday_key = Column(Integer, Computed(cast(extract("month", birthday) * 100 + extract("day", birthday), Integer)),
+                          index=True)
 
     address = Column(String(128))
-    phones = relationship("Phone", cascade="all, delete-orphan", back_populates="contact")
+    # lower-cased name, email and address for search_cnt
+    search_text = Column(Text, Computed(func.lower(first_name + " " + func.coalesce(last_name, "") + " " + email + " " +
+                                                   func.coalesce(address, ""))))
+    # relationships never load implicitly, see src.repository.loaders.loader_options
+    phones = relationship("Phone", cascade="all, delete-orphan", back_populates="contact", lazy="raise")
+
+    __table_args__ = (
+        # keyset pagination index for the name sort of get_cnt (email and created use unique/pk indexes)
+        Index("ix_contacts_name_keyset", first_name, func.coalesce(last_name, ""), "id"),
+        Index("ix_contacts_search_text_trgm", search_text, postgresql_using="gin",
+              postgresql_ops={"search_text": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
 
 
 class Phone(MyBaseModel):
     __tablename__ = "phones"
     contact_id = Column(None, ForeignKey("contacts.id", ondelete="CASCADE"), nullable=False)
     phone_num = Column(String(12), nullable=False, index=True, unique=True)
-    contact = relationship("Contact", back_populates="phones")
+    contact = relationship("Contact", back_populates="phones", lazy="raise")
+
+    __table_args__ = (
+        Index("ix_phones_phone_num_trgm", phone_num, postgresql_using="gin",
+              postgresql_ops={"phone_num": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
 
     def __int__(self, contact_id: int, phone_num: str):
         self.contact_id = contact_id
@@ -58,7 +79,27 @@ class User(MyBaseModel):
     username = Column(String(12), nullable=False)
     email = Column(String(150), nullable=False, unique=True)
     password = Column(String(255), nullable=False)
-    refresh_token = Column(String(255), nullable=True)
     avatar = Column(String(255), nullable=True)
     roles = Column('roles', Enum(Role), default=Role.user)
     confirmed = Column(Boolean, default=False)
+
+
+class MailKind(enum.Enum):
+    confirm_email: str = "confirm_email"
+    reset_password: str = "reset_password"
+
+
+class EmailOutbox(MyBaseModel):
+    __tablename__ = "email_outbox"
+    kind = Column(Enum(MailKind), nullable=False)
+    recipient = Column(String(150), nullable=False)
+    # the template variables besides the token, which is signed when the email is sent
+    payload = Column(JSON, nullable=False, default=dict)
+    attempts = Column(Integer, nullable=False, default=0)
+    # a claimed email becomes available again when the worker that claimed it did not finish it
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_email_outbox_pending", available_at, postgresql_where=sent_at.is_(None)),
+    )
@@ -0,0 +1,102 @@
+import os
+from dataclasses import dataclass
+from time import perf_counter
+
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from src.conf.config import settings
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_time: float = 0.0
+    max_wait_time: float = 0.0
+
+
+class MeteredPool:
+    """
+    Mixed into a pool class, counts the checkouts and the checkout timeouts and measures how long
+    the callers waited for a connection (including the time to open a new one).
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            waited = perf_counter() - start
+            self.metrics.checkouts += 1
+            self.metrics.wait_time += waited
+            self.metrics.max_wait_time = max(self.metrics.max_wait_time, waited)
+
+
+class MeteredQueuePool(MeteredPool, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class MeteredNullPool(MeteredPool, NullPool):
+    pass
+
+
+def engine_options(uri: str, is_async: bool = False) -> dict:
+    """
+    The engine_options function builds the create_engine keyword arguments from the settings.
+        In PgBouncer mode (settings.db_pgbouncer) the application keeps no pool of its own, every checkout opens
+        a connection to PgBouncer, and asyncpg does not cache prepared statements, because a transaction-pooled
+        PgBouncer may run the next statement on another server connection.
+
+    :param uri: str: The database URI of the engine
+    :param is_async: bool: True for create_async_engine
+    :return: A dict of keyword arguments for create_engine or create_async_engine
+    :doc-author: Trelent
+    """
+    options = {"echo": settings.db_echo, "pool_pre_ping": settings.db_pool_pre_ping}
+    if settings.db_pgbouncer:
+        options["poolclass"] = MeteredNullPool
+        if make_url(uri).get_driver_name() == "asyncpg":
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        return options
+    options.update(poolclass=MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+                   pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow,
+                   pool_timeout=settings.db_pool_timeout, pool_recycle=settings.db_pool_recycle)
+    return options
+
+
+def pool_status(engine: Engine | AsyncEngine) -> dict:
+    """
+    The pool_status function reports the current state of the connection pool of an engine.
+        Every uvicorn worker has its own pools, so the numbers are per process and carry its pid.
+
+    :param engine: Engine | AsyncEngine: The engine to report on
+    :return: A dict with the pool size, checked out connections, overflow, checkouts, timeouts and wait times
+    :doc-author: Trelent
+    """
+    pool = engine.pool
+    status = {"pid": os.getpid(), "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                      overflow=max(pool.overflow(), 0), timeout=pool.timeout())
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        avg_wait_time = metrics.wait_time / metrics.checkouts if metrics.checkouts else 0.0
+        status.update(checkouts=metrics.checkouts, checkout_timeouts=metrics.timeouts,
+                      wait_time_ms=round(metrics.wait_time * 1000, 2),
+                      avg_wait_time_ms=round(avg_wait_time * 1000, 2),
+                      max_wait_time_ms=round(metrics.max_wait_time * 1000, 2))
+    return status
@@ -0,0 +1,103 @@
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryStats:
+    statements: list[str] = field(default_factory=list)
+    total_time: float = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+current_stats: ContextVar[QueryStats | None] = ContextVar("current_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_start_time"].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.statements.append(statement)
+        stats.total_time += elapsed
+
+
+def record_queries(engine: Engine | AsyncEngine) -> None:
+    """
+    The record_queries function makes the engine report every statement it executes
+    to the QueryStats of the current request.
+
+    :param engine: Engine | AsyncEngine: The engine to listen to
+    :return: None
+    :doc-author: Trelent
+    """
+    if isinstance(engine, AsyncEngine):
+        engine = engine.sync_engine
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryBudget:
+    def __init__(self, max_queries: int):
+        self.max_queries = max_queries
+
+    async def __call__(self, request: Request):
+        request.state.query_budget = self
+
+
+class QueryBudgetMiddleware:
+    """
+    Collects the statements issued while a request is handled. The count and the total database time
+    are sent in the Server-Timing header. If the route declared a QueryBudget and the request issued more
+    statements, a warning is logged, or QueryBudgetExceeded is raised when settings.query_budget_strict
+    is set (the tests do that).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        current_stats.set(stats)
+        state = scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", f'db;dur={stats.total_time * 1000:.2f};desc="{stats.count} queries"')
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        budget = state.get("query_budget")
+        if budget is not None and stats.count > budget.max_queries:
+            message = f"{scope['method']} {scope['path']} issued {stats.count} queries, " \
+                      f"budget is {budget.max_queries}:\n" + "\n".join(stats.statements)
+            if settings.query_budget_strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
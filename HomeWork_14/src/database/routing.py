@@ -0,0 +1,53 @@
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+
+from src.conf.config import settings
+
+PRIMARY_COOKIE = "db_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingSession(Session):
+    """
+    The sync session class behind AsyncSession. A session opened with info={"read_only": True} sends its
+    SELECT statements to the replica; flushes and every other statement still go to the primary, so a route
+    that writes by mistake cannot write to the replica.
+    """
+
+    def __init__(self, bind=None, replica_bind=None, **kw):
+        super().__init__(bind=bind, **kw)
+        if isinstance(replica_bind, AsyncEngine):
+            replica_bind = replica_bind.sync_engine
+        self.replica_bind = replica_bind
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.replica_bind is not None and self.info.get("read_only") and not self._flushing \
+                and isinstance(clause, Select):
+            return self.replica_bind
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins a client to the primary for settings.replica_pin_seconds after it wrote something: a successful
+    POST, PUT, PATCH or DELETE sets a short-lived cookie and get_read_db does not use the replica while the
+    cookie is present, so the client never reads data older than its own write.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not settings.replica_uri:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = MutableHeaders(scope=message)
+                headers.append("Set-Cookie", f"{PRIMARY_COOKIE}=1; Max-Age={settings.replica_pin_seconds}; "
+                                             f"Path=/; HttpOnly; SameSite=Lax")
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,3 +1,6 @@
+from datetime import date
+
+
 def format_phone_num(pn: str) -> str:
     return f"+{pn[:3]}({pn[3:5]}){pn[5:8]}-{pn[8:10]}-{pn[10:]}"
 
@@ -10,6 +13,10 @@ def sanitize_phone_num(pn: str) -> str:
     return tel_code.get(len(snz_phone), "") + snz_phone
 
 
+def birthday_key(d: date) -> int:
+    return d.month * 100 + d.day
+
+
 if __name__ == '__main__':
     p_num = '0445433108'
     print(sanitize_phone_num(p_num))
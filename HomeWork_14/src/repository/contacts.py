@@ -1,71 +1,169 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from datetime import date, timedelta
-from typing import Type
+from typing import AsyncIterator, Sequence
 
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, delete, exc, func, insert, or_, select, tuple_
 
 from src.database.models import Contact, Phone
-from src.schemas import ContactInput
+from src.functions import birthday_key, sanitize_phone_num
+from src.repository.loaders import loader_options
+from src.schemas import ContactInput, ContactOutput, ContactInListOutput
 
 
-async def get_cnt_by_id(cnt_id: int, db: Session) -> Contact:
+async def get_cnt_by_id(cnt_id: int, db: AsyncSession, load: type[BaseModel] = ContactOutput) -> Contact:
     """
     The get_cnt_by_id function returns a contact by its id.
         Args:
             cnt_id (int): The id of the contact to be returned.
-            db (Session): A database session object that is used to query the database for contacts.
+            db (AsyncSession): A database session object that is used to query the database for contacts.
 
     :param cnt_id: int: Get the contact with the given id
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param load: type[BaseModel]: The response model, its relationships are loaded in the same query
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = db.query(Contact).get(cnt_id)
-    await get_birth_list(db)
+    contact = await db.get(Contact, cnt_id, options=loader_options(Contact, load))
     return contact
 
 
-async def get_cnt(db: Session, filter_type: int = 0, filter_str: str = None) -> list[Type[Contact]]:
+SORT_KEYS = {
+    "name": ((Contact.first_name, func.coalesce(Contact.last_name, ""), Contact.id),
+             lambda cnt: (cnt.first_name, cnt.last_name or "", cnt.id)),
+    "email": ((Contact.email,), lambda cnt: (cnt.email,)),
+    "created": ((Contact.id,), lambda cnt: (cnt.id,)),
+}
+
+
+def encode_cursor(sort: str, contact: Contact) -> str:
+    """
+    The encode_cursor function packs the sort key values of the last contact on a page into an opaque string.
+
+    :param sort: str: The sort option the page was fetched with, e.g. "name" or "-email"
+    :param contact: Contact: The last contact of the page
+    :return: A url-safe cursor string
+    :doc-author: Trelent
+    """
+    values = SORT_KEYS[sort.lstrip("-")][1](contact)
+    return urlsafe_b64encode(json.dumps([sort, *values]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str) -> tuple:
+    """
+    The decode_cursor function unpacks a cursor made by encode_cursor.
+        The cursor is only valid for the sort option it was issued for.
+
+    :param sort: str: The sort option of the current request
+    :param cursor: str: The cursor received from the client
+    :return: The sort key values of the last contact on the previous page
+    :doc-author: Trelent
+    """
+    try:
+        cursor_sort, *values = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if cursor_sort != sort or len(values) != len(SORT_KEYS[sort.lstrip("-")][0]):
+        raise ValueError("Cursor does not match the sort order.")
+    for value, column in zip(values, SORT_KEYS[sort.lstrip("-")][0]):
+        # a tampered cursor must not reach the query with a value of another type
+        if type(value) is not column.type.python_type:
+            raise ValueError("Invalid cursor.")
+    return tuple(values)
+
+
+async def get_cnt(db: AsyncSession, filter_type: int = 0, filter_str: str = None, limit: int = 50,
+                  cursor: str = None, sort: str = "name", days: int = 7,
+                  load: type[BaseModel] = ContactInListOutput) -> tuple[Sequence[Contact], str | None]:
     """
-    The get_cnt function is used to retrieve a list of contacts from the database.
-        The function accepts two parameters: filter_type and filter_str.  If no parameters are passed,
-        all contacts in the database will be returned in alphabetical order by first name and last name.
+    The get_cnt function is used to retrieve one page of contacts from the database.
+        The function accepts two filter parameters: filter_type and filter_str.  If no parameters are passed,
+        all contacts in the database are paged in alphabetical order by first name and last name.
+        Pages are keyset based: the cursor holds the sort key of the last row of the previous page,
+        so every page is an index range scan no matter how deep the client has scrolled.
 
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param filter_type: int: Filter the contacts by first name, last name, email or birthday
     :param filter_str: str: Filter the contacts based on a string
-    :return: A list of contacts
+    :param limit: int: The maximum number of contacts in the page
+    :param cursor: str: The next_cursor of the previous page, None for the first page
+    :param sort: str: The sort option, one of SORT_KEYS, prefixed with "-" for descending order
+    :param days: int: The birthday window in days for filter_type 4
+    :param load: type[BaseModel]: The response model, its relationships are loaded in bounded round trips
+    :return: A list of contacts and the cursor of the next page or None if this is the last page
     :doc-author: Trelent
     """
     if filter_type == 4:
-        contacts = await get_birth_list(db)
+        return await get_birth_list(db, days, load), None
+
+    if filter_str:
+        filter_str = f"%{filter_str}%"
+    else:
+        filter_type = 0
+
+    descending = sort.startswith("-")
+    columns = SORT_KEYS[sort.lstrip("-")][0]
+    stmt = select(Contact).options(*loader_options(Contact, load, many=True)).\
+        order_by(*[col.desc() if descending else col for col in columns]).limit(limit + 1)
+    if cursor:
+        key, last_key = tuple_(*columns), tuple_(*decode_cursor(sort, cursor))
+        stmt = stmt.filter(key < last_key if descending else key > last_key)
+
+    match filter_type:
+        case 1:
+            stmt = stmt.filter(Contact.first_name.ilike(filter_str))
+        case 2:
+            stmt = stmt.filter(Contact.last_name.ilike(filter_str))
+        case 3:
+            stmt = stmt.filter(Contact.email.ilike(filter_str))
+    contacts = (await db.execute(stmt)).scalars().all()
+
+    next_cursor = None
+    if len(contacts) > limit:
+        contacts = contacts[:limit]
+        next_cursor = encode_cursor(sort, contacts[-1])
+    return contacts, next_cursor
+
+
+async def search_cnt(db: AsyncSession, q: str, limit: int = 50,
+                     load: type[BaseModel] = ContactInListOutput) -> Sequence[Contact]:
+    """
+    The search_cnt function looks for q in the name, email, address and phone numbers of the contacts.
+        On postgres the substring match is served by the pg_trgm GIN indexes on contacts.search_text and
+        phones.phone_num, and the contacts are ranked by the trigram word similarity of q and search_text.
+        Other databases (sqlite in tests) fall back to a plain LIKE scan ordered by name.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param q: str: The text to look for
+    :param limit: int: The maximum number of contacts returned
+    :param load: type[BaseModel]: The response model, its relationships are loaded in bounded round trips
+    :return: A list of the most relevant contacts
+    :doc-author: Trelent
+    """
+    q = q.strip().lower()
+    match = Contact.search_text.contains(q, autoescape=True)
+    digits = "".join([ch for ch in q if ch.isdecimal()])
+    if len(digits) >= 3:
+        match = or_(match, Contact.id.in_(select(Phone.contact_id).filter(Phone.phone_num.contains(digits))))
+
+    stmt = select(Contact).options(*loader_options(Contact, load, many=True)).filter(match).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = stmt.order_by(func.word_similarity(q, Contact.search_text).desc(), Contact.first_name, Contact.id)
     else:
-        if filter_str:
-            filter_str = f"%{filter_str}%"
-        else:
-            filter_type = 0
-
-        match filter_type:
-            case 1:
-                contacts = db.query(Contact).filter(Contact.first_name.ilike(filter_str)).\
-                    order_by(Contact.first_name, Contact.last_name).all()
-            case 2:
-                contacts = db.query(Contact).filter(Contact.last_name.ilike(filter_str)).\
-                    order_by(Contact.first_name, Contact.last_name).all()
-            case 3:
-                contacts = db.query(Contact).filter(Contact.email.ilike(filter_str)).\
-                    order_by(Contact.first_name, Contact.last_name).all()
-            case _:
-                contacts = db.query(Contact).order_by(Contact.first_name, Contact.last_name).all()
+        stmt = stmt.order_by(Contact.first_name, Contact.last_name, Contact.id)
+    contacts = (await db.execute(stmt)).scalars().all()
     return contacts
 
 
-async def create_cnt(body: ContactInput, db: Session) -> Contact:
+async def create_cnt(body: ContactInput, db: AsyncSession) -> Contact:
     """
     The create_cnt function creates a new contact in the database.
 
     :param body: ContactInput: Validate the input data
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A contact object, which is the same type as the return value of get_cnt
     :doc-author: Trelent
     """
@@ -78,28 +176,162 @@ async def create_cnt(body: ContactInput, db: Session) -> Contact:
     db.add(contact)
 
     if body.phones:
-        for phone_ in body.phones:
-            db.add(Phone(phone_num=phone_.phone_num, contact=contact))
+        for phone_num in dict.fromkeys(sanitize_phone_num(phone_.phone_num) for phone_ in body.phones):
+            db.add(Phone(phone_num=phone_num, contact=contact))
 
-    db.commit()
-    db.refresh(contact)
+    await db.commit()
+    await db.refresh(contact)
     return contact
 
 
-async def update_cnt(cnt_id: int, body: ContactInput, db: Session) -> Contact | None:
+MAX_IMPORT_ERRORS = 1000
+
+
+def _dialect_insert(db: AsyncSession):
+    match db.get_bind().dialect.name:
+        case "postgresql":
+            return postgresql.insert
+        case "sqlite":
+            return sqlite.insert
+    return insert
+
+
+def _import_error(report: dict, row_num: int, detail: str) -> None:
+    if len(report["errors"]) < MAX_IMPORT_ERRORS:
+        report["errors"].append({"row": row_num, "detail": detail})
+
+
+async def _import_batch(batch: list[tuple[int, ContactInput, list[str]]], db: AsyncSession, report: dict) -> None:
+    rows, errors = {}, []
+    for row_num, body, phones in batch:
+        if body.email in rows:
+            errors.append((row_num, f"Duplicate email {body.email}, see row {rows[body.email][0]}.", True))
+            continue
+        rows[body.email] = row_num, body, phones
+
+    insert_ = _dialect_insert(db)
+    contact_stmt = insert_(Contact).returning(Contact.id, Contact.email)
+    phone_stmt = insert_(Phone).returning(Phone.phone_num)
+    if insert_ is not insert:
+        contact_stmt = contact_stmt.on_conflict_do_nothing()
+        phone_stmt = phone_stmt.on_conflict_do_nothing()
+
+    try:
+        result = await db.execute(contact_stmt, [{"first_name": body.first_name, "last_name": body.last_name,
+                                                  "email": body.email, "birthday": body.birthday,
+                                                  "address": body.address} for _, body, _ in rows.values()])
+        ids = {email: cnt_id for cnt_id, email in result}
+
+        phones = {}
+        for email, (row_num, body, phone_nums) in rows.items():
+            if email not in ids:
+                errors.append((row_num, f"Contact with email {email} already exists.", True))
+                continue
+            for phone_num in phone_nums:
+                if phone_num in phones:
+                    errors.append((row_num, f"Phone {phone_num} skipped, see row {phones[phone_num][0]}.", False))
+                    continue
+                phones[phone_num] = row_num, ids[email]
+
+        if phones:
+            result = await db.execute(phone_stmt, [{"phone_num": phone_num, "contact_id": cnt_id}
+                                                   for phone_num, (_, cnt_id) in phones.items()])
+            inserted = set(result.scalars())
+            errors.extend((row_num, f"Phone {phone_num} skipped, it already exists.", False)
+                          for phone_num, (row_num, _) in phones.items() if phone_num not in inserted)
+        await db.commit()
+    except exc.DBAPIError as err:
+        # a row the database refused (a conflict on a dialect without ON CONFLICT, a value that does not fit
+        # its column), the rows of the batch are inserted one by one, so only that row is rejected
+        await db.rollback()
+        if len(batch) > 1:
+            for row in batch:
+                await _import_batch([row], db, report)
+            return
+        ids = {}
+        errors = [(row_num, f"Row rejected: {err.orig}", True) for row_num, _, _ in batch]
+
+    report["inserted"] += len(ids)
+    for row_num, detail, failed in sorted(errors):
+        report["failed"] += failed
+        _import_error(report, row_num, detail)
+
+
+async def import_cnt(rows: AsyncIterator[tuple[int, dict | ValueError]], db: AsyncSession,
+                     batch_size: int = 1000) -> dict:
+    """
+    The import_cnt function inserts a stream of parsed rows into the database.
+        Every row is validated with ContactInput and its phones are normalized with sanitize_phone_num.
+        Valid rows are inserted batch_size at a time with one multi-row INSERT ... RETURNING for the contacts
+        and one for their phones, and every batch is committed on its own, so memory stays bounded and a bad
+        row never aborts the file. Rows whose email or phone already exists are skipped and reported.
+
+    :param rows: AsyncIterator[tuple[int, dict | ValueError]]: The rows from read_csv or read_ndjson
+    :param db: AsyncSession: Pass the database session to the function
+    :param batch_size: int: The number of rows inserted with one statement
+    :return: A report with the numbers of inserted and failed rows and the first errors
+    :doc-author: Trelent
+    """
+    report = {"inserted": 0, "failed": 0, "errors": []}
+    batch = []
+    async for row_num, row in rows:
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            body = ContactInput(**row)
+            phones = list(dict.fromkeys(sanitize_phone_num(phone.phone_num) for phone in body.phones or []))
+        except ValueError as err:
+            report["failed"] += 1
+            _import_error(report, row_num, str(err))
+            continue
+        batch.append((row_num, body, phones))
+        if len(batch) >= batch_size:
+            await _import_batch(batch, db, report)
+            batch = []
+    if batch:
+        await _import_batch(batch, db, report)
+    return report
+
+
+async def stream_cnt(db: AsyncSession, chunk_size: int = 1000) -> AsyncIterator[list[dict]]:
+    """
+    The stream_cnt function reads all contacts through a server-side cursor and yields them chunk by chunk.
+        Plain rows are fetched instead of ORM objects, so nothing accumulates in the session, and the phones
+        of every chunk are loaded with one SELECT ... WHERE contact_id IN (...).
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param chunk_size: int: The number of contacts fetched from the cursor at a time
+    :return: An async iterator of lists of contact dicts with a "phones" list of phone numbers
+    :doc-author: Trelent
+    """
+    stmt = select(Contact.id, Contact.first_name, Contact.last_name, Contact.email, Contact.birthday,
+                  Contact.address).order_by(Contact.id).execution_options(yield_per=chunk_size)
+    result = await db.stream(stmt)
+    async for partition in result.mappings().partitions():
+        contacts = {row["id"]: {**row, "phones": []} for row in partition}
+        phones = await db.execute(select(Phone.contact_id, Phone.phone_num).
+                                  filter(Phone.contact_id.in_(contacts)).order_by(Phone.id))
+        for cnt_id, phone_num in phones:
+            contacts[cnt_id]["phones"].append(phone_num)
+        yield list(contacts.values())
+
+
+async def update_cnt(cnt_id: int, body: ContactInput, db: AsyncSession) -> Contact | None:
     """
     The update_cnt function updates a contact in the database.
         Args:
             cnt_id (int): The id of the contact to update.
             body (ContactInput): The updated information for the contact.
+        If body has no phones the phones of the contact are left untouched, otherwise the normalized
+        numbers are diffed as sets with the stored ones: one DELETE for the removed, one INSERT for the added.
 
     :param cnt_id: int: Identify the contact to be deleted
     :param body: ContactInput: Pass the data from the request body to update_cnt function
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The updated contact
     :doc-author: Trelent
     """
-    contact = await get_cnt_by_id(cnt_id, db)
+    contact = await get_cnt_by_id(cnt_id, db, load=ContactInListOutput)
     if contact:
         contact.first_name = body.first_name
         contact.last_name = body.last_name
@@ -107,62 +339,64 @@ async def update_cnt(cnt_id: int, body: ContactInput, db: Session) -> Contact |
         contact.email = body.email
         contact.address = body.address
 
-        if body.phones:
-            new_list_phones = [phone.phone_num for phone in body.phones]
-            for phone_cnt in contact.phones:
-                if phone_cnt.phone_num in new_list_phones:
-                    new_list_phones.remove(phone_cnt.phone_num)
-                else:
-                    db.delete(phone_cnt)
-
-            if new_list_phones:
-                contact.phones.extend([Phone(phone_num=p_num, contact=contact) for p_num in new_list_phones])
-                # new_phones = []
-                # for p_num in new_list_phones:
-                #     new_phones.append(Phone(phone_num=p_num, contact=contact))
-        db.commit()
+        if body.phones is not None:
+            new_phones = {sanitize_phone_num(phone.phone_num) for phone in body.phones}
+            phones = dict((await db.execute(select(Phone.phone_num, Phone.id).
+                                            filter(Phone.contact_id == cnt_id))).all())
+            removed = [phones[phone_num] for phone_num in phones.keys() - new_phones]
+            added = new_phones - phones.keys()
+            if removed:
+                await db.execute(delete(Phone).filter(Phone.id.in_(removed)))
+            if added:
+                await db.execute(insert(Phone), [{"contact_id": cnt_id, "phone_num": phone_num}
+                                                 for phone_num in sorted(added)])
+        await db.commit()
     return contact
 
 
-async def delete_cnt_by_id(cnt_id: int, db: Session) -> Contact | None:
+async def delete_cnt_by_id(cnt_id: int, db: AsyncSession) -> Contact | None:
     """
     The delete_cnt_by_id function deletes a contact from the database by its id.
         Args:
             cnt_id (int): The id of the contact to be deleted.
-            db (Session): A connection to the database.
+            db (AsyncSession): A connection to the database.
 
     :param cnt_id: int: Specify the id of the contact to be deleted
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The deleted contact or none if the contact doesn't exist
     :doc-author: Trelent
     """
     contact = await get_cnt_by_id(cnt_id, db)
     if contact:
-        db.delete(contact)
-        db.commit()
+        await db.delete(contact)
+        await db.commit()
     return contact
 
 
-async def get_birth_list(db: Session) -> list[Type[Contact]]:
+async def get_birth_list(db: AsyncSession, days: int = 7,
+                         load: type[BaseModel] = ContactInListOutput) -> Sequence[Contact]:
     """
-    The get_birth_list function returns a list of contacts whose birthday is within the next 7 days.
-    The function takes in a database session and uses it to query the Contact table for all contacts
-    whose birthday falls between today's date and seven days from now. The results are ordered by
-    birthday.
+    The get_birth_list function returns a list of contacts whose birthday is within the next days.
+    The function compares the indexed birthday_key column (month * 100 + day) with the keys of today
+    and of the last day of the window, so the query is an index range scan and February 29 or March 1
+    are matched by calendar date in leap and common years alike. A window crossing the new year is
+    split into two ranges. The results are ordered by the next occurrence of the birthday.
 
-    :param db: Session: Pass the database session to the function
-    :return: A list of contacts whose birthday is in the next 7 days
+    :param db: AsyncSession: Pass the database session to the function
+    :param days: int: The length of the window in days, starting from today
+    :param load: type[BaseModel]: The response model, its relationships are loaded in bounded round trips
+    :return: A list of contacts whose birthday is in the next days
     :doc-author: Trelent
     """
-    date_today_dof = date.today().timetuple().tm_yday
-    date_end_dof = (date.today() + timedelta(days=7)).timetuple().tm_yday
-    if date_end_dof > date_today_dof:
-        contacts = db.query(Contact).\
-            filter(func.date_part('doy', Contact.birthday).between(date_today_dof, date_end_dof)).\
-            order_by(Contact.birthday).all()
+    today = date.today()
+    end = today + timedelta(days=days)
+    start_key, end_key = birthday_key(today), birthday_key(end)
+    stmt = select(Contact).options(*loader_options(Contact, load, many=True))
+    if end.year == today.year:
+        stmt = stmt.filter(Contact.birthday_key.between(start_key, end_key)).\
+            order_by(Contact.birthday_key)
     else:
-        contacts = db.query(Contact).\
-            filter(or_(func.date_part('doy', Contact.birthday).between(date_today_dof, 366),
-                       func.date_part('doy', Contact.birthday).between(1, date_end_dof))).\
-            order_by(Contact.birthday).all()
+        stmt = stmt.filter(or_(Contact.birthday_key >= start_key, Contact.birthday_key <= end_key)).\
+            order_by(case((Contact.birthday_key >= start_key, 0), else_=1), Contact.birthday_key)
+    contacts = (await db.execute(stmt)).scalars().all()
     return contacts
@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+
+def loader_options(entity, schema: type[BaseModel], many: bool = False) -> list:
+    """
+    The loader_options function builds the eager loading options for the relationships a response model serializes.
+        Relationships are lazy="raise" in the models, so every relationship touched by the serializer must be
+        loaded here. A single object joins its collections (one round trip), a list of objects loads them with
+        one SELECT ... IN per relationship, so the number of round trips never depends on the number of rows.
+
+    :param entity: The mapped class that is loaded, e.g. Contact
+    :param schema: type[BaseModel]: The response model the objects are serialized with
+    :param many: bool: True if a list of objects is loaded
+    :return: A list of loader options for select().options() or session.get()
+    :doc-author: Trelent
+    """
+    options = []
+    relationships = inspect(entity).relationships
+    for name, field in schema.__fields__.items():
+        if name not in relationships:
+            continue
+        relationship = relationships[name]
+        loader = selectinload if many and relationship.uselist else joinedload
+        option = loader(getattr(entity, name))
+        if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            option = option.options(*loader_options(relationship.mapper.class_, field.type_, many=True))
+        options.append(option)
+    return options
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import EmailOutbox, MailKind
+
+
+def add_email(kind: MailKind, recipient: str, payload: dict, db: AsyncSession) -> EmailOutbox:
+    """
+    The add_email function adds an email to the outbox of the session without committing it,
+    so it is saved in the same transaction as the changes the caller commits next.
+
+    :param kind: MailKind: The template of the email
+    :param recipient: str: The address of the recipient
+    :param payload: dict: The template variables
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The outbox row
+    :doc-author: Trelent
+    """
+    email = EmailOutbox(kind=kind, recipient=recipient, payload=payload)
+    db.add(email)
+    return email
+
+
+async def queue_email(kind: MailKind, recipient: str, payload: dict, db: AsyncSession) -> None:
+    """
+    The queue_email function saves an email in the outbox, the outbox worker sends it.
+
+    :param kind: MailKind: The template of the email
+    :param recipient: str: The address of the recipient
+    :param payload: dict: The template variables
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    add_email(kind, recipient, payload, db)
+    await db.commit()
+
+
+async def claim_emails(limit: int, lease: float, max_attempts: int, db: AsyncSession) -> list[EmailOutbox]:
+    """
+    The claim_emails function takes the next pending emails for one worker. The rows are locked with
+    FOR UPDATE SKIP LOCKED, so parallel workers claim different rows without waiting for each other,
+    and they are hidden for lease seconds, so an email of a worker that died is sent again after that.
+
+    :param limit: int: The maximum number of emails
+    :param lease: float: The seconds the worker has to send them
+    :param max_attempts: int: The number of attempts after which an email is given up
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The claimed emails
+    :doc-author: Trelent
+    """
+    now = datetime.utcnow()
+    emails = (await db.execute(
+        select(EmailOutbox)
+        .where(EmailOutbox.sent_at.is_(None), EmailOutbox.available_at <= now,
+               EmailOutbox.attempts < max_attempts)
+        .order_by(EmailOutbox.available_at, EmailOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+    for email in emails:
+        email.attempts += 1
+        email.available_at = now + timedelta(seconds=lease)
+    await db.commit()
+    return list(emails)
+
+
+async def finish_emails(sent: list[EmailOutbox], failed: list[EmailOutbox], retry_delay: float,
+                        db: AsyncSession) -> None:
+    """
+    The finish_emails function marks the sent emails and puts the failed ones back with a backoff of
+    retry_delay, 2 * retry_delay, ... seconds by their number of attempts.
+
+    :param sent: list[EmailOutbox]: The emails that were sent
+    :param failed: list[EmailOutbox]: The emails that were not sent
+    :param retry_delay: float: The delay after the first failed attempt
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    now = datetime.utcnow()
+    if sent:
+        await db.execute(update(EmailOutbox).where(EmailOutbox.id.in_([email.id for email in sent]))
+                         .values(sent_at=now))
+    for email in failed:
+        await db.execute(update(EmailOutbox).where(EmailOutbox.id == email.id)
+                         .values(available_at=now + timedelta(seconds=retry_delay * 2 ** (email.attempts - 1))))
+    await db.commit()
+
+
+async def outbox_status(max_attempts: int, db: AsyncSession) -> dict:
+    """
+    The outbox_status function counts the emails that wait in the outbox and the ones that were given up.
+
+    :param max_attempts: int: The number of attempts after which an email is given up
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A dictionary with the pending and failed counts and the creation time of the oldest pending email
+    :doc-author: Trelent
+    """
+    unsent = EmailOutbox.sent_at.is_(None)
+    pending, oldest = (await db.execute(
+        select(func.count(), func.min(EmailOutbox.created_on)).select_from(EmailOutbox)
+        .where(unsent, EmailOutbox.attempts < max_attempts))).one()
+    failed = (await db.execute(
+        select(func.count()).select_from(EmailOutbox).where(unsent, EmailOutbox.attempts >= max_attempts))).scalar_one()
+    return {"pending": pending, "failed": failed, "oldest_pending": oldest}
@@ -1,30 +1,32 @@
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import User
+from src.database.models import User, Role
 from src.schemas import UserInput
+from src.services import user_cache
 
 
-async def get_user_by_email(email: str, db: Session) -> User | None:
+async def get_user_by_email(email: str, db: AsyncSession) -> User | None:
     """
     The get_user_by_email function takes in an email and a database session,
     and returns the user with that email if it exists. If no such user exists,
     it returns None.
 
     :param email: str: Specify the email address of the user
-    :param db: Session: Pass in the database session to the function
+    :param db: AsyncSession: Pass in the database session to the function
     :return: The first user with a matching email address
     :doc-author: Trelent
     """
-    return db.query(User).filter_by(email=email).first()
+    return (await db.execute(select(User).filter_by(email=email))).scalars().first()
 
 
-async def create_user(body: UserInput, db: Session) -> User:
+async def create_user(body: UserInput, db: AsyncSession) -> User:
     """
     The create_user function creates a new user in the database.
 
     :param body: UserInput: Get the data from the request body
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user object
     :doc-author: Trelent
     """
@@ -37,66 +39,72 @@ async def create_user(body: UserInput, db: Session) -> User:
     new_user.avatar = g.get_image()
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, refresh_token: str | None, db: Session) -> None:
-    """
-    The update_token function updates the refresh token for a user.
-
-    :param user: User: Identify the user in the database
-    :param refresh_token: str | None: Specify the type of the refresh_token parameter
-    :param db: Session: Pass the database session to the function
-    :return: None
-    :doc-author: Trelent
-    """
-    user.refresh_token = refresh_token
-    db.commit()
-
-
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
     The confirmed_email function takes in an email and a database session,
     and sets the confirmed field of the user with that email to True.
 
 
     :param email: str: Specify the email of the user to be confirmed
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: None
     :doc-author: Trelent
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await db.commit()
+    await user_cache.cache_user(user)
 
 
-async def change_password(user: User, password: str, db: Session) -> None:
+async def change_password(user: User, password: str, db: AsyncSession) -> None:
     """
     The change_password function takes a user and password, then updates the user's password in the database.
 
     :param user: User: Pass in the user object
     :param password: str: Pass in the new password
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: None, which means that it doesn't return anything
     :doc-author: Trelent
     """
     user.password = password
-    db.commit()
+    await db.commit()
+    await user_cache.invalidate_user(user.email)
+
+
+async def change_role(user: User, role: Role, db: AsyncSession) -> None:
+    """
+    The change_role function changes the role of a user. The access tokens issued before
+    carry the old role, so they are made outdated and the user has to refresh them.
+
+    :param user: User: Pass in the user object
+    :param role: Role: Pass in the new role
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    user.roles = role
+    await db.commit()
+    await user_cache.invalidate_user(user.email)
+    await user_cache.bump_user_version(user.id)
 
 
-async def update_avatar(email: str, url: str, db: Session) -> User:
+async def update_avatar(email: str, url: str, db: AsyncSession) -> User:
     """
     The update_avatar function updates the avatar of a user.
 
     :param email: str: Get the user by email
     :param url: str: Pass in the url of the avatar to be updated
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The updated user
     :doc-author: Trelent
     """
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    await db.commit()
+    await user_cache.cache_user(user)
     return user
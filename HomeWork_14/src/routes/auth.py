@@ -1,25 +1,32 @@
-from fastapi import Depends, HTTPException, status, APIRouter, Security, BackgroundTasks, Request
+from fastapi import Depends, HTTPException, status, APIRouter, Security, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordRequestForm
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from pydantic import EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.conf import messages as msg
 from src.database.db import get_db
+from src.database.models import User, MailKind
+from src.database.query_budget import QueryBudget
 from src.schemas import UserInput, TokenModel, RequestEmail, NewPasswordInput
 from src. repository import users as repository_users
+from src.repository import outbox as repository_outbox
+from src.services import user_cache
 from src.services.auth import auth_service
-from src.services.email import send_email, send_forgot_password
+from src.services.login_throttle import login_throttle
+from src.services.mail_coalesce import mail_coalescer
+from src.services.sessions import session_store
+from src.services.static_assets import static_assets
 
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = static_assets.url
 
 router = APIRouter(prefix="/auth", tags=['auth'])
 security = HTTPBearer()
 
 
-@router.post("/signup", status_code=status.HTTP_201_CREATED)
-async def signup(body: UserInput, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+@router.post("/signup", status_code=status.HTTP_201_CREATED, dependencies=[Depends(QueryBudget(4))])
+async def signup(body: UserInput, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes a UserInput object as input, which contains the following fields:
@@ -28,99 +35,150 @@ async def signup(body: UserInput, background_tasks: BackgroundTasks, request: Re
               being stored in the database.
 
     :param body: UserInput: Get the data from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Pass the database session to the repository_users
+    :param db: AsyncSession: Pass the database session to the repository_users
     :return: A dictionary with the detail key and a message as value
     :doc-author: Trelent
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=msg.ACCOUNT_ALREADY_EXISTS)
-    body.password = auth_service.get_password_hash(body.password)
-    new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, EmailStr(new_user.email), new_user.username, str(request.base_url))
+    body.password = await auth_service.get_password_hash(body.password)
+    # the confirmation email is committed together with the user
+    repository_outbox.add_email(MailKind.confirm_email, body.email,
+                                {"username": body.username, "host": str(request.base_url)}, db)
+    await repository_users.create_user(body, db)
     return {"detail": msg.USER_SUCCESSFULLY_CREATED}
 
 
-@router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/login", response_model=TokenModel, dependencies=[Depends(QueryBudget(2))])
+async def login(request: Request, body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
         It takes in the username and password of the user, and returns an access token if successful.
         The access token can be used to make authenticated requests.
+        Login attempts are throttled per account and per client ip before the password is checked.
 
+    :param request: Request: Get the client ip
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with the access token, refresh token and the type of bearer
     :doc-author: Trelent
     """
+    client_ip = request.client.host if request.client else ""
+    attempt = await login_throttle.check(body.username, client_ip)
     user = await repository_users.get_user_by_email(body.username, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.INVALID_EMAIL)
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.EMAIL_NOT_CONFIRMED)
-    if not auth_service.verify_password(body.password, user.password):
+    valid, new_hash = await auth_service.verify_and_update_password(body.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.INVALID_PASSWORD)
+    await login_throttle.succeeded(body.username, client_ip, attempt)
+    if new_hash is not None:
+        # the bcrypt cost was changed
+        await repository_users.change_password(user, new_hash, db)
+    jti, family = await session_store.create(user.email)
     # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token_ = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token_, db)
+    access_token = await auth_service.create_user_access_token(user)
+    refresh_token_ = await auth_service.create_refresh_token(data={"sub": user.email, "jti": jti, "fam": family})
     return {"access_token": access_token, "refresh_token": refresh_token_, "token_type": "bearer"}
 
 
-@router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+@router.get('/refresh_token', response_model=TokenModel, dependencies=[Depends(QueryBudget(1))])
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        db: AsyncSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns an access_token, a new refresh_token, and the type of token.
-        If there is no user with that email or if the user's current refresh_token does not match what was passed in,
-        then it will return an error message.
+        Only the latest refresh token of a session is accepted, and the session store in Redis is the only
+        storage it touches, unless the user is not in the user cache. If an older refresh token of the session
+        is presented, the session is revoked.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session on a miss of the user cache
     :return: A dictionary with the access_token, refresh_token and token_type
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.INVALID_USER)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    payload = await auth_service.decode_refresh_token(credentials.credentials)
+    email, jti, family = payload.get("sub"), payload.get("jti"), payload.get("fam")
+    new_jti = await session_store.rotate(email, jti, family) if email and jti and family else None
+    if new_jti is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.INVALID_REFRESH_TOKEN)
+    # the access token carries the role, which may have changed since the login
+    user = await user_cache.get_cached_user(email)
+    if user is None:
+        user = await repository_users.get_user_by_email(email, db)
+        if user is None:
+            await session_store.revoke(family)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.INVALID_USER)
+        await user_cache.cache_user(user)
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token_ = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token_, db)
+    access_token = await auth_service.create_user_access_token(user)
+    refresh_token_ = await auth_service.create_refresh_token(data={"sub": email, "jti": new_jti, "fam": family})
     return {"access_token": access_token, "refresh_token": refresh_token_, "token_type": "bearer"}
 
 
-@router.post('/forgot_password', status_code=status.HTTP_200_OK)
-async def forgot_password(body: RequestEmail, background_tasks: BackgroundTasks,
-                          request: Request, db: Session = Depends(get_db)):
+@router.post('/logout', dependencies=[Depends(QueryBudget(0))])
+async def logout(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    The logout function ends the session of a refresh token.
+
+    :param credentials: HTTPAuthorizationCredentials: Get the refresh token from the request header
+    :return: A message to the user
+    :doc-author: Trelent
+    """
+    payload = await auth_service.decode_refresh_token(credentials.credentials)
+    if payload.get("fam"):
+        await session_store.revoke(payload["fam"])
+    return {"detail": msg.LOGGED_OUT}
+
+
+@router.post('/logout_all', dependencies=[Depends(QueryBudget(1))])
+async def logout_all(current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The logout_all function ends all the sessions of the current user on all devices.
+
+    :param current_user: User: Get the current user from the access token
+    :return: A message to the user
+    :doc-author: Trelent
+    """
+    await session_store.revoke_all(current_user.email)
+    return {"detail": msg.LOGGED_OUT}
+
+
+@router.post('/forgot_password', status_code=status.HTTP_200_OK, dependencies=[Depends(QueryBudget(2))])
+async def forgot_password(body: RequestEmail, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The forgot_password function is used to send a password reset email to the user.
         The function takes in an email address and sends a password reset link to that address.
         If the user does not exist, then an error message is returned.
+        A repeated request within the coalescing window reuses the email of the first one.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A json object with a detail key and value
     :doc-author: Trelent
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msg.INVALID_EMAIL)
-    background_tasks.add_task(send_forgot_password, body.email, exist_user.username, str(request.base_url))
+    if await mail_coalescer.claim(MailKind.reset_password, exist_user.email):
+        try:
+            await repository_outbox.queue_email(MailKind.reset_password, exist_user.email,
+                                                {"username": exist_user.username, "host": str(request.base_url)}, db)
+        except Exception:
+            # nothing was queued, a retry must not be taken for a repeated request
+            await mail_coalescer.release(MailKind.reset_password, exist_user.email)
+            raise
     return {"detail": msg.PASSWORD_RESET_SEND}
 
 
-@router.get('/change_password/{token}', response_class=HTMLResponse, description="Change Password")
-async def reset_password(token: str, request: Request, db: Session = Depends(get_db)):
+@router.get('/change_password/{token}', response_class=HTMLResponse, description="Change Password",
+            dependencies=[Depends(QueryBudget(1))])
+async def reset_password(token: str, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The reset_password function is used to reset a user's password.
         It takes in the token from the email sent to the user, and then uses that token
@@ -129,7 +187,7 @@ async def reset_password(token: str, request: Request, db: Session = Depends(get
 
     :param token: str: Get the token from the url
     :param request: Request: Get the request object
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A templateresponse object
     :doc-author: Trelent
     """
@@ -140,8 +198,8 @@ async def reset_password(token: str, request: Request, db: Session = Depends(get
     return templates.TemplateResponse('password_change.html', {"request": request})
 
 
-@router.put('/change_password/{token}')
-async def change_password(token: str, body: NewPasswordInput, db: Session = Depends(get_db)):
+@router.put('/change_password/{token}', dependencies=[Depends(QueryBudget(2))])
+async def change_password(token: str, body: NewPasswordInput, db: AsyncSession = Depends(get_db)):
     """
     The change_password function is used to change the password of a user.
         It takes in a token and body as parameters, where the token is used to verify that the user has access
@@ -150,7 +208,7 @@ async def change_password(token: str, body: NewPasswordInput, db: Session = Depe
 
     :param token: str: Get the email from the token
     :param body: NewPasswordInput: Get the new password from the user
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with the key &quot;detail&quot; and value msg
     :doc-author: Trelent
     """
@@ -158,13 +216,15 @@ async def change_password(token: str, body: NewPasswordInput, db: Session = Depe
     user = await repository_users.get_user_by_email(email, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=msg.VERIFICATION_ERROR)
-    password = auth_service.get_password_hash(body.password)
+    password = await auth_service.get_password_hash(body.password)
     await repository_users.change_password(user, password, db)
+    await session_store.revoke_all(email)
+    await user_cache.bump_user_version(user.id)
     return {"detail": msg.PASSWORD_CHANGED}
 
 
-@router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+@router.get('/confirmed_email/{token}', dependencies=[Depends(QueryBudget(3))])
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         It takes in the token that was sent to the user's email and uses it to get their email address.
@@ -174,7 +234,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
         the function confirms the account by setting its 'confirmed' field to True.
 
     :param token: str: Get the email from the token
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :return: A message that the email has been confirmed
     :doc-author: Trelent
     """
@@ -188,19 +248,18 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     return {"detail": msg.EMAIL_CONFIRMED}
 
 
-@router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+@router.post('/request_email', dependencies=[Depends(QueryBudget(2))])
+async def request_email(body: RequestEmail, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that will allow them
     to confirm their account. The function takes in a RequestEmail object, which contains the email of
     the user who wants to confirm their account. It then checks if there is already an unconfirmed
     account associated with that email address, and if so it sends an email containing a confirmation link.
+    A repeated request within the coalescing window reuses the email of the first one.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A message to the user
     :doc-author: Trelent
     """
@@ -208,5 +267,12 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     if user:
         if user.confirmed:
             return {"message": msg.EMAIL_ALREADY_CONFIRMED}
-        background_tasks.add_task(send_email, EmailStr(user.email), user.username, str(request.base_url))
+        if await mail_coalescer.claim(MailKind.confirm_email, user.email):
+            try:
+                await repository_outbox.queue_email(MailKind.confirm_email, user.email,
+                                                    {"username": user.username, "host": str(request.base_url)}, db)
+            except Exception:
+                # nothing was queued, a retry must not be taken for a repeated request
+                await mail_coalescer.release(MailKind.confirm_email, user.email)
+                raise
     return {"detail": msg.CHECK_YOUR_EMAIL}
@@ -1,15 +1,19 @@
 from typing import List
 
-from fastapi import Depends, HTTPException, status, Path, Query, APIRouter
-from fastapi_limiter.depends import RateLimiter
+from fastapi import Depends, HTTPException, status, Path, Query, APIRouter, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy import exc
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.database.models import User, Role
+from src.conf.config import settings
+from src.database.db import get_db, get_read_db
+from src.database.models import Role
+from src.database.query_budget import QueryBudget
 from src.repository import contacts as repository_contacts
-from src.schemas import ContactInput, ContactOutput, ContactInListOutput
-from src.services.auth import auth_service
+from src.schemas import ContactInput, ContactOutput, ContactInListOutput, ContactPageOutput, ContactSort, \
+    ContactImportOutput, ExportFormat
+from src.services.contacts_io import read_csv, read_ndjson, EXPORT_FORMATS
+from src.services.rate_limit import RateLimit, parse_quotas
 from src.services.roles import RoleAccess
 
 router = APIRouter(prefix="/contacts", tags=['contacts'])
@@ -17,61 +21,106 @@ router = APIRouter(prefix="/contacts", tags=['contacts'])
 allowed_operation_get = RoleAccess([Role.admin, Role.moderator, Role.user])
 allowed_operation_create = RoleAccess([Role.admin, Role.moderator, Role.user])
 allowed_operation_update = RoleAccess([Role.admin, Role.moderator])
+allowed_operation_import = RoleAccess([Role.admin, Role.moderator])
+allowed_operation_export = RoleAccess([Role.admin, Role.moderator])
 allowed_operation_remove = RoleAccess([Role.admin])
 
+rate_limit_get = RateLimit("contacts:get", parse_quotas(settings.rate_limit_contacts_read))
+rate_limit_create = RateLimit("contacts:create", parse_quotas(settings.rate_limit_contacts_write))
+rate_limit_update = RateLimit("contacts:update", parse_quotas(settings.rate_limit_contacts_write))
 
-@router.get("/", response_model=List[ContactInListOutput],
-            dependencies=[Depends(allowed_operation_get), Depends(RateLimiter(times=2, seconds=5))])
+
+@router.get("/", response_model=ContactPageOutput,
+            dependencies=[Depends(allowed_operation_get), Depends(rate_limit_get),
+                          Depends(QueryBudget(1))])
 async def get_contacts(filter_type: int = Query(default=0, ge=0, le=4),
                        filter_str: str | None = None,
-                       _: User = Depends(auth_service.get_current_user),
-                       db: Session = Depends(get_db)):
+                       limit: int = Query(default=50, ge=1, le=500),
+                       cursor: str | None = None,
+                       sort: ContactSort = ContactSort.name,
+                       days: int = Query(default=7, ge=1, le=365),
+                       # pg_trgm needs three characters to search with the trigram indexes
+                       q: str | None = Query(default=None, min_length=3, max_length=64),
+                       db: AsyncSession = Depends(get_read_db)):
     """
-    The get_contacts function returns a list of contacts.
+    The get_contacts function returns one page of contacts.
+        To get the next page pass the returned next_cursor back with the same filter and sort parameters.
+        If q is set the filter and sort parameters are ignored and the best limit matches of q
+        in name, email, address and phones are returned by relevance in a single page.
 
     :param filter_type: int: Filter the contacts by type
     :param filter_str: str | None: Filter the contacts by name or phone number
-    :param _: User: Get the current user from the auth_service
-    :param db: Session: Pass the database session to the repository
-    :return: A list of contacts
+    :param limit: int: The maximum number of contacts in the page
+    :param cursor: str | None: The next_cursor of the previous page
+    :param sort: ContactSort: The sort order of the contacts
+    :param days: int: The window of upcoming birthdays in days for filter_type 4
+    :param q: str | None: Search the contacts by name, email, address or phone number
+    :param db: AsyncSession: Pass the database session to the repository
+    :return: A page of contacts and the cursor of the next page
+    :doc-author: Trelent
+    """
+    if q:
+        return {"items": await repository_contacts.search_cnt(db, q, limit), "next_cursor": None}
+    contacts, next_cursor = await repository_contacts.get_cnt(db, filter_type, filter_str,
+                                                              limit=limit, cursor=cursor, sort=sort.value, days=days)
+    return {"items": contacts, "next_cursor": next_cursor}
+
+
+@router.get("/export", response_class=StreamingResponse, dependencies=[Depends(allowed_operation_export)],
+            description='Only moderators and admin')
+async def export_contacts(format_: ExportFormat = Query(default=ExportFormat.csv, alias="format"),
+                          db: AsyncSession = Depends(get_read_db)):
+    """
+    The export_contacts function streams all contacts as a CSV, NDJSON or vCard file.
+        The rows are read through a server-side cursor and sent chunk by chunk as they arrive,
+        so memory does not grow with the number of contacts.
+
+    :param format_: ExportFormat: The format of the file
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :return: A streaming response with the file
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_cnt(db, filter_type, filter_str)
-    return contacts
+    media_type, header, format_chunk = EXPORT_FORMATS[format_.value]
 
+    async def content():
+        yield header
+        async for contacts in repository_contacts.stream_cnt(db):
+            yield format_chunk(contacts)
 
-@router.get("/{cnt_id}", response_model=ContactOutput, dependencies=[Depends(allowed_operation_get)])
+    return StreamingResponse(content(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="contacts.{format_.value}"'})
+
+
+@router.get("/{cnt_id}", response_model=ContactOutput,
+            dependencies=[Depends(allowed_operation_get), Depends(QueryBudget(1))])
 async def get_contact(cnt_id: int = Path(ge=1),
-                      _: User = Depends(auth_service.get_current_user),
-                      db: Session = Depends(get_db)):
+                      db: AsyncSession = Depends(get_read_db)):
     """
     The get_contact function returns a contact by id.
 
     :param cnt_id: int: Get the contact id from the url
-    :param _: User: Get the current user from the auth_service
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_cnt_by_id(cnt_id, db)
+    contact = await repository_contacts.get_cnt_by_id(cnt_id, db, load=ContactOutput)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact by id {cnt_id} not found")
     return contact
 
 
 @router.post("/", response_model=ContactInListOutput, status_code=status.HTTP_201_CREATED,
-             dependencies=[Depends(allowed_operation_create), Depends(RateLimiter(times=1, seconds=10))])
+             dependencies=[Depends(allowed_operation_create), Depends(rate_limit_create),
+                           Depends(QueryBudget(3))])
 async def create_contact(body: ContactInput,
-                         _: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: AsyncSession = Depends(get_db)):
     """
     The create_contact function creates a new contact in the database.
         The function takes a ContactInput object as input, which is validated by pydantic.
         If the validation fails, an HTTP 400 error is raised with details of what went wrong.
 
     :param body: ContactInput: Pass the contact information to be created
-    :param _: User: Get the current user
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A contact object, which is a dictionary
     :doc-author: Trelent
     """
@@ -79,18 +128,44 @@ async def create_contact(body: ContactInput,
         contact = await repository_contacts.create_cnt(body, db)
     except exc.SQLAlchemyError as err:
         if db.in_transaction():
-            db.rollback()
+            await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.args[0])
     return contact
 
 
+@router.post("/import", response_model=ContactImportOutput, dependencies=[Depends(allowed_operation_import)],
+             description='Only moderators and admin')
+async def import_contacts(request: Request,
+                          db: AsyncSession = Depends(get_db)):
+    """
+    The import_contacts function loads contacts from a CSV (text/csv) or NDJSON (application/x-ndjson) request body.
+        The body is parsed while it is received and inserted in batches, so the size of the file is not limited
+        by memory. Bad rows are skipped and listed in the report.
+
+    :param request: Request: Read the body of the request as a stream
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :return: The import report
+    :doc-author: Trelent
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    match content_type:
+        case "text/csv":
+            rows = read_csv(request.stream())
+        case "application/x-ndjson" | "application/jsonl":
+            rows = read_ndjson(request.stream())
+        case _:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                detail="Send text/csv or application/x-ndjson")
+    return await repository_contacts.import_cnt(rows, db)
+
+
 @router.put("/{cnt_id}", response_model=ContactInListOutput,
-            dependencies=[Depends(allowed_operation_update), Depends(RateLimiter(times=1, seconds=10))],
+            dependencies=[Depends(allowed_operation_update), Depends(rate_limit_update),
+                          Depends(QueryBudget(5))],
             description='Only moderators and admin')
 async def update_contact(body: ContactInput,
                          cnt_id: int = Path(ge=1),
-                         _: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: AsyncSession = Depends(get_db)):
     """
     The update_contact function updates a contact in the database.
         The function takes an id and a body as input, and returns the updated contact.
@@ -99,8 +174,7 @@ async def update_contact(body: ContactInput,
 
     :param body: ContactInput: Define the input schema,
     :param cnt_id: int: Get the contact id from the url
-    :param _: User: Get the current user from the auth_service
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A contact object
     :doc-author: Trelent
     """
@@ -110,24 +184,22 @@ async def update_contact(body: ContactInput,
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact by id {cnt_id} not found")
     except exc.SQLAlchemyError as err:
         if db.in_transaction():
-            db.rollback()
+            await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.args[0])
     return contact
 
 
-@router.delete("/{cnt_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(allowed_operation_remove)],
-               description='Only admin')
+@router.delete("/{cnt_id}", status_code=status.HTTP_204_NO_CONTENT,
+               dependencies=[Depends(allowed_operation_remove), Depends(QueryBudget(3))], description='Only admin')
 async def delete_contact(cnt_id: int = Path(ge=1),
-                         _: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: AsyncSession = Depends(get_db)):
     """
     The delete_contact function deletes a contact from the database.
         The function takes in an id of the contact to be deleted and returns a 204 status code if successful.
         If no such contact exists, it returns 404 status code.
 
     :param cnt_id: int: Get the contact id from the path
-    :param _: User: Make sure that the user is authenticated before they can delete a contact
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A contact object
     :doc-author: Trelent
     """
@@ -137,5 +209,5 @@ async def delete_contact(cnt_id: int = Path(ge=1),
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact by id {cnt_id} not found")
     except exc.SQLAlchemyError as err:
         if db.in_transaction():
-            db.rollback()
+            await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.args[0])
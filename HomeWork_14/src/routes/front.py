@@ -2,6 +2,8 @@ from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
+from src.services.static_assets import static_assets
+
 templates = Jinja2Templates(directory="templates")
 router = APIRouter(tags=['front'])
 
@@ -20,6 +22,7 @@ def format_date(value):
 
 
 templates.env.filters["format_date"] = format_date
+templates.env.globals["asset_url"] = static_assets.url
 
 
 @router.get("/", response_class=HTMLResponse, description="Main Page")
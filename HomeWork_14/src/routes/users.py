@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
 from src.schemas import UserOutput
-from src.services.cloud_image import CloudImage
+from src.services.avatar_storage import avatar_storage
+from src.services.images import AVATAR_REQUEST_BODY, avatar_upload
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -24,20 +25,19 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
     return current_user
 
 
-@router.patch('/avatar', response_model=UserOutput)
-async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+@router.patch('/avatar', response_model=UserOutput, openapi_extra=AVATAR_REQUEST_BODY)
+async def update_avatar_user(current_user: User = Depends(auth_service.get_current_user),
+                             file: bytes = Depends(avatar_upload), db: AsyncSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
+    The image is kept by the avatar storage backend of the avatar_storage setting.
 
-    :param file: UploadFile: Get the file that is uploaded by the user
     :param current_user: User: Get the current user
-    :param db: Session: Pass the database session to the function
+    :param file: bytes: Get the file that is uploaded by the user, after the user is authenticated
+    :param db: AsyncSession: Pass the database session to the function
     :return: The user object
     :doc-author: Trelent
     """
-    public_id = CloudImage.generate_name_avatar(current_user.email)
-    r = CloudImage.upload(file.file, public_id)
-    src_url = CloudImage.get_url_for_avatar(public_id, r)
+    src_url = await avatar_storage.save(file, current_user.email)
     user = await repository_users.update_avatar(current_user.email, src_url, db)
     return user
@@ -1,6 +1,7 @@
 from datetime import date
+from enum import Enum
 
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, validator
 from typing import Optional, List
 
 from src.database.models import Role
@@ -19,12 +20,20 @@ class PhoneOutput(BaseModel):
 
 
 class ContactInput(BaseModel):
-    first_name: str = Field()
-    last_name: Optional[str]
+    # the lengths of the contacts columns
+    first_name: str = Field(max_length=64)
+    last_name: Optional[str] = Field(max_length=64)
     email: EmailStr
     birthday: Optional[date] = None
-    address: Optional[str] = None
-    phones: Optional[List[PhoneOutput]] = []
+    address: Optional[str] = Field(None, max_length=128)
+    # None (not sent) leaves the phones of an updated contact untouched, [] removes them
+    phones: Optional[List[PhoneOutput]] = None
+
+    @validator("email")
+    def email_length(cls, value):
+        if len(value) > 64:
+            raise ValueError("ensure this value has at most 64 characters")
+        return value
 
     class Config:
         schema_extra = {
@@ -81,6 +90,62 @@ class ContactInListOutput(BaseModel):
         }
 
 
+class ContactSort(str, Enum):
+    name = "name"
+    name_desc = "-name"
+    email = "email"
+    email_desc = "-email"
+    created = "created"
+    created_desc = "-created"
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    vcf = "vcf"
+
+
+class ContactPageOutput(BaseModel):
+    items: List[ContactInListOutput]
+    next_cursor: Optional[str] = None
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "items": [
+                    {
+                        "id": 1,
+                        "full_name": "Ben Smith",
+                        "email": "example@example.ua",
+                        "birthday": "1968-12-01",
+                    }
+                ],
+                "next_cursor": "WyJuYW1lIiwgIkJlbiIsICJTbWl0aCIsIDFd",
+            }
+        }
+
+
+class ImportRowError(BaseModel):
+    row: int
+    detail: str
+
+
+class ContactImportOutput(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[ImportRowError] = []
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "inserted": 998,
+                "failed": 2,
+                "errors": [{"row": 17, "detail": "Entered phone '12345' is incorrect."},
+                           {"row": 512, "detail": "Contact with email example@example.ua already exists."}],
+            }
+        }
+
+
 class UserInput(BaseModel):
     username: str = Field(min_length=3, max_length=12)
     email: EmailStr
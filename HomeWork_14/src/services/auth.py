@@ -1,30 +1,41 @@
-import pickle
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 # import redis as redis
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer  # Bearer token
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
 from src.conf.config import settings
-from src.database.db import get_db, redis_db
+from src.database.db import get_db
+from src.database.models import User, Role
 from src.repository import users as repository_users
+from src.services import user_cache
+from src.services.passwords import password_hasher
+from src.services.token_cache import access_tokens
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    email: str
+    user_id: int
+    role: Role
+    confirmed: bool
+    version: int
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-    def verify_password(self, plain_password, hashed_password):
+    async def verify_password(self, plain_password, hashed_password):
         """
         The verify_password function takes a plain-text password and hashed
-        password as arguments. It then uses the pwd_context object to verify that the
-        plain-text password matches the hashed one.
+        password as arguments. The bcrypt check runs in the thread pool of the password_hasher,
+        so it does not block the event loop.
 
         :param self: Represent the instance of the class
         :param plain_password: Check the password entered by the user
@@ -32,19 +43,32 @@ class Auth:
         :return: A boolean value
         :doc-author: Trelent
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await password_hasher.verify(plain_password, hashed_password)
+
+    async def verify_and_update_password(self, plain_password: str, hashed_password: str):
+        """
+        The verify_and_update_password function checks the password like verify_password, and also returns
+        a new hash when the stored one was made with another bcrypt cost than settings.bcrypt_rounds.
 
-    def get_password_hash(self, password: str):
+        :param self: Represent the instance of the class
+        :param plain_password: str: The password entered by the user
+        :param hashed_password: str: The hashed password in the database
+        :return: A tuple of the check result and the new hash or None
+        :doc-author: Trelent
+        """
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+
+    async def get_password_hash(self, password: str):
         """
         The get_password_hash function takes a password as input and returns the hash of that password.
-        The hash is generated using the pwd_context object, which is an instance of Flask-Bcrypt's Bcrypt class.
+        The hash is generated with the configured bcrypt cost in the thread pool of the password_hasher.
 
         :param self: Represent the instance of the class
         :param password: str: Get the password from the user
         :return: A hashed password
         :doc-author: Trelent
         """
-        return self.pwd_context.hash(password)
+        return await password_hasher.hash(password)
 
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
         """
@@ -73,11 +97,11 @@ class Auth:
         """
         The create_refresh_token function creates a refresh token for the user.
             Args:
-                data (dict): A dictionary containing the user's id and username.
+                data (dict): A dictionary containing the user's email, the jti of the token and its session family.
                 expires_delta (Optional[float]): The number of seconds until the token expires, defaults to None.
 
         :param self: Represent the instance of the class
-        :param data: dict: Store the user's id and username
+        :param data: dict: Store the user's email, the jti and the family of the session
         :param expires_delta: Optional[float]: Set the expiration time of the refresh token
         :return: An encoded refresh token
         :doc-author: Trelent
@@ -86,22 +110,37 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=settings.refresh_token_ttl)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
         encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def create_user_access_token(self, user: User):
         """
-        The get_current_user function is a dependency that will be used in the
-            UserRouter class. It takes in a token and db as parameters, and returns
-            the user object associated with that token. If no user is found, it raises
-            an exception.
+        The create_user_access_token function creates an access token that carries the id, the role, the confirmed
+        flag and the current version of the user, so routes that only authorize a request need no lookups.
 
-        :param self: Access the class attributes
+        :param self: Represent the instance of the class
+        :param user: User: The user the token is issued to
+        :return: A jwt token
+        :doc-author: Trelent
+        """
+        version = await user_cache.get_user_version(user.id)
+        return await self.create_access_token(data={"sub": user.email, "uid": user.id,
+                                                    "role": (user.roles or Role.user).value,
+                                                    "confirmed": bool(user.confirmed), "ver": version})
+
+    async def get_token_claims(self, token: str = Depends(oauth2_scheme)):
+        """
+        The get_token_claims function is a dependency that verifies an access token and returns its claims.
+            The claims of a verified token are cached by a digest of the token until it expires, so a client
+            that sends the same token again skips the signature check. The version of the user is compared
+            with the one cached by the worker, so a token issued before a role change is rejected and the
+            client has to refresh it.
+
+        :param self: Represent the instance of the class
         :param token: str: Pass the token to the function
-        :param db: Session: Pass the database connection to the function
-        :return: A user object
+        :return: The claims of the token
         :doc-author: Trelent
         """
         credentials_exception = HTTPException(
@@ -110,48 +149,67 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload.get("scope") == "access_token":
-                email = payload.get("sub")
-                if email is None:
+        claims = access_tokens.get(token)
+        if claims is None:
+            try:
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+                if payload.get("scope") != "access_token":
                     raise credentials_exception
-            else:
+                claims = TokenClaims(email=payload["sub"], user_id=payload["uid"], role=Role(payload["role"]),
+                                     confirmed=payload["confirmed"], version=payload["ver"])
+            except (JWTError, KeyError, ValueError):
                 raise credentials_exception
-        except JWTError:
+            access_tokens.set(token, payload["exp"], claims)
+
+        if claims.version < await user_cache.get_user_version(claims.user_id):
             raise credentials_exception
+        return claims
+
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+        """
+        The get_current_user function is a dependency that will be used in the
+            UserRouter class. It takes in a token and db as parameters, and returns
+            the user object associated with that token. If no user is found, it raises
+            an exception.
 
-        user = await redis_db.get(f"user:{email}")
+        :param self: Access the class attributes
+        :param token: str: Pass the token to the function
+        :param db: AsyncSession: Pass the database connection to the function
+        :return: A user object
+        :doc-author: Trelent
+        """
+        claims = await self.get_token_claims(token)
+
+        user = await user_cache.get_cached_user(claims.email)
         if user is None:
-            user = await repository_users.get_user_by_email(email, db)
+            user = await repository_users.get_user_by_email(claims.email, db)
             if user is None:
-                raise credentials_exception
-            await redis_db.set(f"user:{email}", pickle.dumps(user))
-            await redis_db.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Could not validate credentials",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+            await user_cache.cache_user(user)
 
         return user
 
     async def decode_refresh_token(self, refresh_token: str):
         """
         The decode_refresh_token function is used to decode the refresh token.
-        It takes a refresh_token as an argument and returns the email of the user if it's valid.
+        It takes a refresh_token as an argument and returns its claims if it's valid.
         If not, it raises an HTTPException with status code 401 (UNAUTHORIZED) and detail
         'Could not validate credentials'.
 
 
         :param self: Represent the instance of the class
         :param refresh_token: str: Pass the refresh token to the function
-        :return: The email of the user who has logged in
+        :return: The claims with the email (sub), the jti and the session family (fam) of the token
         :doc-author: Trelent
         """
         try:
             payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+                return payload
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
@@ -0,0 +1,104 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+from pathlib import Path
+
+from src.conf.config import settings
+from src.services.cloud_image import CloudImage
+from src.services.images import prepare_avatar, resize_variants
+from src.services.static_files import ImmutableStaticFiles
+
+
+class AvatarStorage(ABC):
+    @abstractmethod
+    async def save(self, image: bytes, owner: str) -> str:
+        """
+        The save function stores an uploaded avatar.
+
+        :param image: bytes: The uploaded image
+        :param owner: str: The email of the user
+        :return: The url of the avatar
+        :doc-author: Trelent
+        """
+
+
+class CloudinaryStorage(AvatarStorage):
+    """Uploads one avatar-sized JPEG per user, Cloudinary makes other sizes from it on request."""
+
+    def __init__(self):
+        CloudImage.configure()
+
+    async def save(self, image: bytes, owner: str) -> str:
+        public_id = CloudImage.generate_name_avatar(owner)
+        r = await CloudImage.upload(await prepare_avatar(image), public_id)
+        return CloudImage.get_url_for_avatar(public_id, r)
+
+
+class LocalStorage(AvatarStorage):
+    """
+    Keeps the avatars on the local filesystem, addressed by the hash of the uploaded file:
+
+        {root}/{hash[:2]}/{hash}/{size}.jpg
+
+    All the sizes are made once at upload, and an image that is already stored is not decoded again,
+    whoever uploads it. The files never change, so they are served with immutable caching.
+    """
+
+    def __init__(self, root: Path, base_url: str, sizes: list[int]):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+        self.sizes = sizes
+
+    @staticmethod
+    def digest(image: bytes) -> str:
+        return blake2b(image, digest_size=16).hexdigest()
+
+    def path(self, digest: str, size: int) -> Path:
+        return self.root / digest[:2] / digest / f"{size}.jpg"
+
+    def url(self, digest: str, size: int) -> str:
+        return f"{self.base_url}/{digest[:2]}/{digest}/{size}.jpg"
+
+    def _write_variants(self, image: bytes, digest: str) -> None:
+        missing = [size for size in self.sizes if not self.path(digest, size).exists()]
+        if not missing:
+            return
+        for size, variant in resize_variants(image, missing).items():
+            path = self.path(digest, size)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # a parallel upload of the same image may write the same file, the rename keeps it whole
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{id(variant)}.tmp")
+            tmp_path.write_bytes(variant)
+            os.replace(tmp_path, path)
+
+    async def save(self, image: bytes, owner: str) -> str:
+        digest = self.digest(image)
+        await asyncio.to_thread(self._write_variants, image, digest)
+        return self.url(digest, self.sizes[0])
+
+    def files(self) -> ImmutableStaticFiles:
+        return ImmutableStaticFiles(directory=self.root, check_dir=False)
+
+
+def parse_sizes(value: str) -> list[int]:
+    return [int(size) for size in value.split(",")]
+
+
+def make_storage(name: str) -> AvatarStorage:
+    """
+    The make_storage function creates the avatar storage backend of the avatar_storage setting.
+
+    :param name: str: cloudinary or local
+    :return: The storage backend
+    :doc-author: Trelent
+    """
+    if name == "cloudinary":
+        return CloudinaryStorage()
+    if name == "local":
+        return LocalStorage(Path(settings.avatar_local_root), settings.avatar_local_url,
+                            parse_sizes(settings.avatar_sizes))
+    raise ValueError(f"Unknown avatar storage: {name}")
+
+
+avatar_storage = make_storage(settings.avatar_storage)
@@ -1,28 +1,72 @@
 import hashlib
+import logging
+from time import time
 
 import cloudinary
-import cloudinary.uploader
+import cloudinary.utils
+import httpx
+from fastapi import HTTPException, status
 
+from src.conf import messages as msg
 from src.conf.config import settings
 
+logger = logging.getLogger(__name__)
+
 
 class CloudImage:
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
+    # one keep-alive connection pool for all the uploads of the worker, made by configure, closed on shutdown
+    http: httpx.AsyncClient | None = None
+
+    @classmethod
+    def configure(cls) -> None:
+        """
+        The configure function sets the Cloudinary credentials and opens the upload client.
+        It is called by the Cloudinary storage only, so the other backends never touch Cloudinary.
+
+        :return: None
+        :doc-author: Trelent
+        """
+        cloudinary.config(
+            cloud_name=settings.cloudinary_name,
+            api_key=settings.cloudinary_api_key,
+            api_secret=settings.cloudinary_api_secret,
+            secure=True
+        )
+        if cls.http is None:
+            cls.http = httpx.AsyncClient(timeout=settings.avatar_upload_timeout)
+
+    @classmethod
+    async def aclose(cls) -> None:
+        if cls.http is not None:
+            await cls.http.aclose()
+            cls.http = None
 
     @staticmethod
     def generate_name_avatar(email: str):
         name = hashlib.sha256(email.encode('utf-8')).hexdigest()[:12]
         return f"web9/{name}"
 
-    @staticmethod
-    def upload(file, public_id: str):
-        r = cloudinary.uploader.upload(file, public_id=public_id, overwrite=True)
-        return r
+    @classmethod
+    async def upload(cls, image: bytes, public_id: str) -> dict:
+        """
+        The upload function sends a prepared image to the Cloudinary upload API as a signed request,
+        without blocking the event loop.
+
+        :param image: bytes: The JPEG to upload
+        :param public_id: str: The name of the image in Cloudinary
+        :return: The upload result of Cloudinary
+        :doc-author: Trelent
+        """
+        params = cloudinary.utils.sign_request({"public_id": public_id, "overwrite": True,
+                                                "timestamp": int(time())}, {})
+        try:
+            response = await cls.http.post(cloudinary.utils.cloudinary_api_url("upload"), data=params,
+                                           files={"file": ("avatar.jpg", image, "image/jpeg")})
+            response.raise_for_status()
+        except httpx.HTTPError as err:
+            logger.warning("Avatar upload failed: %s", err)
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=msg.IMAGE_UPLOAD_FAILED)
+        return response.json()
 
     @staticmethod
     def get_url_for_avatar(public_id, r):
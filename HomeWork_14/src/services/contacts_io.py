@@ -0,0 +1,205 @@
+import codecs
+import csv
+import io
+import json
+import re
+from typing import AsyncIterator
+
+MAX_LINE_LENGTH = 64 * 1024
+MAX_RECORD_LINES = 100
+
+CSV_FIELDS = ("first_name", "last_name", "email", "birthday", "address", "phones")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    The iter_lines function splits a stream of utf-8 encoded chunks into text lines without reading it all.
+
+    :param chunks: AsyncIterator[bytes]: The body of the request, e.g. request.stream()
+    :return: An async iterator of lines without the line ends
+    :doc-author: Trelent
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if len(buffer) > MAX_LINE_LENGTH:
+            raise ValueError(f"Line is longer than {MAX_LINE_LENGTH} characters.")
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        yield buffer.rstrip("\r")
+
+
+async def _with_end(lines: AsyncIterator[str]) -> AsyncIterator[str | None]:
+    async for line in lines:
+        yield line
+    yield None
+
+
+def split_phones(phones) -> list[dict]:
+    """
+    The split_phones function turns the phones of an imported row into the ContactInput format.
+        A CSV cell holds the numbers separated by commas or semicolons, a NDJSON row holds a list
+        of numbers or of {"phone_num": ...} objects.
+
+    :param phones: The phones value of the row
+    :return: A list of {"phone_num": ...} dicts
+    :doc-author: Trelent
+    """
+    if not phones:
+        return []
+    if isinstance(phones, str):
+        phones = [phone.strip() for phone in re.split(r"[,;]", phones) if phone.strip()]
+    return [phone if isinstance(phone, dict) else {"phone_num": str(phone)} for phone in phones]
+
+
+async def read_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | ValueError]]:
+    """
+    The read_csv function parses a CSV upload row by row.
+        The first line is the header, columns are named like the fields of ContactInput. A quoted field may span
+        up to MAX_RECORD_LINES lines and MAX_LINE_LENGTH characters. Rows that cannot be parsed are yielded
+        as a ValueError, so the caller can report them and go on with the rest of the file, also the row
+        of a quote that is not closed within these limits.
+
+    :param chunks: AsyncIterator[bytes]: The body of the request
+    :return: An async iterator of (row number, row dict or error)
+    :doc-author: Trelent
+    """
+    header = None
+    record_lines, quotes, length = [], 0, 0
+    row_num = 0
+    async for line in _with_end(iter_lines(chunks)):
+        pending = [line]
+        while pending:
+            line = pending.pop(0)
+            if line is not None:
+                record_lines.append(line)
+                quotes += line.count('"')
+                length += len(line) + 1
+            if quotes % 2:
+                if line is not None and len(record_lines) < MAX_RECORD_LINES and length <= MAX_LINE_LENGTH:
+                    # the quoted field goes on in the next line
+                    continue
+                if header is None:
+                    raise ValueError("Unterminated quoted field in the CSV header.")
+                row_num += 1
+                yield row_num, ValueError("Unterminated quoted field.")
+                # only the line with the open quote is dropped, the lines after it are parsed again
+                pending = record_lines[1:] + ([None] if line is None else []) + pending
+                record_lines, quotes, length = [], 0, 0
+                continue
+            record = "\n".join(record_lines)
+            record_lines, quotes, length = [], 0, 0
+            if not record.strip():
+                continue
+            try:
+                values = next(csv.reader([record]))
+            except csv.Error as err:
+                if header is None:
+                    raise ValueError(f"Invalid CSV header: {err}")
+                row_num += 1
+                yield row_num, ValueError(f"Invalid CSV row: {err}")
+                continue
+            if header is None:
+                header = [name.strip().lower() for name in values]
+                if "first_name" not in header or "email" not in header:
+                    raise ValueError(f"CSV header must name the columns {', '.join(CSV_FIELDS)}.")
+                continue
+            row_num += 1
+            if len(values) != len(header):
+                yield row_num, ValueError(f"Expected {len(header)} values, got {len(values)}.")
+                continue
+            row = {name: value.strip() or None for name, value in zip(header, values)}
+            row["phones"] = split_phones(row.get("phones"))
+            yield row_num, row
+
+
+async def read_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | ValueError]]:
+    """
+    The read_ndjson function parses a newline delimited JSON upload, one contact object per line.
+
+    :param chunks: AsyncIterator[bytes]: The body of the request
+    :return: An async iterator of (row number, row dict or error)
+    :doc-author: Trelent
+    """
+    row_num = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        row_num += 1
+        try:
+            row = json.loads(line)
+        except ValueError as err:
+            yield row_num, ValueError(f"Invalid JSON: {err}")
+            continue
+        if not isinstance(row, dict):
+            yield row_num, ValueError("Row must be a JSON object.")
+            continue
+        if not isinstance(row.get("phones"), (list, str, type(None))):
+            yield row_num, ValueError("Phones must be a list or a string.")
+            continue
+        row["phones"] = split_phones(row.get("phones"))
+        yield row_num, row
+
+
+def csv_chunk(contacts: list[dict]) -> str:
+    """
+    The csv_chunk function formats a chunk of exported contacts as CSV rows in the import format.
+
+    :param contacts: list[dict]: The contacts with their phones
+    :return: The CSV rows
+    :doc-author: Trelent
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    for contact in contacts:
+        writer.writerow([contact["first_name"], contact["last_name"] or "", contact["email"],
+                         contact["birthday"] or "", contact["address"] or "", "; ".join(contact["phones"])])
+    return output.getvalue()
+
+
+def ndjson_chunk(contacts: list[dict]) -> str:
+    """
+    The ndjson_chunk function formats a chunk of exported contacts as newline delimited JSON.
+
+    :param contacts: list[dict]: The contacts with their phones
+    :return: One JSON object per line
+    :doc-author: Trelent
+    """
+    return "".join(json.dumps(contact, default=str, ensure_ascii=False) + "\n" for contact in contacts)
+
+
+def _vcard_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;").replace("\n", "\\n")
+
+
+def vcf_chunk(contacts: list[dict]) -> str:
+    """
+    The vcf_chunk function formats a chunk of exported contacts as vCard 3.0 cards.
+
+    :param contacts: list[dict]: The contacts with their phones
+    :return: The vCard cards
+    :doc-author: Trelent
+    """
+    lines = []
+    for contact in contacts:
+        first_name, last_name = _vcard_escape(contact["first_name"]), _vcard_escape(contact["last_name"] or "")
+        lines += ["BEGIN:VCARD", "VERSION:3.0", f"N:{last_name};{first_name};;;",
+                  f"FN:{first_name}{' ' + last_name if last_name else ''}", f"EMAIL:{_vcard_escape(contact['email'])}"]
+        if contact["birthday"]:
+            lines.append(f"BDAY:{contact['birthday']}")
+        if contact["address"]:
+            lines.append(f"ADR:;;{_vcard_escape(contact['address'])};;;;")
+        lines += [f"TEL:+{phone}" for phone in contact["phones"]]
+        lines.append("END:VCARD")
+    return "".join(line + "\r\n" for line in lines)
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ",".join(CSV_FIELDS) + "\n", csv_chunk),
+    "ndjson": ("application/x-ndjson", "", ndjson_chunk),
+    "vcf": ("text/vcard", "", vcf_chunk),
+}
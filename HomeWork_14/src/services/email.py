@@ -1,30 +1,39 @@
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import EmailStr
 
+from src.database.models import EmailOutbox, MailKind
 from src.services.auth import auth_service
 from src.conf.config import settings
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_from),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Free Assistant",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
-
-
-async def send_email(email: EmailStr, username: str, host: str):
+templates = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'), autoescape=select_autoescape())
+
+
+def build_message(email: EmailStr, subject: str, template_name: str, template_body: dict) -> EmailMessage:
+    """
+    The build_message function renders an html template into an email from the service address.
+
+    :param email: EmailStr: The address of the recipient
+    :param subject: str: The subject of the email
+    :param template_name: str: The file name of the template
+    :param template_body: dict: The variables of the template
+    :return: The message to send
+    :doc-author: Trelent
     """
-    The send_email function sends an email to the user with a link to confirm their email address.
+    message = EmailMessage()
+    message["From"] = formataddr(("Free Assistant", settings.mail_from))
+    message["To"] = email
+    message["Subject"] = subject
+    message.set_content(templates.get_template(template_name).render(**template_body), subtype="html")
+    return message
+
+
+def confirmation_email(email: EmailStr, username: str, host: str) -> EmailMessage:
+    """
+    The confirmation_email function builds the email to the user with a link to confirm their email address.
         The function takes in three parameters:
             -email: EmailStr, the user's email address.
             -username: str, the username of the user who is registering for an account.  This will be used in a greeting message within the body of the email sent to them.
@@ -33,27 +42,17 @@ async def send_email(email: EmailStr, username: str, host: str):
     :param email: EmailStr: Validate the email address
     :param username: str: Pass the username to the email template
     :param host: str: Pass the host of the server to the email template
-    :return: A coroutine, which is a special type of object that works with asyncio
+    :return: The message to send
     :doc-author: Trelent
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
-
-
-async def send_forgot_password(email: EmailStr, username: str, host: str):
+    token_verification = auth_service.create_email_token({"sub": email})
+    return build_message(email, "Confirm your email", "email_template.html",
+                         {"host": host, "username": username, "token": token_verification})
+
+
+def password_reset_email(email: EmailStr, username: str, host: str) -> EmailMessage:
     """
-    The send_forgot_password function sends an email to the user with a link to reset their password.
+    The password_reset_email function builds the email to the user with a link to reset their password.
         Args:
             email (str): The user's email address.
             username (str): The user's username.
@@ -62,19 +61,24 @@ async def send_forgot_password(email: EmailStr, username: str, host: str):
     :param email: EmailStr: Specify the email address of the user who forgot their password
     :param username: str: Display the username in the email
     :param host: str: Pass the host name to the template
-    :return: A coroutine, which is an object that can be used to start a task
+    :return: The message to send
+    :doc-author: Trelent
+    """
+    token_verification = auth_service.create_password_token({"sub": email})
+    return build_message(email, "Forgot password.", "forgot_pass_template.html",
+                         {"host": host, "username": username, "token": token_verification})
+
+
+outbox_templates = {MailKind.confirm_email: confirmation_email, MailKind.reset_password: password_reset_email}
+
+
+def outbox_message(email: EmailOutbox) -> EmailMessage:
+    """
+    The outbox_message function builds the message of an outbox email. The token in the link is signed now,
+    so it is valid for its whole lifetime from the time the email is sent.
+
+    :param email: EmailOutbox: The outbox row
+    :return: The message to send
     :doc-author: Trelent
     """
-    try:
-        token_verification = auth_service.create_password_token({"sub": email})
-        message = MessageSchema(
-            subject="Forgot password.",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="forgot_pass_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    return outbox_templates[email.kind](email.recipient, email.payload["username"], email.payload["host"])
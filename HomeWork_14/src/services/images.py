@@ -0,0 +1,116 @@
+import asyncio
+from io import BytesIO
+from typing import AsyncGenerator, Iterable
+
+from fastapi import HTTPException, Request, status
+from PIL import Image, ImageOps, UnidentifiedImageError
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from src.conf import messages as msg
+from src.conf.config import settings
+
+# the request body of the routes that read the avatar with avatar_upload, for the OpenAPI schema
+AVATAR_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object", "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}},
+        }}},
+    },
+}
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=msg.IMAGE_TOO_LARGE)
+
+
+async def _limited(stream: AsyncGenerator[bytes, None], max_bytes: int) -> AsyncGenerator[bytes, None]:
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > max_bytes:
+            raise _too_large()
+        yield chunk
+
+
+async def avatar_upload(request: Request) -> bytes:
+    """
+    The avatar_upload function reads the file field of a multipart request while it is received, and stops
+    with 413 as soon as the body is larger than avatar_max_bytes, before the rest of it is read.
+
+    :param request: Request: The request with the multipart body
+    :return: The content of the uploaded file
+    :doc-author: Trelent
+    """
+    max_bytes = settings.avatar_max_bytes
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        raise _too_large()
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=msg.INVALID_IMAGE)
+    parser = MultiPartParser(request.headers, _limited(request.stream(), max_bytes), max_files=1, max_fields=1)
+    try:
+        form = await parser.parse()
+    except MultiPartException as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.message)
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=msg.INVALID_IMAGE)
+        return await file.read()
+    finally:
+        await form.close()
+
+
+def resize_variants(data: bytes, sizes: Iterable[int]) -> dict[int, bytes]:
+    """
+    The resize_variants function decodes an image once and crops it to a size x size square in the middle
+    for each of the sizes, encoded as JPEG. A JPEG is decoded at the smallest scale that is still larger
+    than the largest square, and the pixel count is checked from the header, before anything is decoded.
+
+    :param data: bytes: The encoded image
+    :param sizes: Iterable[int]: The sides of the squares
+    :return: The encoded JPEG of each size
+    :doc-author: Trelent
+    """
+    sizes = list(sizes)
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if image.width * image.height > settings.avatar_max_pixels:
+                raise _too_large()
+            image.draft("RGB", (max(sizes), max(sizes)))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=msg.INVALID_IMAGE)
+    variants = {}
+    for size in sizes:
+        output = BytesIO()
+        ImageOps.fit(image, (size, size), Image.LANCZOS).save(output, "JPEG", quality=settings.avatar_quality,
+                                                              optimize=True)
+        variants[size] = output.getvalue()
+    return variants
+
+
+def resize_image(data: bytes, size: int) -> bytes:
+    """
+    The resize_image function crops an image to a size x size square in the middle and encodes it as JPEG.
+
+    :param data: bytes: The encoded image
+    :param size: int: The side of the square
+    :return: The encoded JPEG
+    :doc-author: Trelent
+    """
+    return resize_variants(data, [size])[size]
+
+
+async def prepare_avatar(data: bytes) -> bytes:
+    """
+    The prepare_avatar function resizes an uploaded avatar in a thread, so decoding it does not block the event loop.
+
+    :param data: bytes: The uploaded image
+    :return: The avatar as a JPEG of avatar_size x avatar_size
+    :doc-author: Trelent
+    """
+    return await asyncio.to_thread(resize_image, data, settings.avatar_size)
@@ -0,0 +1,120 @@
+import logging
+import math
+from time import time
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf import messages as msg
+from src.conf.config import settings
+from src.database.db import redis_db
+
+logger = logging.getLogger(__name__)
+
+
+class LoginThrottle:
+    """
+    A sliding window of login attempts in Redis, one sorted set per account and one per client ip.
+    Every attempt is recorded before the user is read and before any bcrypt work, and a successful login
+    takes its attempt back, so a burst of parallel attempts is counted before the first one fails.
+    Once a key has `limit` attempts in the window, the next one has to wait base_delay after the previous
+    attempt, doubled for each attempt above the limit. Redis errors let the login through.
+    """
+
+    def __init__(self, redis: Redis, window: int, account_limit: int, ip_limit: int, base_delay: float,
+                 max_delay: float):
+        self.redis = redis
+        self.window = window
+        self.account_limit = account_limit
+        self.ip_limit = ip_limit
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def account_key(email: str) -> str:
+        return f"login:attempts:account:{email.lower()}"
+
+    @staticmethod
+    def ip_key(ip: str) -> str:
+        return f"login:attempts:ip:{ip}"
+
+    def backoff(self, attempts: int, limit: int) -> float:
+        """
+        The backoff function returns how long the next attempt must wait after the previous one.
+
+        :param attempts: int: The attempts already in the window
+        :param limit: int: The attempts allowed before the backoff starts
+        :return: The delay in seconds, 0 below the limit
+        :doc-author: Trelent
+        """
+        if attempts < limit:
+            return 0.0
+        return min(self.base_delay * 2 ** (attempts - limit), self.max_delay)
+
+    async def check(self, email: str, ip: str) -> str | None:
+        """
+        The check function records a login attempt for the account and for the ip in one MULTI/EXEC,
+        and rejects it with 429 and a Retry-After header while either of them backs off.
+        A rejected attempt is taken back, so waiting clients do not extend their own backoff.
+
+        :param email: str: The login of the attempt
+        :param ip: str: The client ip of the attempt
+        :return: The id of the attempt, or None when Redis is not available
+        :doc-author: Trelent
+        """
+        now, attempt = time(), uuid4().hex
+        keys = [(self.account_key(email), self.account_limit), (self.ip_key(ip), self.ip_limit)]
+        try:
+            pipe = self.redis.pipeline()
+            for key, _ in keys:
+                pipe.zremrangebyscore(key, 0, now - self.window)
+                pipe.zadd(key, {attempt: now})
+                pipe.expire(key, self.window)
+                pipe.zcard(key)
+                pipe.zrange(key, -2, -2, withscores=True)
+            results = await pipe.execute()
+            wait = 0.0
+            for index, (_, limit) in enumerate(keys):
+                attempts, previous = results[5 * index + 3], results[5 * index + 4]
+                if previous:
+                    wait = max(wait, previous[0][1] + self.backoff(attempts - 1, limit) - now)
+            if wait <= 0:
+                return attempt
+            pipe = self.redis.pipeline()
+            for key, _ in keys:
+                pipe.zrem(key, attempt)
+            await pipe.execute()
+        except RedisError as err:
+            logger.warning("Login throttle is not available: %s", err)
+            return None
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=msg.TOO_MANY_LOGIN_ATTEMPTS,
+                            headers={"Retry-After": str(math.ceil(wait))})
+
+    async def succeeded(self, email: str, ip: str, attempt: str | None) -> None:
+        """
+        The succeeded function forgets the attempts of an account after a successful login,
+        and takes the successful attempt back from the window of the ip.
+
+        :param email: str: The login of the attempt
+        :param ip: str: The client ip of the attempt
+        :param attempt: str | None: The id returned by check
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            pipe = self.redis.pipeline()
+            pipe.delete(self.account_key(email))
+            if attempt is not None:
+                pipe.zrem(self.ip_key(ip), attempt)
+            await pipe.execute()
+        except RedisError as err:
+            logger.warning("Login throttle is not available: %s", err)
+
+
+login_throttle = LoginThrottle(redis_db, window=settings.login_throttle_window,
+                               account_limit=settings.login_throttle_account_limit,
+                               ip_limit=settings.login_throttle_ip_limit,
+                               base_delay=settings.login_throttle_base_delay,
+                               max_delay=settings.login_throttle_max_delay)
@@ -0,0 +1,84 @@
+import logging
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.db import redis_db
+from src.database.models import MailKind
+
+logger = logging.getLogger(__name__)
+
+
+class MailCoalescer:
+    """
+    Lets one email of a kind per recipient into the outbox within a window. The first request sets
+    mail:pending:{kind}:{email} with SET NX and queues the email, the repeated ones while the key lives
+    reuse that email and are only counted in mail:suppressed:{kind}. Redis errors let the email through.
+    An email that could not be queued after its claim is released, so the next request queues it again.
+    """
+
+    def __init__(self, redis: Redis, window: int):
+        self.redis = redis
+        self.window = window
+
+    @staticmethod
+    def pending_key(kind: MailKind, email: str) -> str:
+        return f"mail:pending:{kind.value}:{email.lower()}"
+
+    @staticmethod
+    def suppressed_key(kind: MailKind) -> str:
+        return f"mail:suppressed:{kind.value}"
+
+    async def claim(self, kind: MailKind, email: str) -> bool:
+        """
+        The claim function decides whether an email has to be queued or an email of the window is reused.
+
+        :param kind: MailKind: The template of the email
+        :param email: str: The address of the recipient
+        :return: True if the email has to be queued
+        :doc-author: Trelent
+        """
+        if self.window <= 0:
+            return True
+        try:
+            if await self.redis.set(self.pending_key(kind, email), 1, ex=self.window, nx=True):
+                return True
+            await self.redis.incr(self.suppressed_key(kind))
+        except RedisError as err:
+            logger.warning("Mail coalescing is not available: %s", err)
+            return True
+        return False
+
+    async def release(self, kind: MailKind, email: str) -> None:
+        """
+        The release function ends the window of a claim whose email was not queued.
+
+        :param kind: MailKind: The template of the email
+        :param email: str: The address of the recipient
+        :return: None
+        :doc-author: Trelent
+        """
+        if self.window <= 0:
+            return
+        try:
+            await self.redis.delete(self.pending_key(kind, email))
+        except RedisError as err:
+            logger.warning("Mail coalescing is not available: %s", err)
+
+    async def stats(self) -> dict:
+        """
+        The stats function reads the number of suppressed emails of each kind across all the workers.
+
+        :return: A dictionary with the count of each kind, or None when Redis is not available
+        :doc-author: Trelent
+        """
+        try:
+            counts = await self.redis.mget([self.suppressed_key(kind) for kind in MailKind])
+        except RedisError as err:
+            logger.warning("Mail coalescing is not available: %s", err)
+            return {kind.value: None for kind in MailKind}
+        return {kind.value: int(count or 0) for kind, count in zip(MailKind, counts)}
+
+
+mail_coalescer = MailCoalescer(redis_db, window=settings.mail_coalesce_window)
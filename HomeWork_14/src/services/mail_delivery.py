@@ -0,0 +1,232 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from email.message import EmailMessage
+from time import perf_counter
+
+from aiosmtplib import SMTP, SMTPException, SMTPRecipientsRefused, SMTPResponseException
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeliveryMetrics:
+    queued: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    batches: int = 0
+    connections: int = 0
+    send_time: float = 0.0
+    latency: float = 0.0
+    max_latency: float = 0.0
+
+
+@dataclass
+class _Job:
+    message: EmailMessage
+    queued_at: float
+    result: asyncio.Future
+
+
+class MailDelivery:
+    """
+    Sends the emails of a worker process from a queue. Each of the workers keeps its own SMTP connection open
+    and sends the messages it finds in the queue as one batch over it, so a burst of emails costs one TLS
+    handshake and login per worker instead of one per message. A connection that was idle for idle_timeout
+    seconds is closed. A message that fails with a temporary error is sent again on a new connection after
+    retry_delay, 2 * retry_delay, ... seconds, a message the server refuses for good (5xx) is dropped.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = False, start_tls: bool = False, workers: int = 1, batch_size: int = 20,
+                 max_retries: int = 3, retry_delay: float = 1, idle_timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.metrics = DeliveryMetrics()
+        self._queue: asyncio.Queue[_Job] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._started_at = perf_counter()
+
+    def enqueue(self, message: EmailMessage) -> asyncio.Future:
+        """
+        The enqueue function puts a message in the queue of the workers and returns at once.
+
+        :param message: EmailMessage: The message to send
+        :return: A future that is True once the message was sent and False if it was dropped
+        :doc-author: Trelent
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        job = _Job(message, perf_counter(), asyncio.get_running_loop().create_future())
+        self._queue.put_nowait(job)
+        self.metrics.queued += 1
+        return job.result
+
+    async def send(self, message: EmailMessage) -> bool:
+        """
+        The send function puts a message in the queue and waits until it is sent or dropped.
+
+        :param message: EmailMessage: The message to send
+        :return: True if the message was sent
+        :doc-author: Trelent
+        """
+        return await self.enqueue(message)
+
+    async def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._started_at = perf_counter()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10) -> None:
+        """
+        The stop function waits up to timeout seconds for the queued messages to be sent and stops the workers.
+
+        :param timeout: float: The seconds to wait for the queue
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Mail delivery stopped with %s messages in the queue", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _connect(self) -> SMTP:
+        smtp = SMTP(hostname=self.hostname, port=self.port, use_tls=self.use_tls, start_tls=self.start_tls)
+        await smtp.connect()
+        if self.username:
+            try:
+                await smtp.login(self.username, self.password)
+            except BaseException:
+                smtp.close()
+                raise
+        self.metrics.connections += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp: SMTP | None, quit_: bool = False) -> None:
+        if smtp is None or not smtp.is_connected:
+            return
+        if quit_:
+            try:
+                await smtp.quit()
+                return
+            except (SMTPException, OSError):
+                pass
+        smtp.close()
+
+    async def _work(self) -> None:
+        smtp = None
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await self._close(smtp, quit_=True)
+                    smtp = None
+                    continue
+                batch = [job]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                try:
+                    smtp = await self._send_batch(smtp, batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    async def _send_batch(self, smtp: SMTP | None, batch: list[_Job]) -> SMTP | None:
+        started_at = perf_counter()
+        self.metrics.batches += 1
+        for job in batch:
+            try:
+                smtp = await self._deliver(smtp, job)
+            except Exception as err:
+                # e.g. a message that cannot be encoded, only its job fails and the worker goes on
+                logger.exception("Mail to %s failed: %s", job.message["To"], err)
+                await self._close(smtp)
+                smtp = None
+                self.metrics.failed += 1
+                self._done(job, False)
+        self.metrics.send_time += perf_counter() - started_at
+        return smtp
+
+    async def _deliver(self, smtp: SMTP | None, job: _Job) -> SMTP | None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect()
+            except (SMTPException, OSError) as err:
+                # a refused connection or login, e.g. 535 for wrong credentials, is not a refusal of the message
+                error = err
+            else:
+                try:
+                    await smtp.send_message(job.message)
+                except (SMTPRecipientsRefused, SMTPResponseException) as err:
+                    # a 5xx reply to MAIL, RCPT or DATA refuses the message for good
+                    if isinstance(err, SMTPRecipientsRefused) or err.code >= 500:
+                        logger.error("Mail to %s was refused: %s", job.message["To"], err)
+                        break
+                    error = err
+                except (SMTPException, OSError) as err:
+                    error = err
+                else:
+                    self._done(job, True)
+                    latency = perf_counter() - job.queued_at
+                    self.metrics.sent += 1
+                    self.metrics.latency += latency
+                    self.metrics.max_latency = max(self.metrics.max_latency, latency)
+                    return smtp
+            # the state of the session is not known after an error, the next attempt starts a new one
+            await self._close(smtp)
+            smtp = None
+            if attempt < self.max_retries:
+                self.metrics.retries += 1
+                logger.warning("Mail to %s failed, retry %s: %s", job.message["To"], attempt + 1, error)
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                logger.error("Mail to %s failed after %s retries: %s", job.message["To"], self.max_retries, error)
+        self.metrics.failed += 1
+        self._done(job, False)
+        return smtp
+
+    @staticmethod
+    def _done(job: _Job, sent: bool) -> None:
+        if not job.result.done():
+            job.result.set_result(sent)
+
+    def stats(self) -> dict:
+        metrics = self.metrics
+        uptime = perf_counter() - self._started_at
+        return {"workers": len(self._tasks), "queue": self._queue.qsize() if self._queue is not None else 0,
+                "queued": metrics.queued, "sent": metrics.sent, "failed": metrics.failed,
+                "retries": metrics.retries, "batches": metrics.batches, "connections": metrics.connections,
+                "sent_per_second": round(metrics.sent / uptime, 2) if uptime else 0.0,
+                "send_time_ms": round(metrics.send_time * 1000, 2),
+                "avg_latency_ms": round(metrics.latency / metrics.sent * 1000, 2) if metrics.sent else 0.0,
+                "max_latency_ms": round(metrics.max_latency * 1000, 2)}
+
+
+mail_delivery = MailDelivery(settings.mail_server, settings.mail_port, username=settings.mail_username,
+                             password=settings.mail_password, use_tls=settings.mail_ssl_tls,
+                             start_tls=settings.mail_starttls, workers=settings.mail_workers,
+                             batch_size=settings.mail_batch_size, max_retries=settings.mail_max_retries,
+                             retry_delay=settings.mail_retry_delay, idle_timeout=settings.mail_idle_timeout)
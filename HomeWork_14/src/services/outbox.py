@@ -0,0 +1,92 @@
+"""
+The outbox worker sends the emails the API saved in the email_outbox table. Run it next to the API:
+
+    python -m src.services.outbox
+
+Several workers can run at the same time, each one claims its own rows.
+"""
+import asyncio
+import logging
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.conf.config import settings
+from src.database.db import session
+from src.repository import outbox as repository_outbox
+from src.services.email import outbox_message
+from src.services.mail_delivery import MailDelivery, mail_delivery
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """
+    Claims the pending emails of the outbox in batches and hands each batch to the mail delivery queue,
+    which sends it over its pooled SMTP connections. An email that could not be sent is claimed again after
+    a backoff until it used up max_attempts, an email of a worker that died is claimed again after the lease.
+    """
+
+    def __init__(self, session: async_sessionmaker, delivery: MailDelivery, batch_size: int, poll_interval: float,
+                 lease: float, max_attempts: int, retry_delay: float):
+        self.session = session
+        self.delivery = delivery
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    async def run_once(self) -> int:
+        """
+        The run_once function claims one batch of emails, sends it and records the results.
+
+        :return: The number of claimed emails
+        :doc-author: Trelent
+        """
+        async with self.session() as db:
+            emails = await repository_outbox.claim_emails(self.batch_size, self.lease, self.max_attempts, db)
+        if not emails:
+            return 0
+        results = await asyncio.gather(*(self.delivery.send(outbox_message(email)) for email in emails))
+        sent = [email for email, result in zip(emails, results) if result]
+        failed = [email for email, result in zip(emails, results) if not result]
+        async with self.session() as db:
+            await repository_outbox.finish_emails(sent, failed, self.retry_delay, db)
+        for email in failed:
+            if email.attempts >= self.max_attempts:
+                logger.error("Gave up the %s email %s to %s", email.kind.value, email.id, email.recipient)
+        logger.info("Sent %s of %s emails", len(sent), len(emails))
+        return len(emails)
+
+    async def run(self) -> None:
+        """
+        The run function sends the outbox for the lifetime of the process. It polls the table
+        only while there is nothing to send, a full batch is followed by the next one at once.
+
+        :return: None
+        :doc-author: Trelent
+        """
+        while True:
+            try:
+                claimed = await self.run_once()
+            except Exception as err:
+                logger.exception("Outbox batch failed: %s", err)
+                claimed = 0
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+
+async def main() -> None:
+    worker = OutboxWorker(session, mail_delivery, batch_size=settings.outbox_batch_size,
+                          poll_interval=settings.outbox_poll_interval, lease=settings.outbox_lease,
+                          max_attempts=settings.outbox_max_attempts, retry_delay=settings.outbox_retry_delay)
+    await mail_delivery.start()
+    try:
+        await worker.run()
+    finally:
+        await mail_delivery.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
+
+from passlib.context import CryptContext
+
+from src.conf.config import settings
+
+
+@dataclass
+class HasherMetrics:
+    submitted: int = 0
+    completed: int = 0
+    queued: int = 0
+    running: int = 0
+    max_queued: int = 0
+    wait_time: float = 0.0
+    work_time: float = 0.0
+
+
+class PasswordHasher:
+    """
+    Runs the bcrypt work of a worker process in a small thread pool, so a burst of logins does not block
+    the event loop. bcrypt releases the GIL while it hashes, the number of threads is the concurrency cap,
+    and the calls above the cap wait in the queue of the executor.
+    """
+
+    def __init__(self, rounds: int, workers: int):
+        self.rounds = rounds
+        self.workers = workers
+        # min_rounds and max_rounds make needs_update() true for the hashes made with another cost
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=rounds,
+                                    bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds)
+        self.metrics = HasherMetrics()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    def _call(self, submitted_at: float, func, *args):
+        started_at = perf_counter()
+        with self._lock:
+            self.metrics.queued -= 1
+            self.metrics.running += 1
+            self.metrics.wait_time += started_at - submitted_at
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.metrics.running -= 1
+                self.metrics.completed += 1
+                self.metrics.work_time += perf_counter() - started_at
+
+    def _cancelled(self, future: Future) -> None:
+        # a call cancelled while it waited in the queue (its task was cancelled, or shutdown) never reaches _call
+        if future.cancelled():
+            with self._lock:
+                self.metrics.queued -= 1
+
+    async def _run(self, func, *args):
+        with self._lock:
+            self.metrics.submitted += 1
+            self.metrics.queued += 1
+            self.metrics.max_queued = max(self.metrics.max_queued, self.metrics.queued)
+        future = self._executor.submit(self._call, perf_counter(), func, *args)
+        future.add_done_callback(self._cancelled)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        """
+        The hash function hashes a password with the configured bcrypt cost in the thread pool.
+
+        :param password: str: The plain-text password
+        :return: The bcrypt hash
+        :doc-author: Trelent
+        """
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """
+        The verify function checks a plain-text password against a bcrypt hash in the thread pool.
+
+        :param password: str: The plain-text password
+        :param hashed_password: str: The stored hash
+        :return: True if the password matches
+        :doc-author: Trelent
+        """
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        The verify_and_update function checks a password and, when the hash was made with another cost,
+        hashes it again with the configured one in the same thread pool call.
+
+        :param password: str: The plain-text password
+        :param hashed_password: str: The stored hash
+        :return: Whether the password matches, and the new hash to store or None
+        :doc-author: Trelent
+        """
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = self.metrics
+            return {"workers": self.workers, "rounds": self.rounds, "submitted": metrics.submitted,
+                    "completed": metrics.completed, "running": metrics.running, "queued": metrics.queued,
+                    "max_queued": metrics.max_queued, "wait_time_ms": round(metrics.wait_time * 1000, 2),
+                    "work_time_ms": round(metrics.work_time * 1000, 2)}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(rounds=settings.bcrypt_rounds, workers=settings.password_hash_workers)
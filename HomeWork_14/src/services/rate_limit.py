@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import math
+from dataclasses import dataclass
+from time import time
+
+from fastapi import Depends, HTTPException, status
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf import messages as msg
+from src.conf.config import settings
+from src.database.db import redis_db
+from src.database.models import Role
+from src.services.auth import auth_service, TokenClaims
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Quota:
+    times: int
+    seconds: int
+
+
+def parse_quotas(value: str) -> dict[Role, Quota]:
+    """
+    The parse_quotas function reads the quotas of the roles from a setting like "admin:20/5,user:2/5",
+    which allows an admin 20 and a user 2 requests per 5 seconds.
+
+    :param value: str: The comma separated role:times/seconds pairs
+    :return: A dict of the quota of each role
+    :doc-author: Trelent
+    """
+    quotas = {}
+    for item in value.split(","):
+        role, _, quota = item.strip().partition(":")
+        times, _, seconds = quota.partition("/")
+        quotas[Role(role)] = Quota(int(times), int(seconds))
+    return quotas
+
+
+class TokenBucket:
+    __slots__ = ("quota", "tokens", "updated", "blocked_until")
+
+    def __init__(self, quota: Quota, now: float):
+        self.quota = quota
+        self.tokens = float(quota.times)
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def take(self, now: float) -> float:
+        """
+        The take function takes a token from the bucket.
+
+        :param now: float: The current time
+        :return: 0 if a token was taken, else the seconds until the next one
+        :doc-author: Trelent
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        rate = self.quota.times / self.quota.seconds
+        self.tokens = min(self.quota.times, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """
+    Every worker answers from its own token buckets and counts what it let through. A background task adds
+    the counts to per-window counters in Redis in one pipeline every sync_interval seconds, and blocks the local
+    bucket of a key until the end of its window once all the workers together used up the quota.
+    So the limits hold across the workers up to what they let through between two syncs, and a request never
+    waits for Redis. While Redis is not available the local buckets alone limit the requests (fail open),
+    or every request is rejected with 503 (fail closed).
+    """
+
+    def __init__(self, redis: Redis, sync_interval: float, fail_open: bool):
+        self.redis = redis
+        self.sync_interval = sync_interval
+        self.fail_open = fail_open
+        self.redis_available = True
+        self.buckets: dict[str, TokenBucket] = {}
+        self._pending: dict[str, tuple[str, int, float]] = {}
+
+    def hit(self, key: str, quota: Quota) -> float:
+        """
+        The hit function counts a request of a key against its quota.
+
+        :param key: str: The scope and the client of the request
+        :param quota: Quota: The quota of the client
+        :return: 0 if the request is allowed, else the seconds to wait
+        :doc-author: Trelent
+        """
+        now = time()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(quota, now)
+        wait = bucket.take(now)
+        if not wait:
+            window = int(now // quota.seconds)
+            counter = f"ratelimit:{key}:{window}"
+            _, count, window_end = self._pending.get(counter, (key, 0, (window + 1) * quota.seconds))
+            self._pending[counter] = (key, count + 1, window_end)
+        return wait
+
+    async def sync(self) -> None:
+        """
+        The sync function adds the local counts to the counters in Redis and blocks the buckets
+        of the keys that used up their quota across all the workers. While Redis is not available
+        and there is nothing to count, it pings Redis to notice when it is back.
+
+        :return: None
+        :doc-author: Trelent
+        """
+        now = time()
+        for key in [key for key, bucket in self.buckets.items()
+                    if bucket.blocked_until < now and now - bucket.updated > bucket.quota.seconds]:
+            del self.buckets[key]
+        pending, self._pending = self._pending, {}
+        if not pending:
+            if not self.redis_available:
+                # in fail closed mode nothing is counted during an outage, so only a ping can end it
+                try:
+                    await self.redis.ping()
+                except RedisError:
+                    return
+                logger.info("Rate limiter is available again")
+                self.redis_available = True
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for counter, (_, count, window_end) in pending.items():
+            pipe.incrby(counter, count)
+            pipe.expireat(counter, math.ceil(window_end))
+        try:
+            results = await pipe.execute()
+        except RedisError as err:
+            if self.redis_available:
+                logger.warning("Rate limiter is not available: %s", err)
+            self.redis_available = False
+            return
+        self.redis_available = True
+        for total, (key, _, window_end) in zip(results[::2], pending.values()):
+            bucket = self.buckets.get(key)
+            if bucket is not None and total >= bucket.quota.times:
+                bucket.blocked_until = max(bucket.blocked_until, window_end)
+
+    async def run(self) -> None:
+        """
+        The run function syncs the counts with Redis for the lifetime of the worker.
+
+        :return: None
+        :doc-author: Trelent
+        """
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync()
+
+
+rate_limiter = RateLimiter(redis_db, sync_interval=settings.rate_limit_sync_interval,
+                           fail_open=settings.rate_limit_fail_open)
+
+
+class RateLimit:
+    def __init__(self, scope: str, quotas: dict[Role, Quota]):
+        self.scope = scope
+        self.quotas = quotas
+
+    async def __call__(self, claims: TokenClaims = Depends(auth_service.get_token_claims)):
+        if not (rate_limiter.redis_available or rate_limiter.fail_open):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=msg.RATE_LIMIT_UNAVAILABLE)
+        wait = rate_limiter.hit(f"{self.scope}:user:{claims.user_id}", self.quotas[claims.role])
+        if wait:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=msg.TOO_MANY_REQUESTS,
+                                headers={"Retry-After": str(math.ceil(wait))})
@@ -1,19 +1,15 @@
 from typing import List
 
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, HTTPException, status
 
-from src.database.models import User, Role
-from src.services.auth import auth_service
+from src.database.models import Role
+from src.services.auth import auth_service, TokenClaims
 
 
 class RoleAccess:
     def __init__(self, allowed_roles: List[Role]):
         self.allowed_roles = allowed_roles
 
-    async def __call__(self, request: Request, current_user: User = Depends(auth_service.get_current_user)):
-        print(request.method, request.url)
-        print(f'User id {current_user.id}')
-        print(f'User role {current_user.roles}')
-        print(f'Allowed roles: {self.allowed_roles}')
-        if current_user.roles not in self.allowed_roles:
+    async def __call__(self, claims: TokenClaims = Depends(auth_service.get_token_claims)):
+        if not claims.confirmed or claims.role not in self.allowed_roles:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Operation forbidden')
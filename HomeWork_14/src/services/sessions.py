@@ -0,0 +1,122 @@
+import logging
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf import messages as msg
+from src.conf.config import settings
+from src.database.db import redis_db
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    The refresh sessions of the users in Redis. Every login starts a family of refresh tokens, each refresh
+    replaces the token of its family by a new one, and only the latest token of a family is valid:
+
+        session:{jti}           the email of the user, while the token is the latest of its family
+        session_family:{family} the jti of the latest token of the family
+        user_sessions:{email}   the families of the user, for revoke_all
+
+    A refresh token that is presented after it was replaced was copied, so its whole family is revoked.
+    All the keys live as long as a refresh token, so an unused session ends by itself.
+    """
+
+    def __init__(self, redis: Redis, ttl: int):
+        self.redis = redis
+        self.ttl = ttl
+
+    @staticmethod
+    def _unavailable(err: RedisError) -> HTTPException:
+        logger.warning("Session store is not available: %s", err)
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=msg.SESSION_STORE_UNAVAILABLE)
+
+    async def create(self, email: str) -> tuple[str, str]:
+        """
+        The create function starts a new session family for a login.
+
+        :param email: str: The email of the user
+        :return: The jti of the first refresh token and the id of the family
+        :doc-author: Trelent
+        """
+        jti = family = uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.set(f"session:{jti}", email, ex=self.ttl)
+        pipe.set(f"session_family:{family}", jti, ex=self.ttl)
+        pipe.sadd(f"user_sessions:{email}", family)
+        pipe.expire(f"user_sessions:{email}", self.ttl)
+        try:
+            await pipe.execute()
+        except RedisError as err:
+            raise self._unavailable(err)
+        return jti, family
+
+    async def rotate(self, email: str, jti: str, family: str) -> str | None:
+        """
+        The rotate function replaces the refresh token jti of a family by a new one. Deleting the session key
+        of the old token is the atomic step, so of two parallel refreshes with the same token only one wins.
+
+        :param email: str: The email of the user
+        :param jti: str: The jti of the presented refresh token
+        :param family: str: The family of the presented refresh token
+        :return: The jti of the new refresh token, or None if the token is not the latest of a live family
+        :doc-author: Trelent
+        """
+        new_jti = uuid4().hex
+        try:
+            if not await self.redis.delete(f"session:{jti}"):
+                await self.revoke(family)
+                return None
+            pipe = self.redis.pipeline()
+            pipe.set(f"session_family:{family}", new_jti, ex=self.ttl, xx=True)
+            pipe.set(f"session:{new_jti}", email, ex=self.ttl)
+            pipe.expire(f"user_sessions:{email}", self.ttl)
+            replaced, *_ = await pipe.execute()
+            if not replaced:
+                # the family was revoked in the meantime
+                await self.redis.delete(f"session:{new_jti}")
+                return None
+        except RedisError as err:
+            raise self._unavailable(err)
+        return new_jti
+
+    async def revoke(self, family: str) -> None:
+        """
+        The revoke function ends a session family, its latest refresh token is not valid anymore.
+
+        :param family: str: The id of the family
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            jti = await self.redis.get(f"session_family:{family}")
+            keys = [f"session_family:{family}"]
+            if jti is not None:
+                keys.append(f"session:{jti.decode()}")
+            await self.redis.delete(*keys)
+        except RedisError as err:
+            raise self._unavailable(err)
+
+    async def revoke_all(self, email: str) -> None:
+        """
+        The revoke_all function ends all the sessions of a user, for example after a password change.
+
+        :param email: str: The email of the user
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            families = [family.decode() for family in await self.redis.smembers(f"user_sessions:{email}")]
+            keys = [f"user_sessions:{email}"] + [f"session_family:{family}" for family in families]
+            if families:
+                jtis = await self.redis.mget([f"session_family:{family}" for family in families])
+                keys += [f"session:{jti.decode()}" for jti in jtis if jti is not None]
+            await self.redis.delete(*keys)
+        except RedisError as err:
+            raise self._unavailable(err)
+
+
+session_store = SessionStore(redis_db, ttl=settings.refresh_token_ttl)
@@ -0,0 +1,109 @@
+"""
+Builds the static files for serving: every file of the static directory is copied to the build directory
+under a name with the hash of its content, with a .gz and a .br copy next to it when that is smaller.
+The build runs on startup and only writes what changed, or ahead of time with
+
+    python -m src.services.static_assets
+"""
+import gzip
+import json
+import os
+from hashlib import sha256
+from pathlib import Path
+
+import brotli
+
+from src.services.static_files import PrecompressedStaticFiles
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json", ".map", ".txt", ".html"}
+
+
+def _write(path: Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the workers of a server may build at the same time, the rename keeps every file whole
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+class StaticAssets:
+    def __init__(self, source: Path, target: Path, url_prefix: str, fallback_prefix: str):
+        self.source = Path(source)
+        self.target = Path(target)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.fallback_prefix = fallback_prefix.rstrip("/")
+        self.manifest: dict[str, str] = {}
+
+    @staticmethod
+    def fingerprint(path: str, content: bytes) -> str:
+        """
+        The fingerprint function puts the hash of the content before the extension: css/site.css becomes
+        css/site.1a2b3c4d5e6f.css.
+
+        :param path: str: The path of the file in the static directory
+        :param content: bytes: The content of the file
+        :return: The path of the built file
+        :doc-author: Trelent
+        """
+        directory, _, name = path.rpartition("/")
+        stem, dot, extension = name.rpartition(".")
+        digest = sha256(content).hexdigest()[:12]
+        name = f"{stem}.{digest}.{extension}" if dot else f"{name}.{digest}"
+        return f"{directory}/{name}" if directory else name
+
+    def build(self) -> dict[str, str]:
+        """
+        The build function writes the fingerprinted and the compressed files that are not built yet,
+        and the manifest of the original paths and the built ones.
+
+        :return: The manifest
+        :doc-author: Trelent
+        """
+        manifest = {}
+        for file in sorted(self.source.rglob("*")):
+            if not file.is_file() or self.target in file.parents:
+                continue
+            path = file.relative_to(self.source).as_posix()
+            content = file.read_bytes()
+            built = manifest[path] = self.fingerprint(path, content)
+            built_path = self.target / built
+            if built_path.exists():
+                continue
+            if file.suffix in COMPRESSIBLE:
+                for suffix, compressed in ((".gz", gzip.compress(content, 9, mtime=0)),
+                                           (".br", brotli.compress(content, quality=11))):
+                    if len(compressed) < len(content):
+                        _write(built_path.with_name(built_path.name + suffix), compressed)
+            # the uncompressed file is written last, it marks the build of the file as done
+            _write(built_path, content)
+        _write(self.target / "manifest.json", json.dumps(manifest, indent=2).encode())
+        self.manifest = manifest
+        return manifest
+
+    def url(self, path: str) -> str:
+        """
+        The url function is the template helper for the static files, {{ asset_url('css/style.css') }}.
+
+        :param path: str: The path of the file in the static directory
+        :return: The url of the fingerprinted file, or of the original file while the build did not run
+        :doc-author: Trelent
+        """
+        path = path.lstrip("/")
+        built = self.manifest.get(path)
+        if built is None:
+            return f"{self.fallback_prefix}/{path}"
+        return f"{self.url_prefix}/{built}"
+
+    def files(self) -> PrecompressedStaticFiles:
+        return PrecompressedStaticFiles(directory=self.target, check_dir=False)
+
+
+BASE_DIR = Path(__file__).parent.parent.parent
+
+static_assets = StaticAssets(BASE_DIR / "static", BASE_DIR / "static_build", url_prefix="/assets",
+                             fallback_prefix="/static")
+
+
+if __name__ == "__main__":
+    for original, built in static_assets.build().items():
+        print(f"{original} -> {built}")
@@ -0,0 +1,92 @@
+import os
+from mimetypes import guess_type
+from pathlib import Path
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    Serves files whose path changes whenever their content changes, so a browser can keep them for a year
+    without asking again. The ETag comes from the path instead of the mtime, so it is the same on every server.
+    """
+
+    @staticmethod
+    def etag(full_path: Path) -> str:
+        return f'"{full_path.parent.name}-{full_path.name}"'
+
+    def file_response(self, full_path: os.PathLike, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        headers = {"Cache-Control": IMMUTABLE, "ETag": self.etag(Path(full_path))}
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result,
+                                method=scope["method"])
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class PrecompressedStaticFiles(ImmutableStaticFiles):
+    """
+    Serves the .br or .gz file that was compressed next to a file at build time, when the client accepts it,
+    so nothing is compressed per request. The response keeps the content type of the uncompressed file.
+    """
+
+    encodings = (("br", ".br"), ("gzip", ".gz"))
+
+    @staticmethod
+    def accepted_encodings(header: str) -> dict[str, float]:
+        """
+        The accepted_encodings function parses an Accept-Encoding header, gzip;q=0.5 or br;q=0.
+
+        :param header: str: The Accept-Encoding header
+        :return: The quality of each encoding, 1 when it has no q
+        :doc-author: Trelent
+        """
+        accepted = {}
+        for item in header.split(","):
+            encoding, *params = [part.strip() for part in item.split(";")]
+            quality = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if encoding:
+                accepted[encoding.lower()] = quality
+        return accepted
+
+    def compressed(self, full_path: Path, scope: Scope) -> tuple[str, Path] | None:
+        accepted = self.accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        best = None
+        # the encoding with the highest quality wins, the order of encodings decides between equal ones
+        for encoding, suffix in self.encodings:
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            compressed_path = full_path.with_name(full_path.name + suffix)
+            if quality > 0 and (best is None or quality > best[0]) and compressed_path.is_file():
+                best = quality, encoding, compressed_path
+        return best[1:] if best is not None else None
+
+    def file_response(self, full_path: os.PathLike, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        full_path = Path(full_path)
+        compressed = self.compressed(full_path, scope)
+        if compressed is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+        encoding, compressed_path = compressed
+        headers = {"Cache-Control": IMMUTABLE, "ETag": self.etag(compressed_path), "Content-Encoding": encoding,
+                   "Vary": "Accept-Encoding"}
+        response = FileResponse(compressed_path, status_code=status_code, headers=headers,
+                                media_type=guess_type(full_path.name)[0] or "text/plain",
+                                stat_result=os.stat(compressed_path), method=scope["method"])
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
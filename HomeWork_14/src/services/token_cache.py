@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from time import time
+from typing import Any
+
+from src.conf.config import settings
+
+
+class TokenCache:
+    """
+    A bounded LRU cache of verified tokens, one per worker process. The key is a digest of the token,
+    so the cache does not hold the tokens themselves, and an entry lives until the exp of its token.
+    Only tokens whose signature was verified are put in, so a hit is as good as a verification.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[bytes, tuple[float, Any]] = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Any | None:
+        key = self.digest(token)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time():
+            del self._entries[key]
+            self.evictions += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, token: str, expires_at: float, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        key = self.digest(token)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+access_tokens = TokenCache(maxsize=settings.token_cache_size)
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import struct
+from collections import OrderedDict
+from time import monotonic
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf import messages as msg
+from src.conf.config import settings
+from src.database.db import redis_db
+from src.database.models import User, Role
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+USER_CACHE_TTL = 900
+INVALIDATION_CHANNEL = "user_cache:invalidate"
+WORKER_ID = uuid4().hex
+
+# version, id, role, confirmed, then the lengths of the utf-8 encoded email, username and avatar
+_HEADER = struct.Struct("!BIB?HHH")
+_ROLES = list(Role)
+
+
+class LocalCache:
+    """
+    A bounded LRU cache with a time to live, one per worker process. It sits in front of the Redis cache,
+    so most authenticated requests identify the caller without a network round trip.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: bytes) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+local_users = LocalCache(maxsize=settings.user_cache_local_size, ttl=settings.user_cache_local_ttl)
+local_versions = LocalCache(maxsize=settings.user_cache_local_size, ttl=settings.user_cache_local_ttl)
+
+
+def user_key(email: str) -> str:
+    return f"user:{email}"
+
+
+def version_key(user_id: int) -> str:
+    return f"user_version:{user_id}"
+
+
+def pack_user(user: User) -> bytes:
+    """
+    The pack_user function packs the fields of a user that the routes need into a compact snapshot.
+        The password hash is never cached.
+
+    :param user: User: The user to cache
+    :return: The snapshot bytes
+    :doc-author: Trelent
+    """
+    email, username, avatar = (value.encode() for value in (user.email, user.username or "", user.avatar or ""))
+    header = _HEADER.pack(CACHE_VERSION, user.id, _ROLES.index(user.roles or Role.user), bool(user.confirmed),
+                          len(email), len(username), len(avatar))
+    return header + email + username + avatar
+
+
+def unpack_user(data: bytes) -> User | None:
+    """
+    The unpack_user function restores a transient User from a snapshot made by pack_user.
+        A snapshot of another version (or an old pickled user) is treated as a cache miss.
+
+    :param data: bytes: The snapshot bytes
+    :return: A User that is not attached to a session, or None
+    :doc-author: Trelent
+    """
+    if len(data) < _HEADER.size or data[0] != CACHE_VERSION:
+        return None
+    _, user_id, role, confirmed, email_len, username_len, avatar_len = _HEADER.unpack_from(data)
+    fields, offset = [], _HEADER.size
+    for length in (email_len, username_len, avatar_len):
+        fields.append(data[offset:offset + length].decode())
+        offset += length
+    email, username, avatar = fields
+    return User(id=user_id, email=email, username=username, avatar=avatar or None, roles=_ROLES[role],
+                confirmed=confirmed)
+
+
+async def get_cached_user(email: str) -> User | None:
+    """
+    The get_cached_user function reads the snapshot of a user from the local cache of the worker,
+    or from Redis when the worker does not hold it.
+
+    :param email: str: The email of the user
+    :return: The cached user, or None on a miss
+    :doc-author: Trelent
+    """
+    key = user_key(email)
+    data = local_users.get(key)
+    if data is None:
+        try:
+            data = await redis_db.get(key)
+        except RedisError as err:
+            logger.warning("User cache is not available: %s", err)
+            return None
+        if data is None:
+            return None
+        local_users.set(key, data)
+    return unpack_user(data)
+
+
+async def cache_user(user: User) -> None:
+    """
+    The cache_user function stores the snapshot of a user in Redis with a single SET ... EX.
+
+    :param user: User: The user to cache
+    :return: None
+    :doc-author: Trelent
+    """
+    key, data = user_key(user.email), pack_user(user)
+    local_users.set(key, data)
+    try:
+        await redis_db.set(key, data, ex=USER_CACHE_TTL)
+        await redis_db.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}:{key}")
+    except RedisError as err:
+        logger.warning("User cache is not available: %s", err)
+
+
+async def invalidate_user(email: str) -> None:
+    """
+    The invalidate_user function removes the snapshot of a user from Redis,
+    the next request of the user reads it from the database again.
+
+    :param email: str: The email of the user
+    :return: None
+    :doc-author: Trelent
+    """
+    key = user_key(email)
+    local_users.pop(key)
+    try:
+        await redis_db.delete(key)
+        await redis_db.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}:{key}")
+    except RedisError as err:
+        logger.warning("User cache is not available: %s", err)
+
+
+async def get_user_version(user_id: int) -> int:
+    """
+    The get_user_version function returns the version of a user that the access tokens must carry.
+        The version is read from Redis only when the local cache of the worker does not hold it,
+        and a user without a version in Redis has version 0. When Redis is not available the version
+        is not known, so the request fails with 503 instead of accepting a revoked token.
+
+    :param user_id: int: The id of the user
+    :return: The current version of the user
+    :doc-author: Trelent
+    """
+    key = version_key(user_id)
+    data = local_versions.get(key)
+    if data is None:
+        try:
+            data = await redis_db.get(key) or b"0"
+        except RedisError as err:
+            logger.warning("User cache is not available: %s", err)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=msg.USER_VERSION_UNAVAILABLE)
+        local_versions.set(key, data)
+    return int(data)
+
+
+async def bump_user_version(user_id: int) -> None:
+    """
+    The bump_user_version function makes all the access tokens issued to a user so far outdated,
+    for example after a change of the role. The other workers drop their cached version on the
+    invalidation message, or at the latest when it expires.
+
+    :param user_id: int: The id of the user
+    :return: None
+    :doc-author: Trelent
+    """
+    key = version_key(user_id)
+    local_versions.pop(key)
+    try:
+        await redis_db.incr(key)
+        await redis_db.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}:{key}")
+    except RedisError as err:
+        logger.warning("User cache is not available: %s", err)
+
+
+def handle_invalidation(message: bytes | str) -> None:
+    """
+    The handle_invalidation function drops the local entry named in an invalidation message of another worker.
+
+    :param message: bytes | str: The "worker id:key" message
+    :return: None
+    :doc-author: Trelent
+    """
+    if isinstance(message, bytes):
+        message = message.decode()
+    worker_id, _, key = message.partition(":")
+    if worker_id != WORKER_ID:
+        local_users.pop(key)
+        local_versions.pop(key)
+
+
+async def listen_invalidations(retry_delay: float = 1.0) -> None:
+    """
+    The listen_invalidations function runs for the lifetime of the worker and applies the invalidations
+    that the other workers and nodes publish. Messages published while the subscription was down are lost,
+    so the local cache is cleared whenever the subscription is (re)established; until then the local ttl
+    bounds how stale an entry can get.
+
+    :param retry_delay: float: Seconds to wait before subscribing again after an error
+    :return: None
+    :doc-author: Trelent
+    """
+    while True:
+        try:
+            async with redis_db.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                local_users.clear()
+                local_versions.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        handle_invalidation(message["data"])
+        except RedisError as err:
+            logger.warning("User cache invalidation channel is not available: %s", err)
+            await asyncio.sleep(retry_delay)
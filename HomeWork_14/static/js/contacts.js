@@ -71,12 +71,16 @@ function new_table_row(contact) {
   return tr;
 }
 
-async function getContacts(filter_type=0) {
-  let filter_str;
-  if (filter_type === 1)
-    filter_str = document.getElementById("filter_str").value;
+let next_cursor = null;
 
-  const url_str = `/api/contacts/?filter_type=${filter_type}&filter_str=${filter_str}`
+async function getContacts(filter_type=0, more=false) {
+  let url_str = `/api/contacts/?filter_type=${filter_type}`
+  if (filter_type === 1) {
+    const q = document.getElementById("filter_str").value.trim();
+    url_str = q.length > 2 ? `/api/contacts/?q=${encodeURIComponent(q)}` : "/api/contacts/?filter_type=0";
+  }
+  if (more && next_cursor)
+    url_str += `&cursor=${next_cursor}`
   const token = localStorage.getItem('accessToken');
 
   const response = await fetch(url_str, {
@@ -87,13 +91,21 @@ async function getContacts(filter_type=0) {
     }
   });
   if (response.ok === true) {
-    const contacts = await response.json();
+    const page = await response.json();
     const rows = document.querySelector("tbody");
 
-    while (rows.rows.length)
-      rows.deleteRow(0);
+    if (!more)
+      while (rows.rows.length)
+        rows.deleteRow(0);
+
+    page.items.forEach(contact => rows.append(new_table_row(contact)));
 
-    contacts.forEach(contact => rows.append(new_table_row(contact)));
+    next_cursor = page.next_cursor;
+    const load_more = document.getElementById("load_more");
+    load_more.onclick = async function() {
+      await getContacts(filter_type, true);
+    }
+    load_more.classList.toggle("d-none", !next_cursor);
   }
   else{
     if (response.status === 401)
@@ -1,19 +1,124 @@
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from main import app
+from src.conf.config import settings
 from src.database.models import Base
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
+from src.database.query_budget import record_queries
+from src.services import user_cache
+from src.services.mail_coalesce import mail_coalescer
+from src.services.sessions import session_store
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient runs every request in its own event loop, so async connections must not be pooled
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# every request of the test client fails when it issues more statements than its route's QueryBudget
+record_queries(async_engine)
+settings.query_budget_strict = True
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.calls.append((getattr(self.redis, f"_{name}"), args, kwargs))
+            return self
+        return command
+
+    async def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.calls]
+
+
+class FakeRedis:
+    """The Redis commands the services use, in memory and without expiry. Values come back as bytes."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        command = getattr(self, f"_{name}")
+
+        async def call(*args, **kwargs):
+            return command(*args, **kwargs)
+        return call
+
+    def _get(self, key):
+        return self.data.get(key)
+
+    def _mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def _set(self, key, value, ex=None, xx=False, nx=False):
+        if xx and key not in self.data or nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode() if isinstance(value, (str, int)) else value
+        return True
+
+    def _incr(self, key, amount=1):
+        value = int(self.data.get(key, 0)) + amount
+        self.data[key] = str(value).encode()
+        return value
+
+    def _delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def _publish(self, channel, message):
+        return 0
+
+    def _expire(self, key, seconds):
+        return key in self.data
+
+    def _sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(member.encode() for member in members)
+
+    def _smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def _zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def _zremrangebyscore(self, key, low, high):
+        members = self.data.get(key, {})
+        for member in [member for member, score in members.items() if low <= score <= high]:
+            del members[member]
+
+    def _zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def _zrange(self, key, start, end, withscores=False):
+        items = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        return items[start:end + 1 or None]
+
+    def _zrem(self, key, member):
+        self.data.get(key, {}).pop(member, None)
+
+
+@pytest.fixture()
+def fake_redis():
+    return FakeRedis()
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -29,13 +134,16 @@ def session():
 
 @pytest.fixture(scope="module")
 def client(session):
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+        session.expire_all()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    session_store.redis = FakeRedis()
+    mail_coalescer.redis = FakeRedis()
+    user_cache.redis_db = FakeRedis()
 
     yield TestClient(app)
 
@@ -46,7 +154,6 @@ def user():
         "username": "Ben",
         "email": "test@example.com",
         "password": "1234567",
-        "refresh_token": None,
         "avatar": None,
         "confirmed": False
         }
@@ -0,0 +1,114 @@
+import asyncio
+import statistics
+from time import perf_counter
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from main import app
+from src.database.models import User
+from src.services.login_throttle import LoginThrottle
+from src.services.passwords import PasswordHasher
+
+
+def make_throttle(redis, **kwargs):
+    options = dict(window=60, account_limit=3, ip_limit=5, base_delay=1, max_delay=60)
+    options.update(kwargs)
+    return LoginThrottle(redis, **options)
+
+
+def test_backoff_doubles_and_is_capped(fake_redis):
+    throttle = make_throttle(fake_redis, max_delay=5)
+    assert [throttle.backoff(attempts, 3) for attempts in range(7)] == [0, 0, 0, 1, 2, 4, 5]
+
+
+def test_account_limit_with_retry_after(fake_redis):
+    throttle = make_throttle(fake_redis)
+
+    async def run():
+        for _ in range(3):
+            await throttle.check("ben@example.com", "10.0.0.1")
+        with pytest.raises(HTTPException) as err:
+            await throttle.check("ben@example.com", "10.0.0.2")
+        return err.value
+
+    err = asyncio.run(run())
+    assert err.status_code == 429
+    assert err.headers == {"Retry-After": "1"}
+    # the rejected attempt is not counted
+    assert throttle.redis._zcard(throttle.account_key("ben@example.com")) == 3
+    assert throttle.redis._zcard(throttle.ip_key("10.0.0.2")) == 0
+
+
+def test_ip_limit_and_success_resets_account(fake_redis):
+    throttle = make_throttle(fake_redis)
+
+    async def run():
+        for number in range(5):
+            attempt = await throttle.check(f"user{number}@example.com", "10.0.0.1")
+        await throttle.succeeded("user4@example.com", "10.0.0.1", attempt)
+        await throttle.check("user5@example.com", "10.0.0.1")
+        with pytest.raises(HTTPException):
+            await throttle.check("user6@example.com", "10.0.0.1")
+
+    asyncio.run(run())
+    assert throttle.redis._zcard(throttle.account_key("user4@example.com")) == 0
+
+
+@pytest.fixture()
+def flood_users(session):
+    hasher = PasswordHasher(rounds=8, workers=1)
+    password = asyncio.run(hasher.hash("1234567"))
+    users = [User(username=f"user{number}", email=f"user{number}@flood.com", password=password, confirmed=True)
+             for number in range(10)]
+    users.append(User(username="legit", email="legit@flood.com", password=password, confirmed=True))
+    session.add_all(users)
+    session.commit()
+    yield hasher
+    hasher.shutdown()
+
+
+def test_load_legitimate_login_latency_under_stuffing_flood(client, flood_users, fake_redis, monkeypatch):
+    """
+    Two ips try wrong passwords against ten accounts 400 times in parallel, while a legitimate user logs in
+    from a third ip. The throttle lets only ip_limit attempts per ip reach bcrypt, so the login latency of
+    the legitimate user stays near the one without the flood.
+    """
+    hasher = flood_users
+    monkeypatch.setattr("src.services.auth.password_hasher", hasher)
+    monkeypatch.setattr("src.routes.auth.login_throttle", make_throttle(fake_redis, account_limit=5, ip_limit=5))
+
+    def http_client(ip):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 1234)), base_url="http://test")
+
+    async def legit_logins(count):
+        latencies = []
+        async with http_client("10.0.0.100") as http:
+            for _ in range(count):
+                start = perf_counter()
+                response = await http.post("/api/auth/login",
+                                           data={"username": "legit@flood.com", "password": "1234567"})
+                latencies.append(perf_counter() - start)
+                assert response.status_code == 200, response.text
+        return latencies
+
+    async def stuffing(ip, count):
+        async with http_client(ip) as http:
+            responses = await asyncio.gather(*(
+                http.post("/api/auth/login", data={"username": f"user{number % 10}@flood.com", "password": "guess"})
+                for number in range(count)))
+        return [response.status_code for response in responses]
+
+    async def run():
+        baseline = await legit_logins(5)
+        submitted = hasher.stats()["submitted"]
+        flood = asyncio.gather(stuffing("10.0.0.1", 200), stuffing("10.0.0.2", 200))
+        under_flood = await legit_logins(5)
+        codes = sum(await flood, [])
+        return baseline, under_flood, codes, hasher.stats()["submitted"] - submitted - 5
+
+    baseline, under_flood, codes, flood_hashes = asyncio.run(run())
+    assert codes.count(429) >= 390
+    assert flood_hashes <= 10
+    assert statistics.median(under_flood) <= 3 * statistics.median(baseline) + 0.1
@@ -1,7 +1,10 @@
+import pytest
 from fastapi.templating import Jinja2Templates
 from fastapi.testclient import TestClient
 
 import main
+from src.database.models import Role
+from src.services.auth import auth_service, TokenClaims
 
 
 client = TestClient(main.app)
@@ -14,3 +17,29 @@ def test_read_main():
     assert response.template.name == 'index.html'  # https://www.starlette.io/templates/
     assert "request" in response.context
 
+
+
+def test_fingerprinted_assets():
+    # the build runs on startup
+    main.static_assets.build()
+    response = client.get('/')
+    url = main.static_assets.url('css/bootstrap.min.css')
+    assert url.startswith('/assets/css/bootstrap.min.') and url in response.text
+    asset = client.get(url, headers={"Accept-Encoding": "br"})
+    assert asset.status_code == 200
+    assert asset.headers["content-encoding"] == "br"
+    assert "immutable" in asset.headers["cache-control"]
+
+
+@pytest.mark.parametrize("metrics", ["pool", "cache", "passwords"])
+def test_metrics_only_for_admin(metrics):
+    response = client.get(f'/api/healthchecker/{metrics}')
+    assert response.status_code == 401
+    for role, status_code in ((Role.user, 403), (Role.admin, 200)):
+        main.app.dependency_overrides[auth_service.get_token_claims] = lambda: TokenClaims(
+            email="admin@example.com", user_id=1, role=role, confirmed=True, version=0)
+        try:
+            response = client.get(f'/api/healthchecker/{metrics}')
+        finally:
+            del main.app.dependency_overrides[auth_service.get_token_claims]
+        assert response.status_code == status_code, response.text
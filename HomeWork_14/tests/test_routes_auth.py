@@ -1,27 +1,34 @@
 import asyncio
-from unittest.mock import MagicMock
 
+import pytest
+
+from main import app
 from src.conf import messages as msg
-from src.database.models import User
-from src.services.auth import auth_service
+from src.database.models import User, Role, EmailOutbox, MailKind
+from src.services.auth import auth_service, TokenClaims
+from src.services.mail_coalesce import mail_coalescer
+
+
+def outbox(session, email):
+    session.expire_all()
+    return [(row.kind, row.payload["username"]) for row in
+            session.query(EmailOutbox).filter(EmailOutbox.recipient == email).order_by(EmailOutbox.id)]
 
 
-def test_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def test_create_user(client, user, session):
     response = client.post("/api/auth/signup", json=user)
     assert response.status_code == 201, response.text
     payload = response.json()
     assert payload["detail"] == msg.USER_SUCCESSFULLY_CREATED
+    assert outbox(session, user["email"]) == [(MailKind.confirm_email, user["username"])]
 
 
-def test_repeat_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def test_repeat_create_user(client, user, session):
     response = client.post("/api/auth/signup", json=user)
     assert response.status_code == 409, response.text
     payload = response.json()
     assert payload["detail"] == msg.ACCOUNT_ALREADY_EXISTS
+    assert len(outbox(session, user["email"])) == 1
 
 
 def test_login_user_not_confirmed_email(client, user):
@@ -60,14 +67,54 @@ def test_login_user_with_wrong_email(client, user, session):
     assert payload["detail"] == msg.INVALID_EMAIL
 
 
-def test_refresh_token_true(client, session, user):
-    current_user: User = session.query(User).filter(User.email == user.get("email")).first()
-    old_refresh_token = current_user.refresh_token
+def test_refresh_token_true(client, user):
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    old_refresh_token = response.json()["refresh_token"]
     headers = {"Authorization": f"Bearer {old_refresh_token}"}
     response = client.get("/api/auth/refresh_token", headers=headers)
     assert response.status_code == 200, response.text
     payload = response.json()
     assert payload["token_type"] == "bearer"
+    assert payload["refresh_token"] != old_refresh_token
+
+
+def test_refresh_token_reuse_revokes_session(client, user):
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    old_refresh_token = response.json()["refresh_token"]
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {old_refresh_token}"})
+    new_refresh_token = response.json()["refresh_token"]
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {old_refresh_token}"})
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == msg.INVALID_REFRESH_TOKEN
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {new_refresh_token}"})
+    assert response.status_code == 401, response.text
+
+
+def test_logout_all(client, user):
+    tokens = [client.post("/api/auth/login",
+                          data={"username": user.get("email"), "password": user.get("password")}).json()
+              for _ in range(2)]
+    response = client.post("/api/auth/logout_all",
+                           headers={"Authorization": f"Bearer {tokens[0]['access_token']}"})
+    assert response.status_code == 200, response.text
+    for token in tokens:
+        response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {token['refresh_token']}"})
+        assert response.status_code == 401, response.text
+
+
+def test_access_token_claims_and_version(client, user, monkeypatch):
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    claims = asyncio.run(auth_service.get_token_claims(response.json()["access_token"]))
+    assert (claims.email, claims.role, claims.confirmed, claims.version) == (user.get("email"), Role.user, True, 0)
+    assert client.get("/api/users/me/", headers=headers).status_code == 200
+
+    async def bumped_version(user_id):
+        return 1
+
+    monkeypatch.setattr("src.services.user_cache.get_user_version", bumped_version)
+    response = client.get("/api/users/me/", headers=headers)
+    assert response.status_code == 401, response.text
 
 
 def test_refresh_token_invalid_email(client):
@@ -76,7 +123,7 @@ def test_refresh_token_invalid_email(client):
     response = client.get('/api/auth/refresh_token', headers=headers)
     assert response.status_code == 401, response.text
     payload = response.json()
-    assert payload["detail"] == msg.INVALID_USER
+    assert payload["detail"] == msg.INVALID_REFRESH_TOKEN
 
 
 def test_refresh_token_invalid_token(client, user):
@@ -88,18 +135,44 @@ def test_refresh_token_invalid_token(client, user):
     assert payload["detail"] == msg.INVALID_REFRESH_TOKEN
 
 
-def test_forgot_password(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def test_forgot_password(client, user, session):
     response = client.post("/api/auth/forgot_password", json={"email": user.get("email")})
     assert response.status_code == 200, response.text
     payload = response.json()
     assert payload["detail"] == msg.PASSWORD_RESET_SEND
+    assert outbox(session, user["email"])[-1] == (MailKind.reset_password, user["username"])
+
+
+def test_forgot_password_repeated(client, user, session, monkeypatch):
+    response = client.post("/api/auth/forgot_password", json={"email": user.get("email")})
+    assert response.status_code == 200, response.text
+    assert response.json()["detail"] == msg.PASSWORD_RESET_SEND
+    assert [kind for kind, _ in outbox(session, user["email"])].count(MailKind.reset_password) == 1
+    response = client.get("/api/healthchecker/mail")
+    assert response.status_code == 401, response.text
+    monkeypatch.setitem(app.dependency_overrides, auth_service.get_token_claims, lambda: TokenClaims(
+        email="admin@example.com", user_id=1, role=Role.admin, confirmed=True, version=0))
+    response = client.get("/api/healthchecker/mail")
+    assert response.status_code == 200, response.text
+    assert response.json()["suppressed"] == {"confirm_email": 0, "reset_password": 1}
+
+
+def test_forgot_password_not_queued(client, user, session, monkeypatch):
+    async def queue_email_failing(*args, **kwargs):
+        raise RuntimeError("The outbox is not available")
+
+    # the coalescing window of the previous requests ended
+    mail_coalescer.redis.data.clear()
+    monkeypatch.setattr("src.repository.outbox.queue_email", queue_email_failing)
+    with pytest.raises(RuntimeError):
+        client.post("/api/auth/forgot_password", json={"email": user.get("email")})
+    monkeypatch.undo()
+    response = client.post("/api/auth/forgot_password", json={"email": user.get("email")})
+    assert response.status_code == 200, response.text
+    assert [kind for kind, _ in outbox(session, user["email"])].count(MailKind.reset_password) == 2
 
 
-def test_forgot_password_invalid_email(client, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def test_forgot_password_invalid_email(client):
     response = client.post("/api/auth/forgot_password", json={"email": "invalid@email.com"})
     assert response.status_code == 401, response.text
     payload = response.json()
@@ -128,7 +201,7 @@ def test_change_password_put(client, user, session):
     payload = response.json()
     assert payload["detail"] == msg.PASSWORD_CHANGED
     current_user: User = session.query(User).filter(User.email == user.get("email")).first()
-    assert auth_service.verify_password("7654321", current_user.password) is True
+    assert asyncio.run(auth_service.verify_password("7654321", current_user.password)) is True
 
 
 def test_change_password_put_verification_error(client, user):
@@ -167,29 +240,25 @@ def test_confirmed_email_1(client, user, session):
     assert payload["detail"] == msg.EMAIL_CONFIRMED
 
 
-def test_request_email(client, user, session, monkeypatch):
+def test_request_email(client, user, session):
     current_user: User = session.query(User).filter(User.email == user.get("email")).first()
     current_user.confirmed = False
     session.commit()
 
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
-
     response = client.post("/api/auth/request_email", json={"email": user.get("email")})
     assert response.status_code == 200, response.text
     payload = response.json()
     assert payload["detail"] == msg.CHECK_YOUR_EMAIL
+    assert outbox(session, user["email"])[-1] == (MailKind.confirm_email, user["username"])
 
 
-def test_request_email_user_confirmed(client, user, session, monkeypatch):
+def test_request_email_user_confirmed(client, user, session):
     current_user: User = session.query(User).filter(User.email == user.get("email")).first()
     current_user.confirmed = True
     session.commit()
 
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
-
     response = client.post("/api/auth/request_email", json={"email": user.get("email")})
     assert response.status_code == 200, response.text
     payload = response.json()
     assert payload["message"] == msg.EMAIL_ALREADY_CONFIRMED
+    assert len(outbox(session, user["email"])) == 4
@@ -0,0 +1,306 @@
+import json
+from base64 import urlsafe_b64encode
+from datetime import date
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from main import app
+from src.database.models import Contact, Phone, Role
+from src.database.query_budget import QueryBudgetExceeded
+from src.repository.contacts import get_cnt_by_id, get_birth_list
+from src.routes.contacts import rate_limit_get
+from src.services.auth import auth_service, TokenClaims
+from src.services.rate_limit import Quota
+
+
+@pytest.fixture(scope="module")
+def admin_client(client):
+    app.dependency_overrides[auth_service.get_token_claims] = lambda: TokenClaims(
+        email="admin@example.com", user_id=1, role=Role.admin, confirmed=True, version=0)
+    yield client
+    del app.dependency_overrides[auth_service.get_token_claims]
+
+
+@pytest.fixture()
+def no_rate_limit(monkeypatch):
+    monkeypatch.setitem(rate_limit_get.quotas, Role.admin, Quota(10000, 5))
+
+
+@pytest.fixture(scope="module")
+def contact_id(session):
+    contact = Contact(first_name="Ben", last_name="Smith", email="ben@example.com", birthday=date(1968, 12, 1))
+    contact.phones = [Phone(phone_num="380984561245"), Phone(phone_num="380991112233")]
+    session.add(contact)
+    session.commit()
+    return contact.id
+
+
+def test_get_contact(admin_client, contact_id):
+    response = admin_client.get(f"/api/contacts/{contact_id}")
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert payload["first_name"] == "Ben"
+    assert sorted(phone["phone_num"] for phone in payload["phones"]) == ["380984561245", "380991112233"]
+    assert '"1 queries"' in response.headers["Server-Timing"]
+
+
+def test_get_contact_not_found(admin_client):
+    response = admin_client.get("/api/contacts/999")
+    assert response.status_code == 404, response.text
+
+
+def test_get_contact_over_budget(admin_client, contact_id, monkeypatch):
+    async def get_cnt_by_id_with_birthdays(cnt_id, db, **kwargs):
+        await get_birth_list(db)
+        return await get_cnt_by_id(cnt_id, db, **kwargs)
+
+    monkeypatch.setattr("src.repository.contacts.get_cnt_by_id", get_cnt_by_id_with_birthdays)
+    with pytest.raises(QueryBudgetExceeded):
+        admin_client.get(f"/api/contacts/{contact_id}")
+
+
+def test_delete_contact(admin_client, contact_id, session):
+    response = admin_client.delete(f"/api/contacts/{contact_id}")
+    assert response.status_code == 204, response.text
+    assert session.get(Contact, contact_id) is None
+    assert session.query(Phone).count() == 0
+
+
+def test_import_contacts_csv(admin_client, session):
+    body = "first_name,last_name,email,birthday,address,phones\n" \
+           "Ann,Lee,ann@example.com,1990-05-01,\"1, Main St\nKyiv\",\"0441112233; 380501112233\"\n" \
+           "Bad,,not-an-email,,,\n" \
+           "Bob,,bob@example.com,,,12345\n" \
+           "Ann,Twin,ann@example.com,,,\n" \
+           "Carl,,carl@example.com,,,380501112233\n"
+    response = admin_client.post("/api/contacts/import", content=body.encode(), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert payload["inserted"] == 2
+    assert payload["failed"] == 3
+    assert [error["row"] for error in payload["errors"]] == [2, 3, 4, 5]
+
+    ann = session.query(Contact).filter(Contact.email == "ann@example.com").one()
+    assert ann.address == "1, Main St\nKyiv"
+    assert sorted(phone.phone_num for phone in session.query(Phone).filter(Phone.contact_id == ann.id)) == \
+           ["380441112233", "380501112233"]
+
+
+def test_import_contacts_ndjson(admin_client, session):
+    body = '{"first_name": "Dan", "email": "dan@example.com", "phones": ["0931234567"]}\n' \
+           '{"first_name": "Ann", "email": "ann@example.com"}\n' \
+           'not json\n'
+    response = admin_client.post("/api/contacts/import", content=body.encode(),
+                                 headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert payload["inserted"] == 1
+    assert payload["failed"] == 2
+    assert session.query(Phone).filter(Phone.phone_num == "380931234567").count() == 1
+
+
+def test_import_contacts_invalid_rows(admin_client, session):
+    body = '{"first_name": "Eve", "email": "eve@example.com", "phones": 5}\n' \
+           '{"first_name": "%s", "email": "fay@example.com"}\n' \
+           '{"first_name": "Gus", "email": "%s@example.com"}\n' \
+           '{"first_name": "Hal", "email": "hal@example.com", "phones": "0931234568"}\n' % ("F" * 65, "g" * 60)
+    response = admin_client.post("/api/contacts/import", content=body.encode(),
+                                 headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert (payload["inserted"], payload["failed"]) == (1, 3)
+    assert [error["row"] for error in payload["errors"]] == [1, 2, 3]
+    assert session.query(Contact).filter(Contact.email == "hal@example.com").count() == 1
+
+
+def test_import_contacts_csv_unterminated_quote(admin_client, session, monkeypatch):
+    monkeypatch.setattr("src.services.contacts_io.MAX_RECORD_LINES", 3)
+    body = "first_name,email\n" \
+           "Ian,\"ian@example.com\n" \
+           "Joe,joe@example.com\n" \
+           "Kim,kim@example.com\n" \
+           "Lea,lea@example.com\n" \
+           "Max,\"max@example.com\n"
+    response = admin_client.post("/api/contacts/import", content=body.encode(), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert (payload["inserted"], payload["failed"]) == (3, 2)
+    assert payload["errors"] == [{"row": 1, "detail": "Unterminated quoted field."},
+                                 {"row": 5, "detail": "Unterminated quoted field."}]
+
+
+def test_import_contacts_rejected_row(admin_client, session, monkeypatch):
+    execute = AsyncSession.execute
+
+    async def execute_with_data_error(self, statement, params=None, *args, **kwargs):
+        # PostgreSQL refuses a value that does not fit its column, SQLite does not check the length
+        if isinstance(params, list) and any(row.get("email") == "nia@example.com" for row in params):
+            raise exc.DataError(str(statement), params, Exception("value too long for type character varying(64)"))
+        return await execute(self, statement, params, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncSession, "execute", execute_with_data_error)
+    body = "first_name,email\nNed,ned@example.com\nNia,nia@example.com\nNoa,noa@example.com\n"
+    response = admin_client.post("/api/contacts/import", content=body.encode(), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert (payload["inserted"], payload["failed"]) == (2, 1)
+    assert payload["errors"][0]["row"] == 2
+    assert payload["errors"][0]["detail"].startswith("Row rejected: value too long")
+    assert session.query(Contact).filter(Contact.email.in_(["ned@example.com", "noa@example.com"])).count() == 2
+
+
+def test_import_contacts_unsupported_type(admin_client):
+    response = admin_client.post("/api/contacts/import", json=[])
+    assert response.status_code == 415, response.text
+
+
+def test_export_contacts(admin_client, session):
+    response = admin_client.get("/api/contacts/export", params={"format": "csv"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "first_name,last_name,email,birthday,address,phones"
+    assert "Dan,,dan@example.com,,,380931234567" in lines
+
+    response = admin_client.get("/api/contacts/export", params={"format": "ndjson"})
+    assert response.status_code == 200, response.text
+    emails = [json.loads(line)["email"] for line in response.text.splitlines()]
+    assert len(emails) == session.query(Contact).count()
+    assert "dan@example.com" in emails
+
+    response = admin_client.get("/api/contacts/export", params={"format": "vcf"})
+    assert response.status_code == 200, response.text
+    assert response.text.count("BEGIN:VCARD") == len(emails)
+    assert "ADR:;;1\\, Main St\\nKyiv;;;;" in response.text
+
+
+class FakeDate(date):
+    today_ = None
+
+    @classmethod
+    def today(cls):
+        return cls.today_
+
+
+@pytest.fixture(scope="module")
+def birthdays(session):
+    birthdays = {"dec30@example.com": date(1980, 12, 30), "jan02@example.com": date(1985, 1, 2),
+                 "jan10@example.com": date(1970, 1, 10), "feb29@example.com": date(1992, 2, 29),
+                 "mar01@example.com": date(1990, 3, 1)}
+    session.add_all([Contact(first_name=email[:5], email=email, birthday=birthday)
+                     for email, birthday in birthdays.items()])
+    session.commit()
+    return birthdays
+
+
+@pytest.fixture()
+def upcoming(admin_client, birthdays, no_rate_limit, monkeypatch):
+    def upcoming_(today, days):
+        FakeDate.today_ = today
+        monkeypatch.setattr("src.repository.contacts.date", FakeDate)
+        response = admin_client.get("/api/contacts/", params={"filter_type": 4, "days": days})
+        assert response.status_code == 200, response.text
+        return [contact["email"] for contact in response.json()["items"] if contact["email"] in birthdays]
+
+    return upcoming_
+
+
+def test_birthdays_across_new_year(upcoming):
+    assert upcoming(date(2023, 12, 29), 7) == ["dec30@example.com", "jan02@example.com"]
+    assert upcoming(date(2023, 12, 31), 10) == ["jan02@example.com", "jan10@example.com"]
+
+
+def test_birthdays_february_29(upcoming):
+    # in a common year the window from February 27 to March 1 still holds February 29
+    assert upcoming(date(2023, 2, 27), 2) == ["feb29@example.com", "mar01@example.com"]
+    assert upcoming(date(2023, 2, 25), 3) == []
+    assert upcoming(date(2024, 2, 28), 1) == ["feb29@example.com"]
+    assert upcoming(date(2024, 2, 29), 1) == ["feb29@example.com", "mar01@example.com"]
+
+
+def test_birthdays_days_bounds(upcoming, admin_client):
+    assert upcoming(date(2023, 12, 30), 1) == ["dec30@example.com"]
+    assert upcoming(date(2023, 12, 27), 3) == ["dec30@example.com"]
+    assert upcoming(date(2023, 12, 27), 2) == []
+    assert upcoming(date(2023, 1, 1), 365) == ["jan02@example.com", "jan10@example.com", "feb29@example.com",
+                                               "mar01@example.com", "dec30@example.com"]
+    for days in (0, 366):
+        response = admin_client.get("/api/contacts/", params={"filter_type": 4, "days": days})
+        assert response.status_code == 422, response.text
+
+
+@pytest.fixture(scope="module")
+def many_contacts(session):
+    names = [("Amy", None), ("Amy", "Cole"), ("Amy", None), ("Zed", "Ray"), ("Bob", "Ann"), ("Amy", "Cole"),
+             ("bob", None), ("Cid", "Ox"), ("Bob", "Ann"), ("Amy", "Ade"), ("Eva", None), ("Cid", "Ox")]
+    session.add_all([Contact(first_name=first_name, last_name=last_name, email=f"page{number:02}@example.com")
+                     for number, (first_name, last_name) in enumerate(names)])
+    session.commit()
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("name", lambda cnt: (cnt.first_name, cnt.last_name or "", cnt.id)),
+    ("email", lambda cnt: cnt.email),
+    ("created", lambda cnt: cnt.id),
+])
+@pytest.mark.parametrize("descending", [False, True])
+def test_get_contacts_pages(admin_client, session, many_contacts, no_rate_limit, sort, key, descending):
+    expected = [cnt.email for cnt in sorted(session.query(Contact), key=key, reverse=descending)]
+    sort = f"-{sort}" if descending else sort
+    emails, cursor = [], None
+    while True:
+        response = admin_client.get("/api/contacts/", params={"sort": sort, "limit": 5, "cursor": cursor})
+        assert response.status_code == 200, response.text
+        payload = response.json()
+        assert len(payload["items"]) <= 5
+        emails += [contact["email"] for contact in payload["items"]]
+        cursor = payload["next_cursor"]
+        if cursor is None:
+            break
+    assert emails == expected
+
+
+def test_get_contacts_cursor_of_other_sort(admin_client, many_contacts, no_rate_limit):
+    response = admin_client.get("/api/contacts/", params={"sort": "name", "limit": 2})
+    cursor = response.json()["next_cursor"]
+    response = admin_client.get("/api/contacts/", params={"sort": "email", "cursor": cursor})
+    assert response.status_code == 400, response.text
+
+
+@pytest.mark.parametrize("values", [["name", {"a": 1}, "x", 1], ["created", {"x": [1]}], ["email", [1, 2]],
+                                    ["created", "1"], ["created", True], ["name", "Amy", None, 1], {"created": 1}, 5])
+def test_get_contacts_tampered_cursor(admin_client, no_rate_limit, values):
+    cursor = urlsafe_b64encode(json.dumps(values).encode()).decode()
+    sort = values[0] if isinstance(values, list) else "created"
+    response = admin_client.get("/api/contacts/", params={"sort": sort, "cursor": cursor})
+    assert response.status_code == 400, response.text
+
+
+@pytest.fixture(scope="module")
+def searched_contact(session):
+    contact = Contact(first_name="Quentin", last_name="Tarrant", email="qtar@example.com",
+                      address="12, Shevchenka Street, Lviv")
+    contact.phones = [Phone(phone_num="380671234567")]
+    session.add(contact)
+    session.commit()
+
+
+@pytest.mark.parametrize("q", ["quent", "TARRANT", "tin tar", "qtar@exa", "shevchenka", "671234567", "067-123-45"])
+def test_search_contacts(admin_client, searched_contact, no_rate_limit, q):
+    response = admin_client.get("/api/contacts/", params={"q": q})
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()["items"]] == ["qtar@example.com"]
+    assert response.json()["next_cursor"] is None
+
+
+def test_search_contacts_no_match(admin_client, searched_contact, no_rate_limit):
+    response = admin_client.get("/api/contacts/", params={"q": "quentinx"})
+    assert response.status_code == 200, response.text
+    assert response.json()["items"] == []
+
+
+def test_search_contacts_too_short(admin_client, no_rate_limit):
+    response = admin_client.get("/api/contacts/", params={"q": "qu"})
+    assert response.status_code == 422, response.text
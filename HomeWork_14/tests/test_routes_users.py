@@ -0,0 +1,78 @@
+from io import BytesIO
+from unittest.mock import AsyncMock
+
+import pytest
+from PIL import Image
+
+from main import app
+from src.conf import messages as msg
+from src.database.models import User, Role
+from src.services.auth import auth_service
+from src.services.avatar_storage import LocalStorage
+
+
+def image_bytes(size, fmt="PNG"):
+    output = BytesIO()
+    Image.new("RGB", size, "red").save(output, fmt)
+    return output.getvalue()
+
+
+@pytest.fixture()
+def avatar_user(client, monkeypatch):
+    current_user = User(id=1, username="Ben", email="ben@example.com", avatar="", roles=Role.user, confirmed=True)
+    app.dependency_overrides[auth_service.get_current_user] = lambda: current_user
+    upload = AsyncMock(return_value={"version": 1})
+    monkeypatch.setattr("src.services.avatar_storage.CloudImage.upload", upload)
+
+    async def update_avatar(email, url, db):
+        current_user.avatar = url
+        return current_user
+
+    monkeypatch.setattr("src.routes.users.repository_users.update_avatar", update_avatar)
+    yield upload
+    del app.dependency_overrides[auth_service.get_current_user]
+
+
+def test_avatar_is_resized_before_upload(client, avatar_user):
+    response = client.patch("/api/users/avatar", files={"file": ("big.png", image_bytes((1200, 800)), "image/png")})
+    assert response.status_code == 200, response.text
+    assert "w_250" in response.json()["avatar"]
+    image, public_id = avatar_user.await_args.args
+    with Image.open(BytesIO(image)) as uploaded:
+        assert (uploaded.format, uploaded.size) == ("JPEG", (250, 250))
+
+
+def test_avatar_too_large(client, avatar_user, monkeypatch):
+    monkeypatch.setattr("src.services.images.settings.avatar_max_bytes", 10_000)
+    body = image_bytes((2000, 2000), "BMP")
+    response = client.patch("/api/users/avatar", files={"file": ("big.bmp", body, "image/bmp")})
+    assert response.status_code == 413, response.text
+    assert response.json()["detail"] == msg.IMAGE_TOO_LARGE
+
+    def chunks():
+        # a chunked body has no content-length, it is cut off while it streams
+        yield b"--boundary\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.bmp\"\r\n\r\n"
+        for start in range(0, len(body), 4096):
+            yield body[start:start + 4096]
+        yield b"\r\n--boundary--\r\n"
+
+    response = client.patch("/api/users/avatar", content=chunks(),
+                            headers={"Content-Type": "multipart/form-data; boundary=boundary"})
+    assert response.status_code == 413, response.text
+    avatar_user.assert_not_awaited()
+
+
+def test_avatar_not_an_image(client, avatar_user):
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.png", b"not an image", "image/png")})
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == msg.INVALID_IMAGE
+    avatar_user.assert_not_awaited()
+
+
+def test_avatar_local_storage(client, avatar_user, monkeypatch, tmp_path):
+    monkeypatch.setattr("src.routes.users.avatar_storage", LocalStorage(tmp_path, "/avatars", [250, 64]))
+    response = client.patch("/api/users/avatar", files={"file": ("big.png", image_bytes((600, 400)), "image/png")})
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"].startswith("/avatars/") and response.json()["avatar"].endswith("/250.jpg")
+    assert len(list(tmp_path.glob("*/*/*.jpg"))) == 2
+    avatar_user.assert_not_awaited()
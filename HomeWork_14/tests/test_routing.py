@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.conf.config import settings
+from src.database.models import Base, Contact, Role
+from src.database.routing import RoutingSession, PRIMARY_COOKIE
+from src.services.auth import auth_service, TokenClaims
+
+
+@pytest.fixture()
+def sessions(tmp_path):
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}", poolclass=NullPool)
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}", poolclass=NullPool)
+
+    async def setup():
+        for engine, name in ((primary, "Primary"), (replica, "Replica")):
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(Contact.__table__.insert().values(first_name=name, email=f"{name}@example.com"))
+
+    asyncio.run(setup())
+    return async_sessionmaker(bind=primary, replica_bind=replica, sync_session_class=RoutingSession,
+                              expire_on_commit=False)
+
+
+async def first_names(db):
+    return (await db.execute(select(Contact.first_name).order_by(Contact.id))).scalars().all()
+
+
+def test_read_only_session_reads_replica(sessions):
+    async def run():
+        async with sessions(info={"read_only": True}) as db:
+            return await first_names(db)
+
+    assert asyncio.run(run()) == ["Replica"]
+
+
+def test_default_session_reads_primary(sessions):
+    async def run():
+        async with sessions() as db:
+            return await first_names(db)
+
+    assert asyncio.run(run()) == ["Primary"]
+
+
+def test_read_only_session_writes_primary(sessions):
+    async def run():
+        async with sessions(info={"read_only": True}) as db:
+            db.add(Contact(first_name="New", email="new@example.com"))
+            await db.commit()
+        async with sessions() as db:
+            return await first_names(db)
+
+    assert asyncio.run(run()) == ["Primary", "New"]
+
+
+def test_write_pins_client_to_primary(client, monkeypatch):
+    monkeypatch.setattr(settings, "replica_uri", "sqlite+aiosqlite:///./replica.db")
+    monkeypatch.setitem(app.dependency_overrides, auth_service.get_token_claims,
+                        lambda: TokenClaims(email="admin@example.com", user_id=1, role=Role.admin, confirmed=True,
+                                            version=0))
+
+    response = client.post("/api/contacts/import", content=b"first_name,email\n",
+                           headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    assert f"{PRIMARY_COOKIE}=1; Max-Age={settings.replica_pin_seconds}" in response.headers["set-cookie"]
+
+    response = client.post("/api/contacts/import", json=[])
+    assert response.status_code == 415, response.text
+    assert "set-cookie" not in response.headers
@@ -0,0 +1,73 @@
+import asyncio
+from io import BytesIO
+from unittest.mock import Mock
+
+import pytest
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from src.services.avatar_storage import LocalStorage, CloudinaryStorage, make_storage
+from src.services.static_files import IMMUTABLE
+
+
+def image_bytes(color, size=(400, 300)):
+    output = BytesIO()
+    Image.new("RGB", size, color).save(output, "PNG")
+    return output.getvalue()
+
+
+@pytest.fixture()
+def storage(tmp_path):
+    return LocalStorage(tmp_path, "/avatars/", [250, 128, 64])
+
+
+def test_variants_are_made_once_per_image(storage, monkeypatch):
+    red = image_bytes("red")
+    url = asyncio.run(storage.save(red, "ben@example.com"))
+    digest = storage.digest(red)
+    assert url == f"/avatars/{digest[:2]}/{digest}/250.jpg"
+    for size in (250, 128, 64):
+        with Image.open(storage.path(digest, size)) as variant:
+            assert variant.size == (size, size)
+
+    def resize_again(*args):
+        raise AssertionError("the image is stored already")
+
+    monkeypatch.setattr("src.services.avatar_storage.resize_variants", resize_again)
+    assert asyncio.run(storage.save(red, "ann@example.com")) == url
+    assert len(list(storage.root.rglob("*.jpg"))) == 3
+
+
+def test_missing_variants_are_made(storage):
+    red = image_bytes("red")
+    asyncio.run(storage.save(red, "ben@example.com"))
+    digest = storage.digest(red)
+    storage.path(digest, 64).unlink()
+    asyncio.run(storage.save(red, "ben@example.com"))
+    assert storage.path(digest, 64).exists()
+
+
+def test_variants_are_served_immutable(storage):
+    url = asyncio.run(storage.save(image_bytes("blue"), "ben@example.com"))
+    http = TestClient(Starlette(routes=[Mount("/avatars", app=storage.files())]))
+    response = http.get(url)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE
+    assert response.headers["content-type"] == "image/jpeg"
+    etag = response.headers["etag"]
+    assert etag == f'"{storage.digest(image_bytes("blue"))}-250.jpg"'
+    assert http.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert http.get(url.replace("250", "32")).status_code == 404
+
+
+def test_make_storage(monkeypatch):
+    configure = Mock()
+    monkeypatch.setattr("src.services.avatar_storage.CloudImage.configure", configure)
+    assert isinstance(make_storage("local"), LocalStorage)
+    configure.assert_not_called()
+    assert isinstance(make_storage("cloudinary"), CloudinaryStorage)
+    configure.assert_called_once_with()
+    with pytest.raises(ValueError):
+        make_storage("s3")
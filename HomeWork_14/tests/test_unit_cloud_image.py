@@ -0,0 +1,41 @@
+import unittest
+from unittest.mock import patch
+
+import httpx
+from fastapi import HTTPException
+
+from src.services.cloud_image import CloudImage
+
+
+class TestCloudImage(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.status = 200
+
+        def handler(request):
+            self.requests.append(request)
+            return httpx.Response(self.status, json={"version": 7})
+
+        self.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        patcher = patch.object(CloudImage, "http", self.http)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addAsyncCleanup(self.http.aclose)
+
+    async def test_signed_upload_over_the_shared_client(self):
+        for _ in range(2):
+            self.assertEqual(await CloudImage.upload(b"jpeg", "web9/ben"), {"version": 7})
+        request = self.requests[0]
+        self.assertEqual(request.method, "POST")
+        self.assertTrue(request.url.path.endswith("/image/upload"))
+        body = request.read()
+        for field in (b'name="public_id"', b"web9/ben", b'name="signature"', b'name="timestamp"', b"jpeg"):
+            self.assertIn(field, body)
+        self.assertEqual(len(self.requests), 2)
+
+    async def test_upload_error(self):
+        self.status = 500
+        with self.assertRaises(HTTPException) as err:
+            await CloudImage.upload(b"jpeg", "web9/ben")
+        self.assertEqual(err.exception.status_code, 502)
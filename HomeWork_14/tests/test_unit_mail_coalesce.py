@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from redis.exceptions import ConnectionError
+
+from conftest import FakeRedis
+from src.database.models import MailKind
+from src.services.mail_coalesce import MailCoalescer
+
+
+class TestMailCoalescer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.coalescer = MailCoalescer(FakeRedis(), window=60)
+
+    async def test_repeated_requests_reuse_the_pending_email(self):
+        claims = [await self.coalescer.claim(MailKind.confirm_email, "Ben@example.com") for _ in range(3)]
+        self.assertEqual(claims, [True, False, False])
+        self.assertTrue(await self.coalescer.claim(MailKind.reset_password, "ben@example.com"))
+        self.assertTrue(await self.coalescer.claim(MailKind.confirm_email, "ann@example.com"))
+        self.assertEqual(await self.coalescer.stats(), {"confirm_email": 2, "reset_password": 0})
+
+    async def test_window_ends(self):
+        await self.coalescer.claim(MailKind.confirm_email, "ben@example.com")
+        # the key expired
+        self.coalescer.redis.data.clear()
+        self.assertTrue(await self.coalescer.claim(MailKind.confirm_email, "ben@example.com"))
+
+    async def test_release(self):
+        await self.coalescer.claim(MailKind.confirm_email, "ben@example.com")
+        await self.coalescer.release(MailKind.confirm_email, "Ben@example.com")
+        self.assertTrue(await self.coalescer.claim(MailKind.confirm_email, "ben@example.com"))
+        self.assertEqual(await self.coalescer.stats(), {"confirm_email": 0, "reset_password": 0})
+
+    async def test_disabled(self):
+        self.coalescer.window = 0
+        self.assertEqual([await self.coalescer.claim(MailKind.confirm_email, "ben@example.com") for _ in range(2)],
+                         [True, True])
+
+    async def test_redis_unavailable(self):
+        redis = MagicMock()
+        redis.set = AsyncMock(side_effect=ConnectionError())
+        redis.mget = AsyncMock(side_effect=ConnectionError())
+        redis.delete = AsyncMock(side_effect=ConnectionError())
+        coalescer = MailCoalescer(redis, window=60)
+        self.assertTrue(await coalescer.claim(MailKind.confirm_email, "ben@example.com"))
+        await coalescer.release(MailKind.confirm_email, "ben@example.com")
+        self.assertEqual(await coalescer.stats(), {"confirm_email": None, "reset_password": None})
@@ -0,0 +1,154 @@
+import asyncio
+import socket
+import unittest
+from unittest.mock import patch
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+from aiosmtplib import SMTP
+
+from src.services.email import build_message, confirmation_email
+from src.services.mail_delivery import MailDelivery
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Handler:
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.replies = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.replies:
+            return self.replies.pop(0)
+        self.sessions.add(id(session))
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+class TestMailDelivery(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.handler = Handler()
+        self.port = free_port()
+        self.server = Controller(self.handler, hostname="127.0.0.1", port=self.port, authenticator=self.authenticate,
+                                 auth_require_tls=False)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    @staticmethod
+    def authenticate(server, session, envelope, mechanism, auth_data):
+        return AuthResult(success=auth_data.password == b"secret", handled=False)
+
+    async def delivery(self, **kwargs):
+        options = dict(workers=1, batch_size=20, max_retries=3, retry_delay=0.01, idle_timeout=5)
+        options.update(kwargs)
+        delivery = MailDelivery("127.0.0.1", options.pop("port", self.port), **options)
+        await delivery.start()
+        self.addAsyncCleanup(delivery.stop)
+        return delivery
+
+    @staticmethod
+    def message(number):
+        return build_message(f"user{number}@example.com", "Confirm your email", "email_template.html",
+                             {"host": "http://test/", "username": f"user{number}", "token": "token"})
+
+    async def test_batch_over_one_session(self):
+        delivery = await self.delivery()
+        results = [delivery.enqueue(self.message(number)) for number in range(10)]
+        self.assertEqual(await asyncio.gather(*results), [True] * 10)
+        self.assertEqual(len(self.handler.messages), 10)
+        self.assertEqual(len(self.handler.sessions), 1)
+        stats = delivery.stats()
+        self.assertEqual((stats["sent"], stats["failed"], stats["connections"], stats["batches"]), (10, 0, 1, 1))
+        self.assertGreater(stats["avg_latency_ms"], 0)
+        self.assertEqual(stats["queue"], 0)
+
+    async def test_workers_share_the_queue(self):
+        delivery = await self.delivery(workers=2, batch_size=5)
+        results = [delivery.enqueue(self.message(number)) for number in range(10)]
+        self.assertEqual(await asyncio.gather(*results), [True] * 10)
+        self.assertEqual(delivery.stats()["connections"], 2)
+        self.assertEqual(delivery.stats()["batches"], 2)
+
+    async def test_retry_temporary_error_on_new_connection(self):
+        self.handler.replies = ["451 Try again later", "421 Service not available"]
+        delivery = await self.delivery()
+        self.assertTrue(await delivery.send(self.message(1)))
+        stats = delivery.stats()
+        self.assertEqual((stats["sent"], stats["retries"], stats["connections"]), (1, 2, 3))
+
+    async def test_permanent_error_is_not_retried(self):
+        self.handler.replies = ["550 No such user"]
+        delivery = await self.delivery()
+        self.assertFalse(await delivery.send(self.message(1)))
+        self.assertTrue(await delivery.send(self.message(2)))
+        stats = delivery.stats()
+        self.assertEqual((stats["sent"], stats["failed"], stats["retries"]), (1, 1, 0))
+
+    async def test_unexpected_error_fails_only_its_message(self):
+        send_message = SMTP.send_message
+
+        async def send_or_fail(smtp, message, *args, **kwargs):
+            if message["To"] == "user1@example.com":
+                raise UnicodeEncodeError("ascii", "\u00fc", 0, 1, "ordinal not in range(128)")
+            return await send_message(smtp, message, *args, **kwargs)
+
+        delivery = await self.delivery()
+        with patch.object(SMTP, "send_message", send_or_fail):
+            results = [delivery.enqueue(self.message(number)) for number in range(3)]
+            self.assertEqual(await asyncio.wait_for(asyncio.gather(*results), 5), [True, False, True])
+        self.assertEqual((delivery.stats()["sent"], delivery.stats()["failed"]), (2, 1))
+        self.assertEqual(delivery.stats()["workers"], 1)
+
+    async def test_login(self):
+        delivery = await self.delivery(username="mailer", password="secret")
+        self.assertTrue(await delivery.send(self.message(1)))
+
+    async def test_failed_login_is_retried_and_closed(self):
+        close = SMTP.close
+        closed = []
+
+        def close_and_count(smtp):
+            closed.append(smtp)
+            close(smtp)
+
+        delivery = await self.delivery(username="mailer", password="wrong", max_retries=2)
+        with patch.object(SMTP, "close", close_and_count):
+            self.assertFalse(await delivery.send(self.message(1)))
+        stats = delivery.stats()
+        self.assertEqual((stats["failed"], stats["retries"], stats["connections"]), (1, 2, 0))
+        self.assertEqual(len(closed), 3)
+        self.assertFalse(any(smtp.is_connected for smtp in closed))
+
+    async def test_server_unavailable(self):
+        delivery = await self.delivery(port=free_port(), max_retries=2)
+        self.assertFalse(await delivery.send(self.message(1)))
+        self.assertEqual((delivery.stats()["failed"], delivery.stats()["retries"]), (1, 2))
+
+    async def test_idle_connection_is_closed(self):
+        delivery = await self.delivery(idle_timeout=0.05)
+        await delivery.send(self.message(1))
+        await asyncio.sleep(0.2)
+        await delivery.send(self.message(2))
+        self.assertEqual(len(self.handler.sessions), 2)
+
+    async def test_stop_sends_the_queue(self):
+        delivery = await self.delivery()
+        for number in range(3):
+            delivery.enqueue(self.message(number))
+        await delivery.stop()
+        self.assertEqual(len(self.handler.messages), 3)
+
+    async def test_confirmation_email(self):
+        delivery = await self.delivery()
+        self.assertTrue(await delivery.send(confirmation_email("ben@example.com", "ben", "http://test/")))
+        envelope = self.handler.messages[0]
+        self.assertEqual(envelope.rcpt_tos, ["ben@example.com"])
+        self.assertIn(b"ben", envelope.content)
+        self.assertIn(b"http://test/api/auth/confirmed_email/", envelope.content)
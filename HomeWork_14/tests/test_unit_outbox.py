@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import AsyncTestingSessionLocal
+from src.database.models import EmailOutbox, MailKind
+from src.repository import outbox as repository_outbox
+from src.services.outbox import OutboxWorker
+
+
+class FakeDelivery:
+    def __init__(self, refused=()):
+        self.refused = set(refused)
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+        return message["To"] not in self.refused
+
+
+@pytest.fixture()
+def outbox(session):
+    session.query(EmailOutbox).delete()
+    session.add_all([EmailOutbox(kind=MailKind.confirm_email, recipient=f"user{number}@example.com",
+                                 payload={"username": f"user{number}", "host": "http://test/"})
+                     for number in range(3)])
+    session.add(EmailOutbox(kind=MailKind.reset_password, recipient="ben@example.com",
+                            payload={"username": "ben", "host": "http://test/"}))
+    session.commit()
+    yield session
+    session.expire_all()
+
+
+def make_worker(delivery, **kwargs):
+    options = dict(batch_size=10, poll_interval=0.01, lease=300, max_attempts=2, retry_delay=60)
+    options.update(kwargs)
+    return OutboxWorker(AsyncTestingSessionLocal, delivery, **options)
+
+
+def test_claim_hides_the_rows_for_the_lease(outbox):
+    async def run():
+        async with AsyncTestingSessionLocal() as db:
+            first = await repository_outbox.claim_emails(3, 300, 5, db)
+            second = await repository_outbox.claim_emails(3, 300, 5, db)
+            third = await repository_outbox.claim_emails(3, 300, 5, db)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert [len(first), len(second), len(third)] == [3, 1, 0]
+    assert {email.id for email in first}.isdisjoint(email.id for email in second)
+    assert all(email.attempts == 1 and email.available_at > datetime.utcnow() + timedelta(seconds=290)
+               for email in first + second)
+
+
+def test_worker_sends_and_backs_off(outbox):
+    delivery = FakeDelivery(refused={"user1@example.com"})
+    worker = make_worker(delivery)
+    assert asyncio.run(worker.run_once()) == 4
+    assert asyncio.run(worker.run_once()) == 0
+
+    outbox.expire_all()
+    emails = {email.recipient: email for email in outbox.query(EmailOutbox)}
+    assert [email.sent_at is not None for email in emails.values()].count(True) == 3
+    failed = emails["user1@example.com"]
+    assert failed.sent_at is None and failed.attempts == 1
+    assert failed.available_at > datetime.utcnow() + timedelta(seconds=50)
+    reset = [message for message in delivery.messages if message["To"] == "ben@example.com"][0]
+    assert reset["Subject"] == "Forgot password."
+    assert "api/auth/change_password/" in reset.get_content()
+
+
+def test_gives_up_after_max_attempts(outbox):
+    delivery = FakeDelivery(refused={"user1@example.com"})
+    worker = make_worker(delivery, retry_delay=0)
+
+    async def run():
+        claimed = [await worker.run_once() for _ in range(3)]
+        async with AsyncTestingSessionLocal() as db:
+            return claimed, await repository_outbox.outbox_status(2, db)
+
+    claimed, status = asyncio.run(run())
+    assert claimed == [4, 1, 0]
+    assert (status["pending"], status["failed"]) == (0, 1)
+
+
+def test_worker_lease_expires(outbox):
+    async def run():
+        async with AsyncTestingSessionLocal() as db:
+            # a worker that died after its claim
+            await repository_outbox.claim_emails(10, 0, 5, db)
+        return await make_worker(FakeDelivery()).run_once()
+
+    assert asyncio.run(run()) == 4
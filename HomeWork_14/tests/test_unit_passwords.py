@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import unittest
+
+from src.services.passwords import PasswordHasher
+
+
+class TestPasswordHasher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.hasher = PasswordHasher(rounds=4, workers=1)
+        self.addCleanup(self.hasher.shutdown)
+
+    async def test_hash_and_verify_off_the_loop(self):
+        threads = []
+        original = self.hasher.context.hash
+        self.hasher.context.hash = lambda password: threads.append(threading.current_thread()) or original(password)
+        hashed = await self.hasher.hash("1234567")
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertTrue(await self.hasher.verify("1234567", hashed))
+        self.assertFalse(await self.hasher.verify("wrong", hashed))
+
+    async def test_rehash_when_cost_changes(self):
+        old_hash = await PasswordHasher(rounds=5, workers=1).hash("1234567")
+        valid, new_hash = await self.hasher.verify_and_update("1234567", old_hash)
+        self.assertTrue(valid)
+        self.assertIn("$04$", new_hash)
+        self.assertEqual(await self.hasher.verify_and_update("1234567", new_hash), (True, None))
+        self.assertEqual(await self.hasher.verify_and_update("wrong", old_hash), (False, None))
+
+    async def test_queue_depth(self):
+        hashed = await self.hasher.hash("1234567")
+        release = threading.Event()
+        blocker = asyncio.ensure_future(self.hasher._run(release.wait))
+        checks = [asyncio.ensure_future(self.hasher.verify("1234567", hashed)) for _ in range(3)]
+        while self.hasher.stats()["running"] == 0:
+            await asyncio.sleep(0.001)
+        self.assertEqual((self.hasher.stats()["running"], self.hasher.stats()["queued"]), (1, 3))
+        release.set()
+        await blocker
+        self.assertEqual(await asyncio.gather(*checks), [True] * 3)
+        stats = self.hasher.stats()
+        self.assertEqual((stats["submitted"], stats["completed"], stats["queued"], stats["running"]), (5, 5, 0, 0))
+        self.assertGreaterEqual(stats["max_queued"], 3)
+
+    async def test_cancelled_calls_leave_the_queue(self):
+        hashed = await self.hasher.hash("1234567")
+        release = threading.Event()
+        blocker = asyncio.ensure_future(self.hasher._run(release.wait))
+        checks = [asyncio.ensure_future(self.hasher.verify("1234567", hashed)) for _ in range(3)]
+        while self.hasher.stats()["running"] == 0:
+            await asyncio.sleep(0.001)
+        checks[0].cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(self.hasher.stats()["queued"], 2)
+        self.hasher.shutdown()
+        self.assertEqual(self.hasher.stats()["queued"], 0)
+        release.set()
+        await blocker
+        self.assertEqual(self.hasher.stats()["running"], 0)
+        for check in checks:
+            with self.assertRaises(asyncio.CancelledError):
+                await check
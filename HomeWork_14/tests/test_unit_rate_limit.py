@@ -0,0 +1,101 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.database.models import Role
+from src.services.auth import TokenClaims
+from src.services.rate_limit import Quota, TokenBucket, RateLimiter, RateLimit, parse_quotas
+
+
+def claims(user_id, role):
+    return TokenClaims(email=f"user{user_id}@example.com", user_id=user_id, role=role, confirmed=True, version=0)
+
+
+class TestRateLimit(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.pipe = self.redis.pipeline.return_value
+        self.pipe.execute = AsyncMock()
+        self.limiter = RateLimiter(self.redis, sync_interval=0.5, fail_open=True)
+        patcher = patch("src.services.rate_limit.rate_limiter", self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_quotas(self):
+        self.assertEqual(parse_quotas("admin:20/5, user:2/5"),
+                         {Role.admin: Quota(20, 5), Role.user: Quota(2, 5)})
+
+    def test_token_bucket_refills(self):
+        bucket = TokenBucket(Quota(2, 10), now=100)
+        self.assertEqual((bucket.take(100), bucket.take(100)), (0, 0))
+        self.assertAlmostEqual(bucket.take(100), 5)
+        self.assertAlmostEqual(bucket.take(104), 1)
+        self.assertEqual(bucket.take(105), 0)
+
+    async def test_sync_blocks_keys_over_the_global_quota(self):
+        quota = Quota(3, 10)
+        with patch("src.services.rate_limit.time", return_value=1005.0):
+            self.assertEqual([self.limiter.hit("a", quota), self.limiter.hit("b", quota)], [0, 0])
+            self.pipe.execute.return_value = [3, True, 1, True]
+            await self.limiter.sync()
+            self.assertEqual(self.limiter.hit("a", quota), 5)
+            self.assertEqual(self.limiter.hit("b", quota), 0)
+        self.pipe.incrby.assert_any_call("ratelimit:a:100", 1)
+        self.pipe.expireat.assert_any_call("ratelimit:a:100", 1010)
+        self.assertEqual(self.limiter.buckets["a"].blocked_until, 1010)
+
+    async def test_counts_are_batched(self):
+        quota = Quota(10, 10)
+        with patch("src.services.rate_limit.time", return_value=1005.0):
+            for _ in range(4):
+                self.limiter.hit("a", quota)
+            self.pipe.execute.return_value = [4, True]
+            await self.limiter.sync()
+            await self.limiter.sync()
+        self.pipe.incrby.assert_called_once_with("ratelimit:a:100", 4)
+        self.pipe.execute.assert_awaited_once()
+
+    async def test_keyed_by_user_with_role_quota(self):
+        limit = RateLimit("contacts:get", {Role.admin: Quota(2, 5), Role.user: Quota(1, 5)})
+        admin = claims(1, Role.admin)
+        await limit(admin)
+        await limit(admin)
+        await limit(claims(2, Role.user))
+        with self.assertRaises(HTTPException) as err:
+            await limit(admin)
+        self.assertEqual(err.exception.status_code, 429)
+        self.assertIn("Retry-After", err.exception.headers)
+        self.assertEqual(set(self.limiter.buckets), {"contacts:get:user:1", "contacts:get:user:2"})
+
+    async def test_redis_unavailable(self):
+        limit = RateLimit("contacts:get", {Role.user: Quota(5, 5)})
+        user = claims(2, Role.user)
+        await limit(user)
+        self.pipe.execute.side_effect = ConnectionError()
+        await self.limiter.sync()
+        self.assertFalse(self.limiter.redis_available)
+        await limit(user)
+        self.limiter.fail_open = False
+        with self.assertRaises(HTTPException) as err:
+            await limit(user)
+        self.assertEqual(err.exception.status_code, 503)
+
+    async def test_recovers_after_redis_outage_in_fail_closed_mode(self):
+        limit = RateLimit("contacts:get", {Role.user: Quota(5, 5)})
+        user = claims(2, Role.user)
+        self.limiter.fail_open = False
+        await limit(user)
+        self.pipe.execute.side_effect = ConnectionError()
+        await self.limiter.sync()
+        with self.assertRaises(HTTPException):
+            await limit(user)
+        self.redis.ping = AsyncMock(side_effect=ConnectionError())
+        await self.limiter.sync()
+        self.assertFalse(self.limiter.redis_available)
+        self.redis.ping = AsyncMock(return_value=True)
+        await self.limiter.sync()
+        self.assertTrue(self.limiter.redis_available)
+        await limit(user)
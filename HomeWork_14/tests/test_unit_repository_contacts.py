@@ -1,18 +1,21 @@
 import unittest
 from datetime import date
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Contact
-from src.schemas import ContactInput, PhoneOutput
+from src.repository.loaders import loader_options
+from src.schemas import ContactInput, PhoneOutput, ContactOutput, ContactInListOutput
 from src.repository.contacts import (
     get_cnt_by_id,
     get_cnt,
     create_cnt,
     update_cnt,
     delete_cnt_by_id,
-    get_birth_list
+    get_birth_list,
+    decode_cursor,
+    search_cnt
 )
 
 
@@ -41,46 +44,90 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
         cls.body = None
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.add = MagicMock()
+        self.result = MagicMock()
+        self.session.execute.return_value = self.result
 
     def tearDown(self):
         self.session = None
 
     async def test_get_birth_list_found(self):
-        self.session.query().filter().order_by().all.return_value = self.contacts
+        self.result.scalars().all.return_value = self.contacts
         result = await get_birth_list(db=self.session)
         self.assertEqual(result, self.contacts)
 
     async def test_get_birth_list_not_found(self):
-        self.session.query().filter().order_by().all.return_value = []
+        self.result.scalars().all.return_value = []
         result = await get_birth_list(db=self.session)
         self.assertEqual(result, [])
 
     async def test_get_cnt_by_id_found(self):
-        self.session.query().get.return_value = self.contact
+        self.session.get.return_value = self.contact
         result = await get_cnt_by_id(cnt_id=1, db=self.session)
         self.assertEqual(result, self.contact)
 
     async def test_get_cnt_by_id_not_found(self):
-        self.session.query().get.return_value = None
+        self.session.get.return_value = None
         result = await get_cnt_by_id(cnt_id=1, db=self.session)
         self.assertIsNone(result)
 
     async def test_get_cnt_found(self):
-        self.session.query().filter().order_by().all.return_value = self.contacts
-        self.session.query().order_by().all.return_value = self.contacts
+        self.result.scalars().all.return_value = self.contacts
 
         for f_type in range(0, 5):
-            result = await get_cnt(db=self.session, filter_type=f_type, filter_str="test")
+            result, next_cursor = await get_cnt(db=self.session, filter_type=f_type, filter_str="test")
             self.assertEqual(result, self.contacts)
+            self.assertIsNone(next_cursor)
 
     async def test_get_cnt_not_found(self):
-        self.session.query().filter().order_by().all.return_value = []
-        self.session.query().order_by().all.return_value = []
+        self.result.scalars().all.return_value = []
 
         for f_type in range(0, 5):
-            result = await get_cnt(db=self.session, filter_type=f_type, filter_str="test")
+            result, next_cursor = await get_cnt(db=self.session, filter_type=f_type, filter_str="test")
             self.assertEqual(result, [])
+            self.assertIsNone(next_cursor)
+
+    async def test_get_cnt_next_page(self):
+        contacts = [Contact(id=i, first_name="Ben", last_name=None, email=f"{i}@example.com") for i in range(1, 4)]
+        self.result.scalars().all.return_value = contacts
+
+        result, next_cursor = await get_cnt(db=self.session, limit=2)
+        self.assertEqual(result, contacts[:2])
+        self.assertEqual(decode_cursor("name", next_cursor), ("Ben", "", 2))
+
+        result, next_cursor = await get_cnt(db=self.session, limit=2, sort="-email")
+        self.assertEqual(decode_cursor("-email", next_cursor), ("2@example.com",))
+
+    async def test_get_cnt_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await get_cnt(db=self.session, cursor="not a cursor")
+
+        self.result.scalars().all.return_value = [Contact(id=1), Contact(id=2)]
+        _, next_cursor = await get_cnt(db=self.session, limit=1, sort="created")
+        with self.assertRaises(ValueError):
+            await get_cnt(db=self.session, cursor=next_cursor, sort="name")
+
+    async def test_search_cnt_found(self):
+        self.result.scalars().all.return_value = self.contacts
+        for dialect in ("postgresql", "sqlite"):
+            self.session.get_bind = MagicMock()
+            self.session.get_bind().dialect.name = dialect
+            result = await search_cnt(db=self.session, q="097 111")
+            self.assertEqual(result, self.contacts)
+
+    async def test_search_cnt_not_found(self):
+        self.result.scalars().all.return_value = []
+        self.session.get_bind = MagicMock()
+        result = await search_cnt(db=self.session, q="test")
+        self.assertEqual(result, [])
+
+    def test_loader_options(self):
+        self.assertEqual(loader_options(Contact, ContactInListOutput), [])
+        [option] = loader_options(Contact, ContactOutput)
+        self.assertEqual(option.context[0].strategy, (("lazy", "joined"),))
+        [option] = loader_options(Contact, ContactOutput, many=True)
+        self.assertEqual(option.context[0].strategy, (("lazy", "selectin"),))
 
     async def test_create_cnt(self):
         result = await create_cnt(body=self.body, db=self.session)
@@ -90,25 +137,34 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
         self.assertTrue(hasattr(result, 'id'))
 
     async def test_update_cnt_found(self):
-        self.session.query().get.return_value = self.contact
+        self.session.get.return_value = self.contact
+        self.result.all.return_value = [("380984561245", 1), ("380501112233", 2)]
         result = await update_cnt(cnt_id=1, body=self.body, db=self.session)
 
         [self.assertEqual(result.__dict__[item],
                           self.body.__dict__[item]) for item in self.body.__dict__ if item != "phones"]
-        self.assertEqual(result.phones[0].phone_num, "380984561245")
+        _, delete_call, insert_call = self.session.execute.await_args_list
+        self.assertEqual(delete_call.args[0].whereclause.right.value, [2])
+        self.assertEqual(insert_call.args[1], [{"contact_id": 1, "phone_num": "380991112233"}])
+
+    async def test_update_cnt_phones_untouched(self):
+        self.session.get.return_value = self.contact
+        body = self.body.copy(update={"phones": None})
+        await update_cnt(cnt_id=1, body=body, db=self.session)
+        self.session.execute.assert_not_awaited()
 
     async def test_update_cnt_not_found(self):
-        self.session.query().get.return_value = None
+        self.session.get.return_value = None
         result = await update_cnt(cnt_id=1, body=self.body, db=self.session)
         self.assertIsNone(result)
 
     async def test_delete_cnt_by_id_found(self):
-        self.session.query().get.return_value = self.contact
+        self.session.get.return_value = self.contact
         result = await delete_cnt_by_id(cnt_id=1, db=self.session)
         self.assertEqual(result, self.contact)
 
     async def test_delete_cnt_by_id_not_found(self):
-        self.session.query().get.return_value = None
+        self.session.get.return_value = None
         result = await delete_cnt_by_id(cnt_id=1, db=self.session)
         self.assertIsNone(result)
 
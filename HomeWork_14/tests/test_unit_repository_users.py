@@ -1,16 +1,16 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock, patch
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import User
+from src.database.models import User, Role
 from src.schemas import UserInput
 from src.repository.users import (
     get_user_by_email,
     create_user,
-    update_token,
     confirmed_email,
     change_password,
+    change_role,
     update_avatar
 )
 
@@ -37,15 +37,21 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
         cls.body = None
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.add = MagicMock()
+        self.result = MagicMock()
+        self.session.execute.return_value = self.result
+        patcher = patch("src.repository.users.user_cache", AsyncMock())
+        self.user_cache = patcher.start()
+        self.addCleanup(patcher.stop)
 
     async def test_get_user_by_email_found(self):
-        self.session.query().filter_by().first.return_value = self.user
+        self.result.scalars().first.return_value = self.user
         result = await get_user_by_email(email=self.email, db=self.session)
         self.assertEqual(result, self.user)
 
     async def test_get_user_by_email_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.result.scalars().first.return_value = None
         result = await get_user_by_email(email=self.email, db=self.session)
         self.assertIsNone(result)
 
@@ -55,28 +61,32 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
                           self.body.__dict__[item]) for item in self.body.__dict__]
         self.assertTrue(hasattr(result, 'id'))
 
-    async def test_update_token(self):
-        u_user = User(refresh_token="old_token")
-        await update_token(user=u_user, refresh_token="new_token", db=self.session)
-        self.assertEqual(u_user.refresh_token, "new_token")
-
     async def test_confirmed_email(self):
         u_user = User(confirmed=False)
-        self.session.query().filter_by().first.return_value = u_user
+        self.result.scalars().first.return_value = u_user
         await confirmed_email(email=self.email, db=self.session)
         self.assertEqual(u_user.confirmed, True)
+        self.user_cache.cache_user.assert_awaited_once_with(u_user)
 
     async def test_change_password(self):
         u_user = User(password="old_password")
         new_password = "new_password"
-        self.session.query().filter_by().first.return_value = u_user
+        self.result.scalars().first.return_value = u_user
         await change_password(user=u_user, password=new_password, db=self.session)
         self.assertEqual(u_user.password, new_password)
+        self.user_cache.invalidate_user.assert_awaited_once_with(u_user.email)
+
+    async def test_change_role(self):
+        u_user = User(id=3, roles=Role.user)
+        await change_role(user=u_user, role=Role.moderator, db=self.session)
+        self.assertEqual(u_user.roles, Role.moderator)
+        self.user_cache.bump_user_version.assert_awaited_once_with(3)
 
     async def test_update_avatar(self):
         u_user = User(avatar=None)
         image_url = "image_url"
-        self.session.query().filter_by().first.return_value = u_user
+        self.result.scalars().first.return_value = u_user
         await update_avatar(email=self.email, url=image_url, db=self.session)
         self.assertEqual(u_user.avatar, image_url)
+        self.user_cache.cache_user.assert_awaited_once_with(u_user)
 
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import AsyncMock
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from conftest import FakeRedis
+from src.services.sessions import SessionStore
+
+
+class TestSessionStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.store = SessionStore(self.redis, ttl=60)
+
+    async def test_rotate(self):
+        jti, family = await self.store.create("ben@example.com")
+        new_jti = await self.store.rotate("ben@example.com", jti, family)
+        self.assertNotIn(new_jti, (None, jti))
+        self.assertIsNone(self.redis.data.get(f"session:{jti}"))
+        self.assertEqual(self.redis.data[f"session_family:{family}"], new_jti.encode())
+
+    async def test_reuse_revokes_family(self):
+        jti, family = await self.store.create("ben@example.com")
+        new_jti = await self.store.rotate("ben@example.com", jti, family)
+        self.assertIsNone(await self.store.rotate("ben@example.com", jti, family))
+        self.assertIsNone(await self.store.rotate("ben@example.com", new_jti, family))
+
+    async def test_many_sessions_and_revoke_all(self):
+        first = await self.store.create("ben@example.com")
+        second = await self.store.create("ben@example.com")
+        other = await self.store.create("ann@example.com")
+        await self.store.revoke_all("ben@example.com")
+        self.assertIsNone(await self.store.rotate("ben@example.com", *first))
+        self.assertIsNone(await self.store.rotate("ben@example.com", *second))
+        self.assertIsNotNone(await self.store.rotate("ann@example.com", *other))
+
+    async def test_redis_error(self):
+        self.store.redis = AsyncMock()
+        self.store.redis.delete.side_effect = ConnectionError()
+        with self.assertRaises(HTTPException) as err:
+            await self.store.rotate("ben@example.com", "jti", "family")
+        self.assertEqual(err.exception.status_code, 503)
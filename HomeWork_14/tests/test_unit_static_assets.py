@@ -0,0 +1,81 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from src.services.static_assets import StaticAssets
+from src.services.static_files import IMMUTABLE
+
+CSS = b"body { color: red; }\n" * 200
+
+
+@pytest.fixture()
+def assets(tmp_path):
+    source = tmp_path / "static"
+    (source / "css").mkdir(parents=True)
+    (source / "css" / "site.min.css").write_bytes(CSS)
+    (source / "img.png").write_bytes(b"\x89PNG" + bytes(range(256)))
+    return StaticAssets(source, tmp_path / "build", url_prefix="/assets", fallback_prefix="/static")
+
+
+def test_fingerprint():
+    assert StaticAssets.fingerprint("css/site.min.css", b"a") == "css/site.min.ca978112ca1b.css"
+    assert StaticAssets.fingerprint("LICENSE", b"a") == "LICENSE.ca978112ca1b"
+
+
+def test_build_is_incremental(assets):
+    assert assets.url("css/site.min.css") == "/static/css/site.min.css"
+    manifest = assets.build()
+    built = assets.target / manifest["css/site.min.css"]
+    assert {path.name for path in built.parent.iterdir()} == {built.name, built.name + ".gz", built.name + ".br"}
+    assert not (assets.target / (manifest["img.png"] + ".gz")).exists()
+    assert assets.url("/css/site.min.css") == f"/assets/{manifest['css/site.min.css']}"
+
+    mtime = built.stat().st_mtime_ns
+    assets.build()
+    assert built.stat().st_mtime_ns == mtime
+    (assets.source / "css" / "site.min.css").write_bytes(CSS + b"a { }")
+    assert assets.build()["css/site.min.css"] != manifest["css/site.min.css"]
+
+
+def test_serves_the_precompressed_file(assets):
+    assets.build()
+    url = assets.url("css/site.min.css")
+    http = TestClient(Starlette(routes=[Mount("/assets", app=assets.files())]))
+
+    response = http.get(url, headers={"Accept-Encoding": "gzip, deflate, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.headers["cache-control"] == IMMUTABLE
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(CSS) // 10
+    assert response.content == CSS
+    assert http.get(url, headers={"Accept-Encoding": "br", "If-None-Match": response.headers["etag"]}) \
+        .status_code == 304
+
+    response = http.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == CSS
+
+    response = http.get(url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == CSS
+    assert response.headers["cache-control"] == IMMUTABLE
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("gzip;q=0.5, br;q=0.5", "br"),
+    ("*", "br"),
+    ("*;q=0.1, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("*;q=0", None),
+    ("br;q=x", None),
+])
+def test_respects_the_quality_of_encodings(assets, accept_encoding, encoding):
+    assets.build()
+    http = TestClient(Starlette(routes=[Mount("/assets", app=assets.files())]))
+    response = http.get(assets.url("css/site.min.css"), headers={"Accept-Encoding": accept_encoding})
+    assert response.headers.get("content-encoding") == encoding
+    assert response.content == CSS
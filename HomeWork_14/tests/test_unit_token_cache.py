@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+
+from jose import jwt
+
+from src.services.auth import auth_service
+from src.services.token_cache import TokenCache
+
+
+class TestTokenCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        patcher = patch("src.services.auth.access_tokens", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.services.user_cache.get_user_version", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bounds_and_expiry(self):
+        with patch("src.services.token_cache.time", return_value=100):
+            self.cache.set("a", 200, "claims a")
+            self.cache.set("b", 200, "claims b")
+            self.cache.get("a")
+            self.cache.set("c", 200, "claims c")
+            self.assertIsNone(self.cache.get("b"))
+            self.assertEqual(self.cache.get("a"), "claims a")
+            self.cache.set("d", 100, "claims d")
+        self.assertIsNone(self.cache.get("d"))
+        self.assertEqual(self.cache.stats(), {"size": 1, "maxsize": 2, "hits": 2, "misses": 2, "evictions": 3})
+
+    async def test_verified_token_is_decoded_once(self):
+        token = await auth_service.create_access_token(data={"sub": "ben@example.com", "uid": 7, "role": "user",
+                                                             "confirmed": True, "ver": 0})
+        with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode:
+            first = await auth_service.get_token_claims(token)
+            second = await auth_service.get_token_claims(token)
+        self.assertIs(first, second)
+        decode.assert_called_once()
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    async def test_invalid_token_is_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                await auth_service.get_token_claims("not a token")
+        self.assertEqual(self.cache.stats()["size"], 0)
@@ -0,0 +1,113 @@
+import pickle
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.database.models import User, Role
+from src.services.user_cache import (
+    pack_user,
+    unpack_user,
+    get_cached_user,
+    cache_user,
+    invalidate_user,
+    get_user_version,
+    bump_user_version,
+    handle_invalidation,
+    LocalCache,
+    USER_CACHE_TTL,
+    WORKER_ID,
+)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.user = User(id=7, username="Ben", email="ben@example.com", password="hash",
+                         avatar="https://example.com/ben.png", roles=Role.moderator, confirmed=True)
+        patcher = patch("src.services.user_cache.redis_db", AsyncMock())
+        self.redis = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.services.user_cache.local_users", LocalCache(maxsize=2, ttl=30))
+        self.local = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.services.user_cache.local_versions", LocalCache(maxsize=2, ttl=30))
+        self.local_versions = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip(self):
+        data = pack_user(self.user)
+        self.assertNotIn(b"hash", data)
+        user = unpack_user(data)
+        for field in ("id", "username", "email", "avatar", "roles", "confirmed"):
+            self.assertEqual(getattr(user, field), getattr(self.user, field))
+        self.assertIsNone(user.password)
+
+    def test_other_version_is_a_miss(self):
+        self.assertIsNone(unpack_user(pickle.dumps({"email": "ben@example.com"})))
+        self.assertIsNone(unpack_user(b"\x02" + pack_user(self.user)[1:]))
+
+    async def test_cache_user_sets_with_expiry(self):
+        await cache_user(self.user)
+        self.redis.set.assert_awaited_once_with("user:ben@example.com", pack_user(self.user), ex=USER_CACHE_TTL)
+        self.redis.expire.assert_not_called()
+
+    async def test_redis_error_is_a_miss(self):
+        self.redis.get.side_effect = ConnectionError()
+        self.assertIsNone(await get_cached_user("ben@example.com"))
+
+    async def test_local_hit_skips_redis(self):
+        self.redis.get.return_value = pack_user(self.user)
+        await get_cached_user("ben@example.com")
+        user = await get_cached_user("ben@example.com")
+        self.assertEqual(user.id, 7)
+        self.redis.get.assert_awaited_once()
+        self.assertEqual((self.local.hits, self.local.misses), (1, 1))
+
+    async def test_invalidate_user_publishes(self):
+        await cache_user(self.user)
+        await invalidate_user("ben@example.com")
+        self.assertEqual(self.local.stats()["size"], 0)
+        self.redis.publish.assert_awaited_with("user_cache:invalidate", f"{WORKER_ID}:user:ben@example.com")
+
+    async def test_user_version_is_cached_locally(self):
+        self.redis.get.return_value = None
+        self.assertEqual(await get_user_version(7), 0)
+        self.assertEqual(await get_user_version(7), 0)
+        self.redis.get.assert_awaited_once_with("user_version:7")
+        await bump_user_version(7)
+        self.redis.incr.assert_awaited_once_with("user_version:7")
+        self.redis.publish.assert_awaited_with("user_cache:invalidate", f"{WORKER_ID}:user_version:7")
+        self.redis.get.return_value = b"1"
+        self.assertEqual(await get_user_version(7), 1)
+
+    async def test_user_version_redis_unavailable(self):
+        self.redis.get.return_value = b"2"
+        self.assertEqual(await get_user_version(7), 2)
+        self.redis.get.side_effect = ConnectionError()
+        # the version known to the worker is still used
+        self.assertEqual(await get_user_version(7), 2)
+        with self.assertRaises(HTTPException) as err:
+            await get_user_version(8)
+        self.assertEqual(err.exception.status_code, 503)
+
+    def test_handle_invalidation_from_other_worker(self):
+        self.local.set("user:ben@example.com", b"data")
+        handle_invalidation(f"{WORKER_ID}:user:ben@example.com".encode())
+        self.assertEqual(self.local.stats()["size"], 1)
+        handle_invalidation(b"other:user:ben@example.com")
+        self.assertEqual(self.local.stats()["size"], 0)
+        self.assertEqual(self.local.invalidations, 1)
+
+    def test_local_cache_bounds(self):
+        self.local.set("a", b"1")
+        self.local.set("b", b"2")
+        self.local.get("a")
+        self.local.set("c", b"3")
+        self.assertIsNone(self.local.get("b"))
+        self.assertEqual(self.local.get("a"), b"1")
+        self.local.ttl = -1
+        self.local.set("d", b"4")
+        self.assertIsNone(self.local.get("d"))
+        self.assertEqual(self.local.evictions, 3)